@@ -0,0 +1,147 @@
+#! /usr/bin/env python
+#
+# Copyright (C) 2017 CERN for the benefit of the ATLAS collaboration
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+## Scaling benchmark of adding the license to a package's files with svnpull's
+#  LicensePool (--workers), for synthetic packages of several sizes. The licensed
+#  files are checked to be identical for every number of workers, including the
+#  symlinks among them (which get a license only if their target had none).
+
+import argparse
+import hashlib
+import imp
+import os
+import os.path
+import random
+import shutil
+import tempfile
+import time
+
+pythondir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "python")
+sharedir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "share", "svnpull")
+svnpull = imp.load_source("svnpull", os.path.join(pythondir, "svnpull.py"))
+
+
+def make_package(path, files, mean_size, seed=42):
+    ## @brief Write a synthetic package of C++ and python files, some of them starting
+    #  with a -*- C++ -*- line or a #! line, with sizes spread around the mean; one in
+    #  twenty is a symlink to an earlier file, in the same directory or another one
+    rng = random.Random(seed)
+    written = []
+    for i in range(files):
+        extension = rng.choice(["cxx", "cxx", "h", "icc", "py", "cmake"])
+        subdir = {"cxx": "src", "icc": "src", "h": "Package", "py": "python", "cmake": "cmake"}[extension]
+        filename = os.path.join(path, subdir, "file{0}.{1}".format(i, extension))
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        if written and rng.random() < 0.05:
+            target = rng.choice(written)
+            os.symlink(os.path.relpath(target, os.path.dirname(filename)), filename)
+            continue
+        written.append(filename)
+        if extension == "py":
+            first_line = "#! /usr/bin/env python\n" if rng.random() < 0.3 else "import os\n"
+            line = "print 'line {0}'\n"
+        else:
+            first_line = "// -*- C++ -*-\n" if rng.random() < 0.3 else "#include <vector>\n"
+            line = "int value{0} = {0};\n"
+        size = int(rng.expovariate(1.0 / mean_size))
+        body = []
+        length = len(first_line)
+        while length < size:
+            body.append(line.format(len(body)))
+            length += len(body[-1])
+        with open(filename, "w") as fh:
+            fh.write(first_line + "".join(body))
+
+
+def tree_digest(path):
+    ## @brief Digest of the names and contents of all files in a tree
+    digest = hashlib.sha1()
+    for root, dirs, filenames in sorted(os.walk(path)):
+        dirs.sort()
+        for name in sorted(filenames):
+            filename = os.path.join(root, name)
+            digest.update(os.path.relpath(filename, path) + "\0")
+            if os.path.islink(filename):
+                digest.update("link\0" + os.readlink(filename))
+                continue
+            with open(filename) as fh:
+                digest.update(fh.read())
+    return digest.hexdigest()
+
+
+def bench(package, scratch, workers, license_text, license_filter, min_files):
+    ## @brief License a fresh copy of a package with a number of workers
+    #  @return Tuple of wall time and digest of the licensed package
+    shutil.rmtree(scratch, ignore_errors=True)
+    shutil.copytree(package, os.path.join(scratch, "Package"), symlinks=True)
+    svnpull.license_pool.setup(workers, license_text, min_batch=min_files)
+    try:
+        start = time.time()
+        svnpull.process_svn_tree(os.path.join(scratch, "Package"), scratch, license_text=license_text,
+                                 license_filter=license_filter)
+        wall = time.time() - start
+    finally:
+        svnpull.license_pool.close()
+    return wall, tree_digest(scratch)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark svnpull license injection with a process pool")
+    parser.add_argument("--files", default="100,1000,5000",
+                        help="Comma separated numbers of files in the packages (default %(default)s)")
+    parser.add_argument("--workers", default="1,2,4,8",
+                        help="Comma separated numbers of worker processes (default %(default)s)")
+    parser.add_argument("--min-files", type=int, default=svnpull.LicensePool.min_batch,
+                        help="Smallest number of files to license that the workers are used for, as "
+                        "svnpull's --workers-min-files (default %(default)s; 0 always uses the workers)")
+    parser.add_argument("--mean-size", type=int, default=20000,
+                        help="Mean file size in bytes (default %(default)s)")
+    parser.add_argument("--workdir", help="Directory to work in (default, a temporary directory that is removed)")
+    args = parser.parse_args()
+
+    with open(os.path.join(sharedir, "cerncopy.txt")) as lfh:
+        license_text = [ line.rstrip() for line in lfh.readlines() ]
+    license_filter = svnpull.PathFilter(*svnpull.load_exceptions_file(os.path.join(sharedir,
+                                                                                   "atlaslicense-exceptions.txt")))
+    workdir = args.workdir if args.workdir else tempfile.mkdtemp(prefix="svnpull-bench-license-")
+    mismatches = 0
+    try:
+        print "{0:>7s} {1:>8s} {2:>9s} {3:>9s} {4:>8s}".format("Files", "Workers", "Wall (s)", "Files/s", "Speedup")
+        for files in [ int(n) for n in args.files.split(",") ]:
+            package = os.path.join(workdir, "package-{0}".format(files))
+            if not os.path.isdir(package):
+                make_package(package, files, args.mean_size)
+            serial_wall = reference = None
+            for workers in [ int(n) for n in args.workers.split(",") ]:
+                wall, digest = bench(package, os.path.join(workdir, "scratch"), workers, license_text, license_filter,
+                                     args.min_files)
+                if reference is None:
+                    serial_wall, reference = wall, digest
+                elif digest != reference:
+                    mismatches += 1
+                    print "  licensed files differ with {0} workers".format(workers)
+                print "{0:7d} {1:8d} {2:9.3f} {3:9.0f} {4:7.2f}x".format(files, workers, wall, files / wall,
+                                                                         serial_wall / wall)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    if mismatches:
+        raise SystemExit("Licensed files differ between numbers of workers")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+#! /usr/bin/env python
+#
+# Copyright (C) 2017 CERN for the benefit of the ATLAS collaboration
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+## Micro-benchmark of svnpull's compiled PathFilter against the original
+#  loop of one re.match per exception pattern, using the real ATLAS
+#  exceptions files. The decisions of both are checked to be identical.
+
+import argparse
+import imp
+import os
+import os.path
+import random
+import re
+import time
+
+pythondir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "python")
+sharedir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "share", "svnpull")
+svnpull = imp.load_source("svnpull", os.path.join(pythondir, "svnpull.py"))
+
+
+def loop_match(path, path_accept, path_reject):
+    ## @brief Original decision logic: accept patterns first, then reject patterns
+    for rule in path_accept:
+        if re.match(rule, path):
+            return True, rule
+    for rule in path_reject:
+        if re.match(rule, path):
+            return False, rule
+    return None, None
+
+
+def make_paths(path_accept, path_reject, count, seed=42):
+    ## @brief Generate test paths; some built from the patterns themselves
+    #  (so that rules do fire), the rest random athena-like paths
+    rng = random.Random(seed)
+    words = ["Event", "xAOD", "xAODMuon", "Trigger", "TrigT1", "Control", "AthenaKernel",
+             "src", "python", "share", "data", "doc", "test", "components", "cmt", "Root"]
+    extensions = ["cxx", "h", "py", "icc", "txt", "xml", "root", "dat", "cmake", "sh"]
+    globs = [ rule.pattern for rule in path_accept + path_reject ]
+    paths = []
+    for i in range(count):
+        if i % 4 == 0 and globs:
+            # Turn a regexp for a glob back into a matching-ish path
+            body = svnpull.glob_regexp_body(rng.choice(globs))
+            body = body.replace(".*", "/".join(rng.sample(words, 2))).replace("\\", "")
+            paths.append(re.sub(r"[^\w/.-]", "x", body))
+        else:
+            paths.append("/".join(rng.sample(words, rng.randint(2, 6))) +
+                         "/file{0}.{1}".format(i, rng.choice(extensions)))
+    return paths
+
+
+def bench(label, path_accept, path_reject, paths):
+    path_filter = svnpull.PathFilter(path_accept, path_reject)
+    start = time.time()
+    reference = [ loop_match(path, path_accept, path_reject) for path in paths ]
+    loop_time = time.time() - start
+    start = time.time()
+    compiled = [ path_filter.match(path) for path in paths ]
+    filter_time = time.time() - start
+    mismatches = sum(1 for a, b in zip(reference, compiled) if a != b)
+    decided = sum(1 for decision, rule in reference if decision is not None)
+    print "{0}: {1} rules, {2} paths ({3} decided by a rule)".format(label, len(path_filter.rules), len(paths), decided)
+    print "  re.match loop: {0:.3f}s ({1:.1f} us/path)".format(loop_time, 1e6 * loop_time / len(paths))
+    print "  PathFilter:    {0:.3f}s ({1:.1f} us/path), speedup x{2:.1f}".format(filter_time, 1e6 * filter_time / len(paths),
+                                                                           loop_time / filter_time)
+    print "  mismatched decisions: {0}".format(mismatches)
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark svnpull path filtering")
+    parser.add_argument("--paths", type=int, default=20000, help="Number of paths to test (default %(default)s)")
+    args = parser.parse_args()
+
+    mismatches = 0
+    for label, filename, reject_changelog in (("import exceptions", "atlasoffline-exceptions.txt", True),
+                                              ("license exceptions", "atlaslicense-exceptions.txt", False)):
+        path_accept, path_reject = svnpull.load_exceptions_file(os.path.join(sharedir, filename),
+                                                                reject_changelog=reject_changelog)
+        paths = make_paths(path_accept, path_reject, args.paths)
+        mismatches += bench(label, path_accept, path_reject, paths)
+    if mismatches:
+        raise SystemExit("PathFilter decisions differ from the re.match loop")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,237 @@
+#! /usr/bin/env python
+#
+# Copyright (C) 2017 CERN for the benefit of the ATLAS collaboration
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+## Check that each of svnpull's import modes gives the same git tree as a plain import
+#
+#  Builds a small SVN repository (with svnadmin, accessed through file://) holding
+#  two tags of a package with the awkward cases for an import: symlinks to source
+#  files (imported as licensed copies of their targets), listed before or after their
+#  targets, in the same directory or another one, a symlink to a directory, a
+#  dotfile, a large non-source file, a source file without a trailing newline and a
+#  doc/packagedoc.h that the second tag deletes; the target of one file symlink
+#  changes between the tags, and the second tag adds a symlink to a directory. Both
+#  tags are imported in turn with each mode, from the same scratch git repository,
+#  and the git tree left is compared with the one left by plain imports. Modes that
+#  use a cache are run twice, so the second run reads from the cache. The audit mode
+#  instead checks that --audit finds the package left by plain imports identical to
+#  its SVN tag. Only svn, svnadmin and git are needed, no network access.
+
+import argparse
+import os
+import os.path
+import shutil
+import subprocess
+import sys
+import tempfile
+
+svnpull = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bin", "svnpull.py")
+package = "Event/CheckPkg"
+tags = ["CheckPkg-00-00-01", "CheckPkg-00-00-02"]
+
+## Modes to check: extra svnpull arguments and the number of times to run the imports
+#  (the cache directories given as {cache} are kept between the runs)
+modes = {"checkout": (["--svn-checkout"], 1),
+         "sync": (["--sync"], 1),
+         "jobs": (["--jobs", "2"], 1),
+         "svn-cache": (["--svn-cache", "{cache}"], 2),
+         # The package is small, so the workers are only used if asked to for any size
+         "workers": (["--workers", "2", "--workers-min-files", "0"], 1),
+         "license-cache": (["--license-cache", "{cache}"], 2),
+         "workers-cache": (["--workers", "2", "--workers-min-files", "0", "--license-cache", "{cache}"], 2),
+         "git-branch": (["--git-branch", "check-import"], 1),
+         "git-branch-jobs": (["--git-branch", "check-import", "--jobs", "2"], 1),
+         "replay": (["--replay"], 1),
+         "delta": (["--delta"], 1),
+         "prefilter": (["--prefilter"], 1),
+         # Not an import: after plain imports, the audit must find the package identical
+         "audit": (["--audit", "{cache}.json"], 2),
+         }
+
+
+def run(cmd, cwd=None):
+    ## @brief Run a command quietly, raising an exception if it fails
+    with open(os.devnull, "w") as devnull:
+        subprocess.check_call(cmd, cwd=cwd, stdout=devnull, stderr=devnull)
+
+
+def write_file(path, content, mode=0o644):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, "w") as fh:
+        fh.write(content)
+    os.chmod(path, mode)
+
+
+def make_package(path, version):
+    ## @brief Write one version (1 or 2) of the check package
+    write_file(os.path.join(path, "CMakeLists.txt"), "atlas_subdir( CheckPkg )\n")
+    write_file(os.path.join(path, "src", "real.cxx"), "int real() {{ return {0}; }}\n".format(version))
+    os.symlink("real.cxx", os.path.join(path, "src", "link.cxx"))
+    # Listed before or after its target, depending on the file system
+    os.symlink("real.cxx", os.path.join(path, "src", "a.cxx"))
+    os.symlink("src", os.path.join(path, "srclink"))
+    write_file(os.path.join(path, "src", "nonl.cxx"), "// -*- C++ -*-\nint nonl = 1;")
+    write_file(os.path.join(path, "CheckPkg", "Header.h"), "#ifndef HEADER_H\n#define HEADER_H\n#endif\n")
+    os.symlink("Header.h", os.path.join(path, "CheckPkg", "Alias.h"))
+    # A symlink into another directory, which may be processed before or after it
+    os.symlink(os.path.join("CheckPkg", "Header.h"), os.path.join(path, "Alias.h"))
+    write_file(os.path.join(path, "python", "module.py"), "def f():\n    return 1\n")
+    write_file(os.path.join(path, "scripts", "run.py"), "#!/usr/bin/env python\nprint 'run'\n", 0o755)
+    write_file(os.path.join(path, ".hidden"), "not imported\n")
+    write_file(os.path.join(path, "data", "big.root"), "x" * (200 * 1024))
+    if version == 1:
+        write_file(os.path.join(path, "doc", "packagedoc.h"), "/** @page CheckPkg */\n")
+    else:
+        write_file(os.path.join(path, "src", "new.cxx"), "int added = 2;\n")
+        os.symlink("python", os.path.join(path, "pylink"))
+
+
+def create_svn_repo(workdir):
+    ## @return file:// URL of the repository root
+    repo = os.path.join(workdir, "svnrepo")
+    run(["svnadmin", "create", repo])
+    svnroot = "file://" + repo
+    for version, tag in enumerate(tags, 1):
+        source = os.path.join(workdir, "src", tag)
+        make_package(source, version)
+        run(["svn", "import", "-q", "-m", "Tag " + tag, source, "/".join([svnroot, package, "tags", tag])])
+    return svnroot
+
+
+def create_git_repo(workdir):
+    ## @return Path to a scratch git repository holding the package's CMakeLists.txt
+    gitrepo = os.path.join(workdir, "athena")
+    os.makedirs(gitrepo)
+    run(["git", "init", "-q"], cwd=gitrepo)
+    # svnpull commits too (with --git-branch and --replay)
+    git(gitrepo, "config", "user.name", "check")
+    git(gitrepo, "config", "user.email", "check@localhost")
+    write_file(os.path.join(gitrepo, package, "CMakeLists.txt"), "atlas_subdir( CheckPkg )\n")
+    git(gitrepo, "add", "-A")
+    git(gitrepo, "commit", "-q", "-m", "Base")
+    git(gitrepo, "tag", "base")
+    return gitrepo
+
+
+def git(gitrepo, *args):
+    ## @brief Run a git command in the scratch repository
+    #  @return Output of the command
+    return subprocess.check_output(["git"] + list(args), cwd=gitrepo).strip()
+
+
+def reset_git(gitrepo):
+    ## @brief Put the scratch repository back to its base commit, forgetting svnpull's state
+    #  (but not the caches used by the modes)
+    git(gitrepo, "reset", "-q", "--hard", "base")
+    for branch in git(gitrepo, "for-each-ref", "--format=%(refname:short)", "refs/heads").split():
+        if branch != "master":
+            git(gitrepo, "branch", "-q", "-D", branch)
+    git(gitrepo, "clean", "-q", "-f", "-d", "-x")
+    shutil.rmtree(os.path.join(gitrepo, ".git", "svnpull"), ignore_errors=True)
+
+
+def worktree_tree(gitrepo):
+    ## @brief Git tree of the working tree, as it would be committed
+    git(gitrepo, "add", "-A")
+    return git(gitrepo, "write-tree")
+
+
+def run_svnpull(gitrepo, svnroot, args):
+    run([sys.executable, svnpull, "--no-daemon", "--svnroot", svnroot] + args, cwd=gitrepo)
+
+
+def import_tags(gitrepo, svnroot, extra_args):
+    ## @brief Import both tags in turn (with one command for --replay)
+    #  @return Git tree left in the working tree (or committed, with --git-branch and --replay)
+    if "--replay" in extra_args:
+        run_svnpull(gitrepo, svnroot, extra_args + ["{0}..{1}".format(tags[0], tags[-1])])
+    else:
+        for tag in tags:
+            run_svnpull(gitrepo, svnroot, extra_args + [tag])
+    if "--git-branch" in extra_args:
+        return git(gitrepo, "rev-parse", extra_args[extra_args.index("--git-branch") + 1] + "^{tree}")
+    if "--replay" in extra_args:
+        # What was committed for the last tag
+        return git(gitrepo, "rev-parse", "HEAD^{tree}")
+    return worktree_tree(gitrepo)
+
+
+def audit_tree(gitrepo, svnroot, extra_args):
+    ## @brief Audit the last tag against plain imports of both tags
+    #  @return Git tree left by the plain imports, if the audit found the package identical
+    #  (or @c None)
+    if not os.path.exists(extra_args[-1]):
+        # The first run, which fills the audit's digest cache
+        reset_git(gitrepo)
+        import_tags(gitrepo, svnroot, [])
+    try:
+        run_svnpull(gitrepo, svnroot, extra_args + [tags[-1]])
+    except subprocess.CalledProcessError:
+        return None
+    return worktree_tree(gitrepo)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that svnpull's import modes give the same git tree as "
+                                     "a plain import, for a synthetic package with symlinks, dotfiles, "
+                                     "large files and a file without a trailing newline")
+    parser.add_argument("--modes", default=",".join(sorted(modes)),
+                        help="Comma separated modes to check, from {0} (default %(default)s)".format(
+                            ", ".join(sorted(modes))))
+    parser.add_argument("--workdir", help="Directory to build the repositories in (default a new temporary "
+                        "directory, which is removed afterwards)")
+    args = parser.parse_args()
+
+    workdir = args.workdir if args.workdir else tempfile.mkdtemp(prefix="svnpull-check-")
+    failed = []
+    try:
+        svnroot = create_svn_repo(workdir)
+        gitrepo = create_git_repo(workdir)
+        reference = import_tags(gitrepo, svnroot, [])
+        print "{0:12s} {1}".format("plain", reference)
+        for mode in args.modes.split(","):
+            extra_args, repeat = modes[mode]
+            cache = os.path.join(workdir, "cache-" + mode)
+            extra_args = [ arg.format(cache=cache) for arg in extra_args ]
+            for attempt in range(repeat):
+                if "--audit" in extra_args:
+                    tree = audit_tree(gitrepo, svnroot, extra_args)
+                else:
+                    reset_git(gitrepo)
+                    try:
+                        tree = import_tags(gitrepo, svnroot, extra_args)
+                    except subprocess.CalledProcessError as e:
+                        print "{0:12s} {1}".format(mode, e)
+                        tree = None
+                ok = tree == reference
+                if not ok:
+                    failed.append(mode)
+                print "{0:12s} {1} {2}{3}".format(mode, tree or "(failed)", "OK" if ok else "DIFFERS",
+                                                  " (run {0})".format(attempt + 1) if repeat > 1 else "")
+                if not ok and tree:
+                    print git(gitrepo, "diff-tree", "-r", "--stat", reference, tree)
+            shutil.rmtree(cache, ignore_errors=True)
+            if os.path.exists(cache + ".json"):
+                os.remove(cache + ".json")
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    if failed:
+        raise SystemExit("Modes giving a different tree from a plain import: {0}".format(" ".join(sorted(set(failed)))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+#! /usr/bin/env python
+#
+# Copyright (C) 2017 CERN for the benefit of the ATLAS collaboration
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+## Offline benchmark of svnpull.py
+#
+#  Builds a synthetic SVN repository (with svnadmin, accessed through file://)
+#  holding athena-like packages of several sizes, each with a trunk, tags and a
+#  branch, plus a scratch git repository containing the same packages. svnpull is
+#  then run against them and the throughput of each import phase is reported,
+#  using svnpull's --metrics-json output. Only svn, svnadmin and git are needed,
+#  no network access. With --ssh-host the repository is accessed through svn+ssh://
+#  instead (e.g., through a local sshd), to measure SSH connection sharing.
+
+import argparse
+import json
+import os
+import os.path
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+svnpull = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bin", "svnpull.py")
+license_line = "Copyright (C) 2002-2017 CERN for the benefit of the ATLAS collaboration"
+
+# Variants of the import to benchmark, as extra svnpull arguments
+variants = {"export": [],
+            "checkout": ["--svn-checkout"],
+            "sync": ["--sync"],
+            }
+
+# Extra variant with --ssh-host, making a new SSH connection for each svn command
+ssh_variants = {"ssh-direct": ["--ssh-connections", "0"]}
+
+
+def run(cmd, cwd=None):
+    ## @brief Run a command quietly, raising an exception if it fails
+    with open(os.devnull, "w") as devnull:
+        subprocess.check_call(cmd, cwd=cwd, stdout=devnull)
+
+
+def write_file(path, content, mode=0o644):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, "w") as fh:
+        fh.write(content)
+    os.chmod(path, mode)
+
+
+def make_package(path, package, nfiles, rng):
+    ## @brief Write an athena-like package
+    #  @param path Directory to write the package to
+    #  @param package Package name
+    #  @param nfiles Approximate number of files
+    #  @param rng Random number generator
+    write_file(os.path.join(path, "CMakeLists.txt"), "atlas_subdir( {0} )\n".format(package))
+    write_file(os.path.join(path, "cmt", "requirements"), "package {0}\n".format(package))
+    write_file(os.path.join(path, "ChangeLog"), "2017-01-01 Someone\n\t* Tagged\n" * 50)
+    write_file(os.path.join(path, "doc", "mainpage.h"), "/** @mainpage */\n")
+    body = "".join([ "    int value{0} = {0}; // some code\n".format(i) for i in range(40) ])
+    for i in range(nfiles):
+        kind = i % 20
+        if kind < 8:
+            content = "int func{0}() {{\n{1}}}\n".format(i, body)
+            if kind == 0:
+                content = "// -*- C++ -*-\n" + content
+            elif kind == 1:
+                content = "/*\n  {0}\n*/\n\n".format(license_line) + content
+            write_file(os.path.join(path, "src", "File{0}.cxx".format(i)), content)
+        elif kind < 13:
+            write_file(os.path.join(path, package, "File{0}.h".format(i)),
+                       "// -*- C++ -*-\n#ifndef FILE{0}_H\n#define FILE{0}_H\n{1}#endif\n".format(i, body))
+        elif kind < 17:
+            content = "def func{0}():\n    return {0}\n".format(i) * 20
+            if kind == 13:
+                write_file(os.path.join(path, "scripts", "script{0}.py".format(i)),
+                           "#!/usr/bin/env python\n" + content, 0o755)
+            else:
+                write_file(os.path.join(path, "python", "module{0}.py".format(i)), content)
+        elif kind == 17:
+            write_file(os.path.join(path, "share", "{0}_jobOptions{1}.py".format(package, i)),
+                       "include('Common.py')\n" * 10)
+        elif kind == 18:
+            # Large, non-source file that is vetoed by size (or small data file)
+            size = rng.choice([1024, 200 * 1024])
+            write_file(os.path.join(path, "data", "data{0}.root".format(i)),
+                       "".join([ chr(rng.randint(0, 255)) for _ in range(256) ]) * (size // 256))
+        else:
+            write_file(os.path.join(path, "test", ".hidden{0}".format(i)), "ignored\n")
+
+
+def create_svn_repo(workdir, sizes, rng):
+    ## @brief Create an SVN repository with one package per size, each having trunk,
+    #  two tags (with a few files changed between them) and a branch
+    #  @return file:// URL of the repository root
+    repo = os.path.join(workdir, "svnrepo")
+    run(["svnadmin", "create", repo])
+    svnroot = "file://" + repo
+    for nfiles in sizes:
+        package = "BenchPkg{0}".format(nfiles)
+        package_url = "/".join([svnroot, "Bench", package])
+        source = os.path.join(workdir, "src", package)
+        make_package(source, package, nfiles, rng)
+        run(["svn", "import", "-q", "-m", "Import " + package, source, package_url + "/trunk"])
+        run(["svn", "mkdir", "-q", "-m", "Tags and branches", package_url + "/tags", package_url + "/branches"])
+        run(["svn", "copy", "-q", "-m", "Tag", package_url + "/trunk", package_url + "/tags/{0}-00-00-01".format(package)])
+        # Change a few files for the next tag
+        wc = os.path.join(workdir, "wc", package)
+        run(["svn", "checkout", "-q", package_url + "/trunk", wc])
+        for name in sorted(os.listdir(os.path.join(wc, "src")))[:5]:
+            with open(os.path.join(wc, "src", name), "a") as fh:
+                fh.write("// changed\n")
+        run(["svn", "commit", "-q", "-m", "Change", wc])
+        run(["svn", "copy", "-q", "-m", "Tag", package_url + "/trunk", package_url + "/tags/{0}-00-00-02".format(package)])
+        run(["svn", "copy", "-q", "-m", "Branch", package_url + "/tags/{0}-00-00-01".format(package),
+             package_url + "/branches/{0}-00-00-01-branch".format(package)])
+    return svnroot
+
+
+def create_git_repo(workdir, sizes):
+    ## @brief Create a scratch git repository containing each package's CMakeLists.txt
+    #  @return Path to the repository
+    gitrepo = os.path.join(workdir, "athena")
+    os.makedirs(gitrepo)
+    run(["git", "init", "-q"], cwd=gitrepo)
+    for nfiles in sizes:
+        package = "BenchPkg{0}".format(nfiles)
+        write_file(os.path.join(gitrepo, "Bench", package, "CMakeLists.txt"), "atlas_subdir( {0} )\n".format(package))
+    run(["git", "add", "-A"], cwd=gitrepo)
+    run(["git", "-c", "user.name=bench", "-c", "user.email=bench@localhost", "commit", "-q", "-m", "Base"],
+        cwd=gitrepo)
+    return gitrepo
+
+
+def run_svnpull(gitrepo, svnroot, specifiers, extra_args, metrics_file):
+    ## @brief Run svnpull and return its metrics, together with the total wall time
+    cmd = [sys.executable, svnpull, "--no-daemon", "--svnroot", svnroot, "--metrics-json", metrics_file] + \
+        extra_args + specifiers
+    start = time.time()
+    run(cmd, cwd=gitrepo)
+    wall = time.time() - start
+    with open(metrics_file) as metrics_fh:
+        return json.load(metrics_fh), wall
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of svnpull, using a synthetic file:// "
+                                     "SVN repository and a scratch git repository")
+    parser.add_argument("--sizes", default="100,1000,5000",
+                        help="Comma separated package sizes, in files (default %(default)s)")
+    parser.add_argument("--variants", default=",".join(sorted(variants)),
+                        help="Comma separated import variants to run, from {0} "
+                        "(default %(default)s)".format(", ".join(sorted(variants))))
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Number of times to repeat each import, the fastest is reported (default %(default)s)")
+    parser.add_argument("--workdir", help="Directory to build the repositories in (default a new temporary "
+                        "directory, which is removed afterwards)")
+    parser.add_argument("--json", metavar="FILE", help="Also write the results to FILE as JSON")
+    parser.add_argument("--ssh-host", metavar="HOST",
+                        help="Access the SVN repository as svn+ssh://HOST/... instead of file:// (HOST must accept "
+                        "ssh without a password and have svnserve, e.g., localhost running sshd); this adds "
+                        "the ssh-direct variant, which does not share SSH connections")
+    args = parser.parse_args()
+    if args.ssh_host:
+        variants.update(ssh_variants)
+        if "ssh-direct" not in args.variants.split(","):
+            args.variants += ",ssh-direct"
+
+    sizes = [ int(size) for size in args.sizes.split(",") ]
+    workdir = args.workdir if args.workdir else tempfile.mkdtemp(prefix="svnpull-bench-")
+    results = []
+    try:
+        print "Building SVN and git repositories in {0}".format(workdir)
+        svnroot = create_svn_repo(workdir, sizes, random.Random(1234))
+        if args.ssh_host:
+            svnroot = "svn+ssh://{0}{1}".format(args.ssh_host, svnroot[len("file://"):])
+        gitrepo = create_git_repo(workdir, sizes)
+        metrics_file = os.path.join(workdir, "metrics.json")
+
+        print "{0:>6s} {1:9s} {2:8s} {3:>9s} {4:>7s} {5:>10s} {6:>9s} {7:>8s}".format(
+            "Size", "Variant", "Phase", "Wall (s)", "Files", "Files/s", "MB", "MB/s")
+        for nfiles in sizes:
+            package = "BenchPkg{0}".format(nfiles)
+            for variant in args.variants.split(","):
+                best = None
+                for attempt in range(args.repeat):
+                    if variant == "sync":
+                        # Import one tag, then measure syncing to the next one
+                        run_svnpull(gitrepo, svnroot, [package + "-00-00-01"], [], metrics_file)
+                    metrics, wall = run_svnpull(gitrepo, svnroot, [package + "-00-00-02"], variants[variant],
+                                                metrics_file)
+                    if best is None or wall < best[1]:
+                        best = (metrics, wall)
+                    run(["git", "checkout", "-q", "--", "."], cwd=gitrepo)
+                    run(["git", "clean", "-q", "-f", "-d", "-x", "-e", ".git"], cwd=gitrepo)
+                package_metrics = [ metric for metric in best[0] if metric["name"] != "(package index)" ][0]
+                for phase, counters in package_metrics["phases"].iteritems():
+                    mb = counters["bytes"] / 1024.0 / 1024
+                    wall = max(counters["wall"], 1e-6)
+                    print "{0:6d} {1:9s} {2:8s} {3:9.3f} {4:7d} {5:10.1f} {6:9.2f} {7:8.2f}".format(
+                        nfiles, variant, phase, counters["wall"], counters["files"], counters["files"] / wall,
+                        mb, mb / wall)
+                print "{0:6d} {1:9s} {2:8s} {3:9.3f}   peak temporary space {4:.2f}MB".format(
+                    nfiles, variant, "total", best[1], package_metrics["peak_tempdir_bytes"] / 1024.0 / 1024)
+                results.append({"size": nfiles, "variant": variant, "wall": best[1], "metrics": package_metrics})
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    if args.json:
+        with open(args.json, "w") as json_fh:
+            json.dump(results, json_fh, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,4210 @@
+#! /usr/bin/env python
+#
+# Author: Graeme A Stewart <graeme.andrew.stewart@cern.ch>
+#
+# Copyright (C) 2017 CERN for the benefit of the ATLAS collaboration
+# 
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0
+# 
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+## Pull packages from SVN, clean them up, then copy them into the current
+#  git repository
+#
+#  This module can be used as a library (see run() and ImportResult) and is
+#  the implementation of the bin/svnpull.py command, which forwards to a
+#  running svnpull daemon (see SvnPullDaemon) if there is one.
+
+import argparse
+import atexit
+import collections
+import contextlib
+import csv
+import difflib
+import cProfile
+import cStringIO
+import errno
+import fcntl
+import filecmp
+import fnmatch
+import functools
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import os.path
+import pstats
+import random
+import shutil
+import stat
+import subprocess
+import sys
+import re
+import shlex
+import signal
+import socket
+import sqlite3
+import textwrap
+import threading
+import tempfile
+import time
+import urllib
+import urlparse
+import xml.etree.ElementTree as ElementTree
+
+from multiprocessing.pool import ThreadPool
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+# Ripped out logger configuration; the handler is only added by main(), so that
+# using the module as a library leaves the program's own logging alone
+logger = logging.getLogger("svnpull")
+logger.addHandler(logging.NullHandler())
+hdlr = logging.StreamHandler(sys.stdout)
+frmt = logging.Formatter("%(name)s.%(funcName)s %(levelname)s %(message)s")
+hdlr.setFormatter(frmt)
+logger.setLevel(logging.WARNING)
+
+
+# Options for SVN commands, which can be changed from the command line
+svn_command_options = {"progress": False,  # Show a count of files fetched
+                       "timeout": None,    # Overall time limit for a command, including retries
+                       "ssh": None,        # SshMultiplexer for svn+ssh:// connections
+                       }
+
+# Exceptions and license files already loaded, by path, size and modification time
+loaded_file_cache = {}
+
+# Package indexes already loaded, by git repository
+package_index_cache = {}
+
+# SshMultiplexers started, by SVN root, number of connections and SVN_SSH
+ssh_multiplexers = {}
+
+# Lines output by svn checkout/export/update/switch for each file fetched
+svn_file_line = re.compile(r"[ADUCGER ]{1,4}\s+\S")
+
+
+def check_output_with_retry(cmd, retries=2, wait=10, ignore_fail=False, dryrun=False, max_wait=300,
+                            timeout=None, capture=True, progress=None, merge_stderr=True):
+    ## @brief Multiple attempt wrapper for subprocess.check_call (especially remote SVN commands can bork)
+    #
+    #  Output is streamed line by line, rather than buffered, and after a failure the
+    #  command is retried after an exponentially increasing (with some random jitter),
+    #  but capped, wait
+    #  @param cmd list or tuple of command line parameters
+    #  @param retries Number of attempts to execute successfully
+    #  @param wait Sleep time after the first unsuccessful execution attempt (doubled for each
+    #  further attempt)
+    #  @param ignore_fail Do not raise an exception if the command fails
+    #  @param dryrun If @c True do not actually execute the command, only print it and return an empty string
+    #  @param max_wait Maximum sleep time between attempts
+    #  @param timeout Overall time limit for all attempts, after which the command is killed
+    #  @param capture If @c True return all of the output, otherwise only the last few lines
+    #  are kept (use this for commands with very large outputs)
+    #  @param progress If set, show a count of files fetched by svn with this label
+    #  @param merge_stderr If @c False, stderr is not mixed into the returned output
+    #  (but is still kept for error reports)
+    #  @return String containing command output
+    if dryrun:
+        logger.info("Dryrun mode: {0}".format(cmd))
+        return ""
+    tries = 0
+    start = time.time()
+    deadline = start + timeout if timeout else None
+    env = svn_command_options["ssh"].env() if svn_command_options["ssh"] and cmd[0] == "svn" else None
+    while True:
+        tries += 1
+        logger.debug("Calling {0}".format(cmd))
+        returncode, output, tail, timed_out = run_streaming(cmd, deadline=deadline, capture=capture,
+                                                            progress=progress, merge_stderr=merge_stderr, env=env)
+        if returncode == 0 or ignore_fail:
+            break
+        logger.warning("Attempt {0} to execute {1} failed{2}, last output was:\n{3}".format(
+            tries, cmd, " (timed out)" if timed_out else "", "".join(tail).rstrip()))
+        if tries > retries or timed_out:
+            raise RuntimeError("{0} to execute {1}{2}".format(
+                "Timed out" if timed_out else "Repeated failures", cmd, ": " + tail[-1].strip() if tail else ""))
+        metrics = ImportMetrics.current()
+        if metrics:
+            metrics.add(retries=1)
+        sleep = min(max_wait, wait * 2 ** (tries - 1)) * random.uniform(0.5, 1.0)
+        if deadline:
+            sleep = min(sleep, max(0, deadline - time.time()))
+        time.sleep(sleep)
+    logger.debug("Executed in {0}s".format(time.time() - start))
+    return output if capture else "".join(tail)
+
+
+def run_streaming(cmd, deadline=None, capture=True, progress=None, merge_stderr=True, tail_lines=20, env=None):
+    ## @brief Run a command once, processing its output line by line as it arrives
+    #  @param cmd list or tuple of command line parameters
+    #  @param deadline Time at which to kill the command
+    #  @param capture If @c True keep all of the output
+    #  @param progress If set, show a count of files fetched by svn with this label
+    #  @param merge_stderr If @c False, stderr is only kept for the tail
+    #  @param tail_lines Number of final lines of output to keep for error reports
+    #  @param env Environment for the command (if @c None, this process's environment)
+    #  @return Tuple of return code, captured output, list of final lines of output and
+    #  a flag set if the command was killed at the deadline
+    p = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                         stderr=subprocess.STDOUT if merge_stderr else subprocess.PIPE, env=env)
+    tail = collections.deque(maxlen=tail_lines)
+    captured = []
+    timed_out = []
+    timer = stderr_reader = None
+    if deadline:
+        def kill():
+            timed_out.append(True)
+            try:
+                p.kill()
+            except OSError:
+                pass
+        timer = threading.Timer(max(0, deadline - time.time()), kill)
+        timer.daemon = True
+        timer.start()
+    if not merge_stderr:
+        stderr_reader = threading.Thread(target=lambda: tail.extend(iter(p.stderr.readline, "")))
+        stderr_reader.daemon = True
+        stderr_reader.start()
+    files = 0
+    try:
+        for line in iter(p.stdout.readline, ""):
+            tail.append(line)
+            if capture:
+                captured.append(line)
+            if progress and svn_file_line.match(line):
+                files += 1
+                if files % 100 == 0:
+                    sys.stderr.write("\r{0}: {1} files fetched".format(progress, files))
+                    sys.stderr.flush()
+        p.wait()
+    finally:
+        if p.poll() is None:
+            # Interrupted, so do not leave svn writing into a directory that will be removed
+            p.kill()
+            p.wait()
+        if timer:
+            timer.cancel()
+        if stderr_reader:
+            stderr_reader.join()
+        if progress and files >= 100:
+            sys.stderr.write("\r{0}: {1} files fetched\n".format(progress, files))
+    return p.returncode, "".join(captured), list(tail), bool(timed_out)
+
+
+class SshMultiplexer(object):
+    ## @brief Shares a few persistent SSH connections between all of the svn commands
+    #  run against an svn+ssh:// repository
+    #
+    #  On its own svn opens a new SSH connection, with a full key exchange and
+    #  authentication, for every command. Instead, SSH master connections are started
+    #  once per run (one for each concurrent job, up to a small limit) and svn is told
+    #  to go through them, by adding their ControlPath to SVN_SSH (any SVN_SSH already
+    #  set, e.g., to give a user name or key, is kept).
+    def __init__(self, svnroot, connections=1):
+        ## @param svnroot svn+ssh:// URL of the SVN repository
+        #  @param connections Number of master connections to start
+        url = urlparse.urlsplit(svnroot)
+        self.target = ([ "-p", str(url.port) ] if url.port else []) + \
+            ([ "-l", url.username ] if url.username else []) + [ url.hostname ]
+        self.svn_ssh = os.environ.get("SVN_SSH", "ssh")
+        self.ssh = shlex.split(self.svn_ssh)
+        self.connections = connections
+        self.control_dir = None
+        self.control_paths = []
+        self.slots = {}
+        self.uses = 0
+        self.setup_time = 0.0
+        self.lock = threading.Lock()
+
+    def start(self):
+        ## @brief Start the master connections
+        #  @return @c True if at least one connection was started
+        # Keep the socket paths short, as they have a small length limit
+        self.control_dir = tempfile.mkdtemp(prefix="svnpull-ssh-")
+        for connection in range(self.connections):
+            control_path = os.path.join(self.control_dir, str(connection))
+            start = time.time()
+            with open(os.devnull, "w") as devnull:
+                returncode = subprocess.call(self.ssh + ["-o", "ControlMaster=yes", "-o", "ControlPersist=yes",
+                                                        "-o", "ControlPath=" + control_path, "-N", "-f"] +
+                                             self.target, stdout=devnull)
+            if returncode:
+                logger.warning("Failed to start SSH master connection to {0} (exit code {1}), svn will "
+                               "make its own connections".format(self.target[-1], returncode))
+                break
+            self.setup_time += time.time() - start
+            self.control_paths.append(control_path)
+        logger.info("Started {0} SSH master connections to {1} in {2:.2f}s".format(len(self.control_paths),
+                                                                                   self.target[-1], self.setup_time))
+        return len(self.control_paths) > 0
+
+    def env(self):
+        ## @brief Make the environment for an svn command, so that it uses one of the master
+        #  connections (each thread sticks to one connection, spreading threads over them)
+        #  @return Environment dictionary
+        with self.lock:
+            thread = threading.current_thread().ident
+            if thread not in self.slots:
+                self.slots[thread] = self.control_paths[len(self.slots) % len(self.control_paths)]
+            self.uses += 1
+            control_path = self.slots[thread]
+        env = dict(os.environ)
+        env["SVN_SSH"] = "{0} -o ControlMaster=no -o ControlPath={1}".format(self.svn_ssh, control_path)
+        return env
+
+    def stop(self, report=False):
+        ## @brief Close the master connections, and report the connection setup time saved
+        #  (estimating that each svn command would have taken as long to connect as a
+        #  master connection did)
+        #  @param report If @c True print the report, otherwise only log it
+        with open(os.devnull, "w") as devnull:
+            for control_path in self.control_paths:
+                subprocess.call(self.ssh + ["-o", "ControlPath=" + control_path, "-O", "exit"] + self.target,
+                                stdout=devnull, stderr=devnull)
+        if self.control_dir:
+            shutil.rmtree(self.control_dir, ignore_errors=True)
+        if self.control_paths:
+            saved = (self.uses - len(self.control_paths)) * self.setup_time / len(self.control_paths)
+            message = "SSH connection sharing: {0} svn commands over {1} connections, about {2:.1f}s of " \
+                "connection setup saved".format(self.uses, len(self.control_paths), max(0, saved))
+            if report:
+                print message
+            else:
+                logger.info(message)
+        self.control_paths = []
+
+    def check(self):
+        ## @brief Check that the master connections are still up (e.g., in a daemon, after
+        #  the network dropped), closing them all if any is not
+        #  @return @c True if they are all up
+        with open(os.devnull, "w") as devnull:
+            for control_path in self.control_paths:
+                if subprocess.call(self.ssh + ["-o", "ControlPath=" + control_path, "-O", "check"] + self.target,
+                                   stdout=devnull, stderr=devnull):
+                    logger.info("SSH master connection {0} has gone, restarting".format(control_path))
+                    self.stop()
+                    return False
+        return len(self.control_paths) > 0
+
+
+def shared_ssh_multiplexer(svnroot, connections, report=False):
+    ## @brief Get master SSH connections to an SVN server, reusing those already started
+    #  by this process (they are closed at exit)
+    #  @param svnroot svn+ssh:// URL of the SVN repository
+    #  @param connections Number of master connections
+    #  @param report If @c True print the report of connection setup time saved at exit
+    #  @return SshMultiplexer, or @c None if no connection could be started
+    # A different SVN_SSH (e.g., from another daemon client) may log in differently
+    key = (svnroot, connections, os.environ.get("SVN_SSH"))
+    ssh = ssh_multiplexers.get(key)
+    if ssh and ssh.check():
+        return ssh
+    ssh = SshMultiplexer(svnroot, connections)
+    if not ssh.start():
+        ssh.stop()
+        return None
+    atexit.register(ssh.stop, report)
+    ssh_multiplexers[key] = ssh
+    return ssh
+
+
+class ImportMetrics(object):
+    ## @brief Wall time and counters for each phase of importing one package
+    #
+    #  The metrics being recorded are activated per thread, so that deeply nested
+    #  functions (like check_output_with_retry(), which counts retries) can find them
+    #  with ImportMetrics.current() without them being passed around. When no metrics
+    #  are active, recording is a no-op.
+    _active = threading.local()
+
+    def __init__(self, name, profiler=None):
+        ## @param name Name of the package (or other work) being measured
+        #  @param profiler ThreadProfiler to run during in-process phases
+        self.name = name
+        self.profiler = profiler
+        self.status = None
+        self.peak_tempdir_size = 0
+        self.phases = collections.OrderedDict()
+        self._phase_stack = []
+
+    @classmethod
+    def current(cls):
+        ## @return The ImportMetrics active in this thread (or @c None)
+        return getattr(cls._active, "metrics", None)
+
+    def add(self, phase=None, wall=0.0, files=0, bytes=0, retries=0, rejected=0):
+        ## @brief Add to the counters of a phase
+        #  @param phase Phase name (defaults to the phase currently running)
+        if phase is None:
+            phase = self._phase_stack[-1][0] if self._phase_stack else "other"
+        counters = self.phases.setdefault(phase, {"wall": 0.0, "files": 0, "bytes": 0, "retries": 0,
+                                                  "rejected": 0})
+        counters["wall"] += wall
+        counters["files"] += files
+        counters["bytes"] += bytes
+        counters["retries"] += retries
+        counters["rejected"] += rejected
+
+    def update_peak_tempdir_size(self, path):
+        ## @brief Measure a temporary directory, remembering the largest size seen
+        self.peak_tempdir_size = max(self.peak_tempdir_size, tree_stats(path)[1])
+
+    def enter(self, phase):
+        now = time.time()
+        if self._phase_stack:
+            # Time spent in a nested phase is not counted in the enclosing one
+            outer, start = self._phase_stack[-1]
+            self.add(outer, wall=now - start)
+        elif self.profiler and phase != "fetch":
+            self.profiler.enable()
+        self._phase_stack.append((phase, now))
+
+    def leave(self):
+        now = time.time()
+        phase, start = self._phase_stack.pop()
+        self.add(phase, wall=now - start)
+        if self._phase_stack:
+            self._phase_stack[-1] = (self._phase_stack[-1][0], now)
+        elif self.profiler and phase != "fetch":
+            self.profiler.disable()
+
+    def as_dict(self):
+        return {"name": self.name, "status": self.status, "peak_tempdir_bytes": self.peak_tempdir_size,
+                "phases": self.phases}
+
+
+@contextlib.contextmanager
+def activate_metrics(metrics):
+    ## @brief Make metrics the ones recorded to in this thread
+    #  @param metrics ImportMetrics object (if @c None, nothing is recorded)
+    previous = ImportMetrics.current()
+    ImportMetrics._active.metrics = metrics
+    try:
+        yield metrics
+    finally:
+        ImportMetrics._active.metrics = previous
+
+
+@contextlib.contextmanager
+def metrics_phase(phase):
+    ## @brief Time a phase of an import in the metrics active for this thread
+    #  (which may be none, then nothing is done)
+    #  @param phase Name of the phase (resolve, fetch, cleanup, license or sync)
+    #  @return Active ImportMetrics object or @c None
+    metrics = ImportMetrics.current()
+    if metrics is None:
+        yield None
+        return
+    metrics.enter(phase)
+    try:
+        yield metrics
+    finally:
+        metrics.leave()
+
+
+class ImportResult(object):
+    ## @brief Outcome of a run of svnpull, for callers using it as a library
+    #
+    #  Each package asked for has a dictionary in @c packages, giving its SVN package
+    #  specifier, package path, SVN path imported, status (ok, failed, skipped if it was
+    #  already imported, or not run after an earlier failure), error, the number of
+    #  files written, skipped (rejected by the import filter) and licensed, and the
+    #  wall time of each phase. For an audit (see DriftAudit) nothing is imported and
+    #  the comparison of each package is given in @c audit instead.
+    def __init__(self, exit_code=0):
+        ## @param exit_code Exit code for the command line
+        self.packages = []
+        self.audit = None
+        self.exit_code = exit_code
+
+    @property
+    def ok(self):
+        return self.exit_code == 0
+
+    @property
+    def imported(self):
+        ## @return @c True if any packages were asked to be imported (rather than, e.g.,
+        #  only listing the package index or SVN tags)
+        return len(self.packages) > 0
+
+    def add(self, svn_import, status, error=None):
+        ## @brief Add the outcome of one import
+        #  @param svn_import Dictionary describing the import
+        #  @param status Status of the import
+        #  @param error Error that made the import fail (or @c None)
+        phases = svn_import["metrics"].phases if svn_import["metrics"] else {}
+
+        def count(phase, counter):
+            return phases[phase][counter] if phase in phases else 0
+
+        self.packages.append({"svn_package": svn_import["svn_package"], "package": svn_import["package"],
+                              "svn_path": os.path.join(svn_import["package"], svn_import["tag"]),
+                              "status": status, "error": str(error) if error else None,
+                              "files_written": count("sync", "files"),
+                              "files_skipped": count("cleanup", "rejected"),
+                              "files_licensed": count("license", "files"),
+                              "timings": collections.OrderedDict((phase, counters["wall"])
+                                                                 for phase, counters in phases.iteritems())})
+
+    def as_dict(self):
+        result = {"exit_code": self.exit_code, "packages": self.packages}
+        if self.audit is not None:
+            result["audit"] = self.audit
+        return result
+
+
+class ThreadProfiler(object):
+    ## @brief Collects cProfile statistics from any thread running an in-process
+    #  phase of an import (cProfile only profiles the thread it was enabled in,
+    #  so each thread gets its own profile, which are merged at the end)
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._profiles = {}
+
+    def _profile(self):
+        with self._lock:
+            return self._profiles.setdefault(threading.current_thread().ident, cProfile.Profile())
+
+    def enable(self):
+        self._profile().enable()
+
+    def disable(self):
+        self._profile().disable()
+
+    def dump(self, filename):
+        ## @brief Write merged statistics, which can be read with pstats
+        stats = None
+        for profile in self._profiles.values():
+            profile.create_stats()
+            if stats is None:
+                stats = pstats.Stats(profile)
+            else:
+                stats.add(profile)
+        if stats:
+            stats.dump_stats(filename)
+
+
+def print_metrics_table(all_metrics):
+    ## @brief Print a table of the metrics of each package and phase
+    #  @param all_metrics List of ImportMetrics
+    print "{0:40s} {1:8s} {2:>9s} {3:>7s} {4:>10s} {5:>7s}".format("Package", "Phase", "Wall (s)", "Files",
+                                                                   "MB", "Retries")
+    for metrics in all_metrics:
+        name = metrics.name
+        for phase, counters in metrics.phases.iteritems():
+            print "{0:40s} {1:8s} {2:9.3f} {3:7d} {4:10.2f} {5:7d}".format(name, phase, counters["wall"],
+                                                                           counters["files"],
+                                                                           counters["bytes"] / 1024.0 / 1024,
+                                                                           counters["retries"])
+            name = ""
+        if metrics.peak_tempdir_size:
+            print "{0:40s} peak temporary space {1:.2f}MB".format(name, metrics.peak_tempdir_size / 1024.0 / 1024)
+
+
+def find_git_root():
+    ## @brief Search for a git repository root from cwd
+    found_git = False
+    start = searching = os.getcwd()
+    while True:
+        if os.path.isdir(".git"):
+            found_git = True
+            break
+        else:
+            os.chdir("..")
+            if os.getcwd() == searching:  # Hit filesystem root
+                break
+            searching = os.getcwd()
+
+    os.chdir(start)
+    if found_git and git_repo_ok(os.path.join(searching, ".git")):
+        logger.debug("Found .git for repository root here: {0}".format(searching))
+        return searching
+
+    logger.debug("No valid .git found descending from {0}".format(start))
+    return None
+
+
+def git_repo_ok(path="."):
+    ## @brief Check if a directory seems to contain a valid git repository
+    #  @param path Path to check
+    #  @return Boolean, @c True if the repo seems valid
+    entries = os.listdir(path)
+    try:
+        if (os.path.isfile(os.path.join(path, "HEAD")) and
+            os.path.isdir(os.path.join(path, "objects")) and
+            os.path.isdir(os.path.join(path, "refs"))):
+            return True
+    except OSError:
+        return False
+    return False
+
+def load_exceptions_file(filename, reject_changelog=False):
+    ## @brief Parse and return path globbing exceptions file
+    #  @param filename File containing exceptions
+    #  @param reject_changelog Special flag used by svnpull to ensure that
+    #  ChangeLog files are rejected (in a normal svn2git they are accepted,
+    #  onto the import branches, but then excluded specially from the
+    #  release branches)
+    #  @return Tuple of path globs to accept and globs to reject, converted to regexps
+    if filename != "NONE":
+        # Parsed files are kept, for as long as they do not change, so that a daemon
+        # does not parse and compile them again for each request
+        try:
+            file_stat = os.stat(filename)
+            key = (os.path.abspath(filename), file_stat.st_size, file_stat.st_mtime, reject_changelog)
+        except OSError:
+            key = None
+        if key in loaded_file_cache:
+            return loaded_file_cache[key]
+    path_accept = []
+    path_reject = []
+    if filename != "NONE":
+        with open(filename) as filter_file:
+            logger.info("Loaded import exceptions from {0}".format(filename))
+            for line in filter_file:
+                line = line.strip()
+                if reject_changelog and ("ChangeLog" in line):
+                    logger.debug("Found ChangeLog line, which will be forced to reject: {0}".format(line))
+                    line = "- */ChangeLog"
+                if line.startswith("#") or line == "":
+                    continue
+                if line.startswith("-"):
+                    path_reject.append(re.compile(fnmatch.translate(line.lstrip("- "))))
+                else:
+                    path_accept.append(re.compile(fnmatch.translate(line.lstrip("+ "))))
+    logger.debug("Glob accept: {0}".format([ m.pattern for m in path_accept ]))
+    logger.debug("Glob reject: {0}".format([ m.pattern for m in path_reject ]))
+    if filename != "NONE" and key:
+        loaded_file_cache[key] = (path_accept, path_reject)
+    return path_accept, path_reject
+
+
+def load_license_file(filename):
+    ## @brief Read the license text to add to source files
+    #  @param filename License file
+    #  @return List of strings containing the license text
+    file_stat = os.stat(filename)
+    key = (os.path.abspath(filename), file_stat.st_size, file_stat.st_mtime)
+    if key not in loaded_file_cache:
+        with open(filename) as lfh:
+            loaded_file_cache[key] = [ line.rstrip() for line in lfh.readlines() ]
+    return loaded_file_cache[key]
+
+
+def load_manifest(filename):
+    ## @brief Read the SVN package specifiers to import from a manifest file,
+    #  one per line (blank lines and lines starting with '#' are ignored)
+    #  @param filename Manifest file
+    #  @return List of SVN package specifiers
+    svn_packages = []
+    with open(filename) as manifest_file:
+        for line in manifest_file:
+            line = line.strip()
+            if line.startswith("#") or line == "":
+                continue
+            svn_packages.append(line)
+    logger.info("Loaded {0} packages from manifest {1}".format(len(svn_packages), filename))
+    return svn_packages
+
+
+class PathFilter(object):
+    ## @brief Compiled matcher for a list of accept and reject path regexps
+    #
+    #  All of the rules are merged into one alternation, with a named group
+    #  per rule, so that a single regexp match finds the first rule matching
+    #  a path. Accept rules come before reject rules, so a match to accept
+    #  wins, as it always has in the exceptions files.
+    #
+    #  The python2 re module only allows 100 named groups in a pattern, so
+    #  long rule lists are split over several merged patterns, which are tried
+    #  in order.
+    max_groups = 90
+    _cache = {}
+    _cache_lock = threading.Lock()
+
+    @classmethod
+    def cached(cls, path_accept=[], path_reject=[]):
+        ## @brief Get the PathFilter for a list of rules, reusing one already compiled
+        #  for the same rules (which saves recompiling them for each package, and for
+        #  each request to a daemon)
+        #  @return PathFilter
+        key = (tuple(rule.pattern for rule in path_accept), tuple(rule.pattern for rule in path_reject))
+        with cls._cache_lock:
+            if key not in cls._cache:
+                cls._cache[key] = cls(path_accept, path_reject)
+            return cls._cache[key]
+
+    def __init__(self, path_accept=[], path_reject=[]):
+        ## @param path_accept List of compiled regexps (from fnmatch.translate) to accept
+        #  @param path_reject List of compiled regexps (from fnmatch.translate) to reject
+        self.rules = [ (True, rule) for rule in path_accept ] + [ (False, rule) for rule in path_reject ]
+        self._matchers = []
+        for offset in range(0, len(self.rules), self.max_groups):
+            alternatives = [ "(?P<r{0}>{1})".format(offset + index, glob_regexp_body(rule.pattern))
+                             for index, (accept, rule) in enumerate(self.rules[offset:offset + self.max_groups]) ]
+            self._matchers.append(re.compile(r"(?ms)(?:{0})\Z".format("|".join(alternatives))))
+
+    def match(self, path):
+        ## @brief Find the rule that decides on a path
+        #  @param path Path to test
+        #  @return Tuple of decision (@c True to accept, @c False to reject and @c None if
+        #  no rule matches) and the compiled regexp of the matching rule (or @c None)
+        for matcher in self._matchers:
+            m = matcher.match(path)
+            if m:
+                return self.rules[int(m.lastgroup[1:])]
+        return None, None
+
+
+def glob_regexp_body(pattern):
+    ## @brief Strip the end of string anchor and flags from a fnmatch.translate regexp, so
+    #  that it can be combined with others
+    #  @param pattern Regexp string, as returned by fnmatch.translate
+    #  @return Regexp string without the trailing anchor
+    if pattern.endswith(r"\Z(?ms)"):
+        return pattern[:-len(r"\Z(?ms)")]
+    if pattern.endswith(r"\Z"):
+        return pattern[:-len(r"\Z")]
+    return pattern
+
+
+def svnpull_state_dir(gitrepo="."):
+    ## @brief Directory, inside the git repository's .git, where svnpull keeps
+    #  state that should persist between runs (it is created if needed)
+    #  @param gitrepo Path to git repository
+    #  @return Path to state directory
+    state_dir = os.path.join(gitrepo, ".git", "svnpull")
+    if not os.path.isdir(state_dir):
+        os.makedirs(state_dir)
+    return state_dir
+
+
+def package_index_key(gitrepo="."):
+    ## @brief Key identifying the state of the git checkout, which changes
+    #  whenever HEAD moves or the index is updated
+    #  @param gitrepo Path to git repository
+    #  @return List of HEAD commit and the index file's size and modification time
+    try:
+        head = subprocess.check_output(["git", "rev-parse", "-q", "--verify", "HEAD"], cwd=gitrepo).strip()
+    except subprocess.CalledProcessError:
+        head = ""
+    try:
+        index_stat = os.stat(os.path.join(gitrepo, ".git", "index"))
+        return [head, index_stat.st_size, index_stat.st_mtime]
+    except OSError:
+        return [head, 0, 0]
+
+
+def build_package_index(gitrepo="."):
+    ## @brief Find all packages (directories with a CMakeLists.txt file) in the
+    #  git checkout, asking git for tracked and untracked (but not ignored) files
+    #  instead of walking the whole checkout
+    #  @param gitrepo Path to git repository
+    #  @return Dictionary of package name to sorted list of package paths
+    package_index = {}
+    try:
+        files = subprocess.check_output(["git", "ls-files", "-z", "--cached", "--others", "--exclude-standard",
+                                         "--", "CMakeLists.txt", "*/CMakeLists.txt"], cwd=gitrepo).split("\0")
+    except (OSError, subprocess.CalledProcessError) as e:
+        logger.warning("Failed to list files with git ({0}), walking the checkout instead".format(e))
+        files = []
+        for root, dirs, filenames in os.walk(gitrepo):
+            if ".git" in dirs:
+                dirs.remove(".git")
+            if "CMakeLists.txt" in filenames:
+                files.append(os.path.relpath(os.path.join(root, "CMakeLists.txt"), gitrepo))
+    for filename in files:
+        root = os.path.dirname(filename)
+        if root == "":
+            continue
+        package_index.setdefault(os.path.basename(root), set()).add(root)
+    return dict((package, sorted(paths)) for package, paths in package_index.iteritems())
+
+
+def load_package_index(gitrepo=".", required=[]):
+    ## @brief Return the package index, from the on disk cache if it is still valid
+    #  for the current HEAD and git index, otherwise rebuilding (and saving) it
+    #  @param gitrepo Path to git repository
+    #  @param required Package names that are expected in the index; if any
+    #  is missing from a cached index, the index is rebuilt (e.g., to pick up a new
+    #  untracked package)
+    #  @return Dictionary of package name to sorted list of package paths
+    index_file = os.path.join(svnpull_state_dir(gitrepo), "package-index.json")
+    key = package_index_key(gitrepo)
+    cached_key, cached_index = package_index_cache.get(os.path.abspath(gitrepo), (None, None))
+    if cached_key == key and not [ package for package in required if package not in cached_index ]:
+        logger.debug("Using package index already loaded")
+        return cached_index
+    try:
+        with open(index_file) as index_fh:
+            cached_index = json.load(index_fh)
+        if cached_index["key"] == key:
+            missing = [ package for package in required if package not in cached_index["packages"] ]
+            if not missing:
+                logger.debug("Using cached package index from {0}".format(index_file))
+                # JSON gives unicode strings, but paths should stay as byte strings
+                package_index = dict((package.encode("utf-8"), [ path.encode("utf-8") for path in paths ])
+                                     for package, paths in cached_index["packages"].iteritems())
+                package_index_cache[os.path.abspath(gitrepo)] = (key, package_index)
+                return package_index
+            logger.debug("Packages {0} not in cached index, rebuilding".format(missing))
+    except (IOError, ValueError, KeyError, TypeError):
+        pass
+    package_index = build_package_index(gitrepo)
+    try:
+        with open(index_file + ".tmp", "w") as index_fh:
+            json.dump({"key": key, "packages": package_index}, index_fh)
+        os.rename(index_file + ".tmp", index_file)
+    except (IOError, OSError) as e:
+        logger.warning("Failed to save package index to {0}: {1}".format(index_file, e))
+    package_index_cache[os.path.abspath(gitrepo)] = (key, package_index)
+    return package_index
+
+
+def find_duplicate_packages(package_index):
+    ## @brief Find package names that are used by more than one package path
+    #  @param package_index Dictionary of package name to package paths
+    #  @return Dictionary of duplicated package name to package paths
+    return dict((package, paths) for package, paths in package_index.iteritems() if len(paths) > 1)
+
+
+def map_package_names_to_paths(gitrepo=".", required=[]):
+    # # @brief Map package names to a source path
+    #  @param gitrepo Path to git repository
+    #  @param required Package names that are expected to be found
+    #  @return Dictionary of package name to package path mappings (if a name is
+    #  used by several packages, the first path in sorted order is used)
+    package_index = load_package_index(gitrepo, required)
+    return dict((package, paths[0]) for package, paths in package_index.iteritems())
+
+
+def get_svn_path_from_tag_name(svn_package, package_path_dict):
+    # # @brief Map a package's SVN tag name to a path in SVN from which
+    #  we will import the package
+    #  @return tuple with package name and SVN import path
+    if "+" in svn_package:
+        package, svn_path = svn_package.split("+", 1)
+        package_name = os.path.basename(package)
+        package_path_dict[package_name] = package
+        return package_name, package, svn_path
+    try:
+        package_name = svn_package.split("-")[0]
+        if svn_package in package_path_dict:
+            return svn_package, package_path_dict[svn_package], "trunk"
+        if svn_package.endswith("branch"):
+            return package_name, package_path_dict[package_name], os.path.join("branches", svn_package)
+        if re.search(r'(-\d\d){3,4}', svn_package):
+            return package_name, package_path_dict[package_name], os.path.join("tags", svn_package)
+    except KeyError:
+        pass
+    suggestions = [] if package_name in package_path_dict else difflib.get_close_matches(package_name,
+                                                                                         package_path_dict.keys())
+    logger.error("Failed to find a matching package path in your checkout "
+                 "for SVN package {0} or you used an invalid package specification "
+                 "(see --help). Make sure your git checkout "
+                 "contains the package you wish to pull an SVN revision onto "
+                 "(or use an advanced package specifier).{1}".format(
+                     svn_package, " Did you mean {0}?".format(" or ".join(suggestions)) if suggestions else ""))
+    sys.exit(2)
+
+
+class TagCatalog(object):
+    ## @brief Local catalog of the tags and branches of SVN packages, kept in an SQLite
+    #  database, so that package specifiers can be checked and resolved without going
+    #  to the SVN server each time
+    #
+    #  A package's tags and branches are listed from SVN (with their last changed
+    #  revisions) the first time they are needed, and listed again when the record is
+    #  older than the maximum age or a version is asked for that is not known. If SVN
+    #  cannot be reached, the last record is used.
+    def __init__(self, db_file, svnroot, max_age=24 * 3600):
+        ## @param db_file SQLite database file
+        #  @param svnroot Base path to SVN repository
+        #  @param max_age Time, in seconds, after which a package's record is refreshed
+        self.svnroot = svnroot
+        self.max_age = max_age
+        self.refreshed = set()
+        self.db = sqlite3.connect(db_file)
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS packages (svnroot TEXT, package TEXT, refreshed REAL, "
+                            "PRIMARY KEY (svnroot, package))")
+            self.db.execute("CREATE TABLE IF NOT EXISTS versions (svnroot TEXT, package TEXT, kind TEXT, "
+                            "name TEXT, revision INTEGER, PRIMARY KEY (svnroot, package, kind, name))")
+
+    def refresh(self, package):
+        ## @brief List a package's tags and branches from SVN and record them
+        #  @param package Path to package root
+        #  @return @c True if the package could be listed
+        self.refreshed.add(package)
+        try:
+            versions = svn_list_versions(self.svnroot, package)
+        except RuntimeError as e:
+            logger.warning("Failed to list the tags of {0} in SVN, using the last record ({1})".format(package, e))
+            return False
+        with self.db:
+            self.db.execute("DELETE FROM versions WHERE svnroot = ? AND package = ?", (self.svnroot, package))
+            self.db.executemany("INSERT INTO versions VALUES (?, ?, ?, ?, ?)",
+                                [ (self.svnroot, package, kind, name, revision) for kind, name, revision in versions ])
+            self.db.execute("INSERT OR REPLACE INTO packages VALUES (?, ?, ?)", (self.svnroot, package, time.time()))
+        return True
+
+    def versions(self, package, kind="tags", refresh=False):
+        ## @brief Get the versions of a package, refreshing the record if it is missing or old
+        #  @param package Path to package root
+        #  @param kind @c tags or @c branches
+        #  @param refresh If @c True refresh the record (unless that was already done in this run)
+        #  @return List of (name, last changed revision) tuples, or @c None if there is no record
+        row = self.db.execute("SELECT refreshed FROM packages WHERE svnroot = ? AND package = ?",
+                              (self.svnroot, package)).fetchone()
+        if package not in self.refreshed and (refresh or row is None or time.time() - row[0] > self.max_age):
+            if not self.refresh(package) and row is None:
+                return None
+        return [ (name.encode("utf-8"), revision) for name, revision in
+                 self.db.execute("SELECT name, revision FROM versions WHERE svnroot = ? AND package = ? AND kind = ?",
+                                 (self.svnroot, package, kind)) ]
+
+    def has_version(self, package, kind, name):
+        ## @brief Check if a package has a tag or branch
+        #  @param package Path to package root
+        #  @param kind @c tags or @c branches
+        #  @param name Tag or branch name
+        #  @return @c True or @c False, or @c None if it is not known
+        versions = self.versions(package, kind)
+        if versions is not None and name not in [ version for version, revision in versions ]:
+            # Maybe it is new
+            versions = self.versions(package, kind, refresh=True)
+        if versions is None:
+            return None
+        return name in [ version for version, revision in versions ]
+
+    def suggest(self, package, kind, name):
+        ## @brief Find the versions of a package closest to a misspelt name
+        #  @return List of names
+        return difflib.get_close_matches(name, [ version for version, revision in self.versions(package, kind) or [] ])
+
+    def latest_tag(self, package):
+        ## @brief Find the highest numbered tag of a package
+        #  @return Tag name, or @c None if the package has no tags
+        tags = self.versions(package)
+        if not tags:
+            return None
+        return max(tags, key=lambda tag: (tag_version_key(tag[0]), tag[1]))[0]
+
+    def tag_at_revision(self, package, revision):
+        ## @brief Find the latest tag of a package made at or before an SVN revision
+        #  @return Tag name, or @c None if there is no such tag
+        tags = [ tag for tag in self.versions(package) or [] if tag[1] <= revision ]
+        if not tags:
+            return None
+        return max(tags, key=lambda tag: (tag[1], tag_version_key(tag[0])))[0]
+
+    def close(self):
+        ## @brief Close the database
+        self.db.close()
+
+
+def tag_version_key(tag):
+    ## @brief Sort key putting the tags of a package in version order
+    #  @param tag Tag name
+    #  @return List of the numbers in the tag name
+    return [ int(n) for n in re.findall(r"\d+", tag) ]
+
+
+def svn_list_dirs(url):
+    ## @brief List the directories directly under an SVN URL
+    #  @param url SVN URL
+    #  @return List of (name, last changed revision) tuples
+    output = check_output_with_retry(["svn", "list", "--xml", url], retries=1, wait=3,
+                                     timeout=svn_command_options["timeout"], merge_stderr=False)
+    dirs = []
+    try:
+        for entry in ElementTree.fromstring(output).iter("entry"):
+            if entry.get("kind") == "dir":
+                dirs.append((entry.findtext("name").encode("utf-8"), int(entry.find("commit").get("revision"))))
+    except (ElementTree.ParseError, AttributeError, TypeError, ValueError):
+        raise RuntimeError("Could not parse svn list output for {0}".format(url))
+    return dirs
+
+
+def svn_list_versions(svnroot, package):
+    ## @brief List the tags and branches of a package in SVN
+    #  @param svnroot Base path to SVN repository
+    #  @param package Path to package root
+    #  @return List of (kind, name, last changed revision) tuples, where kind is
+    #  @c tags or @c branches
+    versions = []
+    # Not every package has branches (or even tags)
+    for kind, revision in svn_list_dirs(os.path.join(svnroot, package)):
+        if kind in ("tags", "branches"):
+            versions.extend((kind, name, revision) for name, revision in
+                            svn_list_dirs(os.path.join(svnroot, package, kind)))
+    return versions
+
+
+def resolve_catalog_specifier(svn_package, package_path_dict, tag_catalog):
+    ## @brief Turn a PACKAGE@latest or PACKAGE@rREVISION specifier into a tag name, using
+    #  the tag catalog
+    #  @param svn_package SVN package specifier
+    #  @param package_path_dict Dictionary of package name to package path
+    #  @param tag_catalog TagCatalog
+    #  @return Tag name
+    package_name, version = svn_package.split("@", 1)
+    if package_name not in package_path_dict:
+        get_svn_path_from_tag_name(package_name, package_path_dict)
+    package = package_path_dict[package_name]
+    if version == "latest":
+        tag = tag_catalog.latest_tag(package)
+    elif re.match(r"r?\d+$", version):
+        tag = tag_catalog.tag_at_revision(package, int(version.lstrip("r")))
+    else:
+        logger.error("Invalid package specifier {0}, use {1}@latest or {1}@rREVISION".format(svn_package,
+                                                                                           package_name))
+        sys.exit(2)
+    if not tag:
+        logger.error("Found no tag of {0} for {1}".format(package, svn_package))
+        sys.exit(2)
+    print "Resolved {0} to {1}".format(svn_package, tag)
+    return tag
+
+
+def expand_tag_range(svn_package, package_path_dict, tag_catalog):
+    ## @brief Expand a FIRSTTAG..LASTTAG specifier into all of the tags of the package from
+    #  FIRSTTAG to LASTTAG, in version order, using the tag catalog
+    #  @param svn_package SVN package specifier
+    #  @param package_path_dict Dictionary of package name to package path
+    #  @param tag_catalog TagCatalog
+    #  @return List of tag names
+    first, last = svn_package.split("..", 1)
+    package_name, package, svn_package_path = get_svn_path_from_tag_name(first, package_path_dict)
+    tags = tag_catalog.versions(package) if tag_catalog else None
+    if tags is None:
+        logger.error("The tags of {0} are not known, so {1} cannot be expanded".format(package, svn_package))
+        sys.exit(2)
+    selected = sorted([ tag for tag, revision in tags if tag.startswith(package_name + "-") and
+                        tag_version_key(first) <= tag_version_key(tag) <= tag_version_key(last) ],
+                      key=tag_version_key)
+    if not selected:
+        logger.error("Found no tags of {0} from {1} to {2}".format(package, first, last))
+        sys.exit(2)
+    print "Expanded {0} to {1} tags".format(svn_package, len(selected))
+    return selected
+
+
+def check_svn_version_exists(tag_catalog, svn_package, package, svn_package_path):
+    ## @brief Check that a tag or branch to import exists, using the tag catalog, exiting
+    #  with suggestions if it does not
+    #  @param tag_catalog TagCatalog
+    #  @param svn_package SVN package specifier
+    #  @param package Path to package root
+    #  @param svn_package_path Path to import, relative to the package root
+    kind, name = os.path.split(svn_package_path)
+    if kind not in ("tags", "branches"):
+        return
+    if tag_catalog.has_version(package, kind, name) is False:
+        suggestions = tag_catalog.suggest(package, kind, name)
+        logger.error("SVN package {0} has no {1} {2}{3}".format(package, kind[:-1] if kind == "tags" else "branch",
+                                                                name, ", did you mean {0}?".format(
+                                                                    " or ".join(suggestions)) if suggestions else ""))
+        sys.exit(2)
+
+
+def svn_co_tag_and_commit(svnroot, gitrepo, package, tag, full_clobber=True,
+                          svn_path_accept=[], svn_path_reject=[], revision=None,
+                          license_text=None, license_path_accept=[], license_path_reject=[],
+                          svn_export=True, wc_cache=None, sync=False, git_importer=None, license_cache=None,
+                          svn_prefilter=False):
+    ## @brief Make a temporary space, check out from svn, clean-up and copy into git checkout
+    #  @param svnroot Base path to SVN repository
+    #  @param gitrepo Path to git repository to import to
+    #  @param package Path to package root (in git and svn)
+    #  @param tag Package tag to import (i.e., path after base package path)
+    #  @param full_clobber If @c True then all current files are deleted, if false then
+    #  only newly imported files are copied to checkout
+    #  @param svn_path_accept Paths to force import to git
+    #  @param svn_path_reject Paths to force reject from the import
+    #  @param license_text List of strings containing the license text to add (if @c False, then no
+    #  license file is added)
+    #  @param revision Force SVN revision number
+    #  @param license_path_accept Paths to force include in license file addition
+    #  @param license_path_reject Paths to exclude from license file addition
+    #  @param svn_export If @c True use svn export, otherwise make a full svn checkout
+    #  @param wc_cache SvnWorkingCopyCache to fetch through (if @c None fetch directly)
+    #  @param sync If @c True only write the files that changed into the git checkout
+    #  @param git_importer GitFastImport to write the package to, instead of the git checkout
+    #  @param license_cache LicenseCache to look up licensed files in (or @c None)
+    #  @param svn_prefilter If @c True only fetch the files that are imported (see
+    #  svn_prefiltered_fetch())
+    package_files = []
+    tempdir = svn_prepare_package(svnroot, package, tag,
+                                  svn_path_accept=svn_path_accept, svn_path_reject=svn_path_reject,
+                                  revision=revision, license_text=license_text,
+                                  license_path_accept=license_path_accept,
+                                  license_path_reject=license_path_reject,
+                                  svn_export=svn_export, wc_cache=wc_cache,
+                                  copy_to=None if full_clobber or git_importer else gitrepo,
+                                  blob_writer=git_importer.blob_writer(package_files) if git_importer else None,
+                                  license_cache=license_cache, svn_prefilter=svn_prefilter)
+    try:
+        if git_importer:
+            git_importer.add_package(package, tag, package_files, full_clobber)
+        elif full_clobber:
+            with metrics_phase("sync"):
+                copy_package_to_git(tempdir, gitrepo, package, tag, full_clobber, sync=sync)
+    finally:
+        # Clean up
+        staging.remove(tempdir)
+
+
+def svn_prepare_package(svnroot, package, tag, svn_path_accept=[], svn_path_reject=[], revision=None,
+                        license_text=None, license_path_accept=[], license_path_reject=[],
+                        svn_export=True, wc_cache=None, copy_to=None, blob_writer=None, license_cache=None,
+                        svn_prefilter=False):
+    ## @brief Make a temporary space, check out from svn and clean-up, ready to be copied
+    #  into the git checkout (this part of the import can be run concurrently for many packages)
+    #  @param svnroot Base path to SVN repository
+    #  @param package Path to package root (in git and svn)
+    #  @param tag Package tag to import (i.e., path after base package path)
+    #  @param svn_path_accept Paths to force import to git
+    #  @param svn_path_reject Paths to force reject from the import
+    #  @param revision Force SVN revision number
+    #  @param license_text List of strings containing the license text to add (if @c False, then no
+    #  license file is added)
+    #  @param license_path_accept Paths to force include in license file addition
+    #  @param license_path_reject Paths to exclude from license file addition
+    #  @param svn_export If @c True use svn export, otherwise make a full svn checkout
+    #  @param wc_cache SvnWorkingCopyCache to fetch through (if @c None fetch directly)
+    #  @param copy_to If set, copy each file to this git checkout as soon as it is ready
+    #  (used when only some files are imported, instead of a full clobber)
+    #  @param blob_writer If set, pass each file that is kept to this function (see
+    #  process_svn_tree()) instead of licensing it in place
+    #  @param license_cache LicenseCache to look up licensed files in (or @c None)
+    #  @param svn_prefilter If @c True only fetch the files that are imported (see
+    #  svn_prefiltered_fetch()); ignored when fetching through @c wc_cache
+    #  @return Temporary directory holding the prepared package, which the caller must remove
+    msg = "Importing SVN path {0}/{1}".format(package, tag)
+    logger.info(msg)
+
+    tempdir = staging.mkdtemp()
+    try:
+        full_svn_path = os.path.join(tempdir, package)
+        with metrics_phase("fetch") as metrics:
+            rejected = rejected_size = 0
+            if wc_cache:
+                wc_cache.fetch(svnroot, package, tag, full_svn_path, revision=revision)
+            elif svn_prefilter:
+                rejected, rejected_size = svn_prefiltered_fetch(svnroot, package, tag, full_svn_path,
+                                                                PathFilter.cached(svn_path_accept, svn_path_reject),
+                                                                revision=revision)
+            else:
+                svn_fetch(svnroot, package, tag, full_svn_path, revision=revision, svn_export=svn_export)
+            if metrics:
+                files, size = tree_stats(tempdir)
+                metrics.add(files=files, bytes=size)
+                metrics.peak_tempdir_size = max(metrics.peak_tempdir_size, size)
+                # Files left out of the fetch count as rejected by the clean up
+                metrics.add("cleanup", files=rejected, bytes=rejected_size, rejected=rejected)
+
+        # Clean out directory of things we don't want to import and, if desired, inject
+        # a licence into the source code
+        with metrics_phase("cleanup") as metrics:
+            process_svn_tree(full_svn_path, svn_co_root=tempdir,
+                             path_filter=PathFilter.cached(svn_path_accept, svn_path_reject),
+                             license_text=license_text,
+                             license_filter=PathFilter.cached(license_path_accept, license_path_reject),
+                             copy_to=copy_to, blob_writer=blob_writer, license_cache=license_cache)
+            if metrics:
+                metrics.update_peak_tempdir_size(tempdir)
+    except:
+        staging.remove(tempdir)
+        raise
+    return tempdir
+
+
+def svn_fetch(svnroot, package, tag, dest, revision=None, svn_export=True):
+    ## @brief Fetch a package version from SVN
+    #
+    #  By default svn export is used, which writes only the versioned files and none
+    #  of the working copy metadata (that would double the data written and then have
+    #  to be deleted again); a checkout is only needed if the result must remain an
+    #  SVN working copy
+    #  @param svnroot Base path to SVN repository
+    #  @param package Path to package root (in git and svn)
+    #  @param tag Package tag to import (i.e., path after base package path)
+    #  @param dest Directory to fetch into (must not exist yet)
+    #  @param revision Force SVN revision number
+    #  @param svn_export If @c True use svn export, otherwise make a full svn checkout
+    if svn_export:
+        cmd = ["svn", "export"]
+        # Unlike checkout, export does not create missing parent directories
+        if not os.path.isdir(os.path.dirname(dest)):
+            os.makedirs(os.path.dirname(dest))
+    else:
+        cmd = ["svn", "checkout"]
+    if revision:
+        cmd.extend(["-r", str(revision)])
+    cmd.extend([os.path.join(svnroot, package, tag), dest])
+    check_output_with_retry(cmd, retries=1, wait=3, capture=False, timeout=svn_command_options["timeout"],
+                            progress=package if svn_command_options["progress"] else None)
+
+
+def svn_commit_revision(svnroot, package, tag, revision=None):
+    ## @brief Find the revision in which an SVN path was last changed
+    #  @param svnroot Base path to SVN repository
+    #  @param package Path to package root (in git and svn)
+    #  @param tag Package tag to import (i.e., path after base package path)
+    #  @param revision Look at this SVN revision instead of HEAD
+    #  @return Last changed revision number
+    url = os.path.join(svnroot, package, tag)
+    if revision:
+        url += "@{0}".format(revision)
+    return svn_info_commit_revision(url)
+
+
+def svn_info_commit_revision(target):
+    ## @brief Find the last changed revision of an SVN URL or working copy with svn info
+    #  @param target URL or working copy path
+    #  @return Last changed revision number
+    output = check_output_with_retry(["svn", "info", "--xml", target], retries=1, wait=3,
+                                     timeout=svn_command_options["timeout"], merge_stderr=False)
+    try:
+        return int(ElementTree.fromstring(output).find("entry/commit").get("revision"))
+    except (ElementTree.ParseError, AttributeError, TypeError, ValueError):
+        raise RuntimeError("Could not find the last changed revision of {0} in svn info output".format(target))
+
+
+## Size of a file in an SVN listing, standing in for the lstat() result svn_file_accepted() takes
+SvnListStat = collections.namedtuple("SvnListStat", ["st_size"])
+
+
+def svn_list_package(svnroot, package, tag, revision=None):
+    ## @brief List the files of a package version in SVN, without fetching them
+    #  @param svnroot Base path to SVN repository
+    #  @param package Path to package root (in git and svn)
+    #  @param tag Package tag to list (i.e., path after base package path)
+    #  @param revision List at this SVN revision instead of HEAD
+    #  @return Dictionary of file path, relative to the package root, to tuple of
+    #  size and last changed revision
+    url = "{0}@{1}".format(os.path.join(svnroot, package, tag), revision if revision else "HEAD")
+    output = check_output_with_retry(["svn", "list", "-R", "--xml", url], retries=1, wait=3,
+                                     timeout=svn_command_options["timeout"], merge_stderr=False)
+    svn_files = {}
+    try:
+        for entry in ElementTree.fromstring(output).iter("entry"):
+            if entry.get("kind") != "file":
+                continue
+            name = entry.findtext("name")
+            if isinstance(name, unicode):
+                name = name.encode("utf-8")
+            svn_files[name] = (int(entry.findtext("size")), int(entry.find("commit").get("revision")))
+    except (ElementTree.ParseError, AttributeError, TypeError, ValueError):
+        raise RuntimeError("Could not parse svn list output for {0}".format(url))
+    return svn_files
+
+
+def svn_list_properties(svnroot, package, tag, revision=None):
+    ## @brief Find the names of the SVN properties set on each path of a package version
+    #  @param svnroot Base path to SVN repository
+    #  @param package Path to package root (in git and svn)
+    #  @param tag Package tag to look at (i.e., path after base package path)
+    #  @param revision Look at this SVN revision instead of HEAD
+    #  @return Dictionary of path, relative to the package root (empty for the root
+    #  itself), to the set of property names set on it; paths without properties are
+    #  left out
+    url = os.path.join(svnroot, package, tag)
+    output = check_output_with_retry(["svn", "proplist", "-R", "--xml",
+                                      "{0}@{1}".format(url, revision if revision else "HEAD")],
+                                     retries=1, wait=3, timeout=svn_command_options["timeout"], merge_stderr=False)
+    properties = {}
+    try:
+        for target in ElementTree.fromstring(output).iter("target"):
+            path = target.get("path")
+            if isinstance(path, unicode):
+                path = path.encode("utf-8")
+            if path == url:
+                path = ""
+            elif path.startswith(url + "/"):
+                path = path[len(url) + 1:]
+            else:
+                continue
+            names = set(prop.get("name") for prop in target.iter("property"))
+            if names:
+                properties.setdefault(path, set()).update(names)
+    except (ElementTree.ParseError, AttributeError, TypeError):
+        raise RuntimeError("Could not parse svn proplist output for {0}".format(url))
+    return properties
+
+
+def svn_prefiltered_fetch(svnroot, package, tag, dest, path_filter, revision=None, batch_size=100):
+    ## @brief Fetch from SVN only the files of a package version that will be imported
+    #
+    #  The same rules as process_svn_tree() are applied to a recursive SVN listing
+    #  (which gives the file sizes), then only the files that pass are fetched into a
+    #  sparse checkout (made with --depth empty, then filled with svn update --parents).
+    #  Files are fetched anyway, leaving process_svn_tree() to decide, where the listing
+    #  cannot be trusted: symlinks, as a symlink to a directory is kept whatever its name,
+    #  and files with svn:keywords or svn:eol-style, as the listing gives the size before
+    #  keyword and end of line expansion, which can move a file across the size limit.
+    #  A listing does not show svn:externals, so a package with any is fetched whole.
+    #  The tree left after process_svn_tree() is then the same as for a full fetch.
+    #  @param svnroot Base path to SVN repository
+    #  @param package Path to package root (in git and svn)
+    #  @param tag Package tag to import (i.e., path after base package path)
+    #  @param dest Directory to fetch into (must not exist yet)
+    #  @param path_filter PathFilter for files to import to git
+    #  @param revision Force SVN revision number
+    #  @param batch_size Maximum number of files to update with one svn command
+    #  @return Tuple of the number and total size of files that were not fetched
+    svn_revision = revision if revision else svn_commit_revision(svnroot, package, tag)
+    properties = svn_list_properties(svnroot, package, tag, svn_revision)
+    if any("svn:externals" in names for names in properties.itervalues()):
+        logger.info("{0}/{1} has svn:externals, fetching the whole package".format(package, tag))
+        svn_fetch(svnroot, package, tag, dest, revision=svn_revision)
+        return 0, 0
+    svn_files = svn_list_package(svnroot, package, tag, svn_revision)
+    fetch = []
+    rejected = rejected_size = 0
+    for path, (size, last_changed) in sorted(svn_files.iteritems()):
+        names = properties.get(path, set())
+        if "svn:keywords" in names or "svn:eol-style" in names:
+            # Only the size after expansion is known for sure, so the size limit waits for the fetch
+            size_checked = 0
+        else:
+            size_checked = size
+        if "svn:special" in names or svn_file_accepted(os.path.join(package, path), os.path.basename(path),
+                                                       SvnListStat(size_checked), path_filter):
+            fetch.append(path)
+        else:
+            rejected += 1
+            rejected_size += size
+    if rejected == 0:
+        # Nothing to leave out, so an export of the whole package is fastest
+        svn_fetch(svnroot, package, tag, dest, revision=svn_revision)
+        return 0, 0
+    logger.info("Fetching {0} of {1} files of {2}/{3}".format(len(fetch), len(svn_files), package, tag))
+    timeout = svn_command_options["timeout"]
+    check_output_with_retry(["svn", "checkout", "--quiet", "--depth", "empty", "-r", str(svn_revision),
+                             "{0}@{1}".format(os.path.join(svnroot, package, tag), svn_revision), dest],
+                            retries=1, wait=3, capture=False, timeout=timeout)
+    for start in range(0, len(fetch), batch_size):
+        check_output_with_retry(["svn", "update", "--quiet", "--parents", "-r", str(svn_revision)] +
+                                [ os.path.join(dest, path) for path in fetch[start:start + batch_size] ],
+                                retries=1, wait=3, capture=False, timeout=timeout)
+    return rejected, rejected_size
+
+
+class SvnWorkingCopyCache(object):
+    ## @brief Persistent cache of SVN working copies, one per package path
+    #
+    #  A package fetched through the cache reuses the previous working copy of
+    #  that package with svn switch (which is just an update if the same SVN path
+    #  is requested again), so only the differences are transferred. A clean copy,
+    #  without the .svn metadata, is then staged for the rest of the import.
+    #
+    #  Each entry is protected by a lock file, so that concurrent svnpull runs
+    #  (or --jobs threads) sharing a cache do not corrupt it. When the cache grows
+    #  beyond its size limit the least recently used entries that are not in use
+    #  are removed.
+    def __init__(self, cache_dir, max_size=10 * 1024 * 1024 * 1024):
+        ## @param cache_dir Directory holding the cache
+        #  @param max_size Maximum size of the cache, in bytes
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_size = max_size
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    @contextlib.contextmanager
+    def _lock(self, lock_file, blocking=True):
+        ## @brief Hold an exclusive lock on a lock file
+        #  @param lock_file Path to lock file
+        #  @param blocking If @c False raise IOError if the lock is held elsewhere
+        with open(lock_file, "a") as lock_fh:
+            fcntl.flock(lock_fh, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_fh, fcntl.LOCK_UN)
+
+    def _entry_dir(self, package):
+        return os.path.join(self.cache_dir, urllib.quote(package, safe=""))
+
+    def _read_info(self, entry_dir):
+        try:
+            with open(os.path.join(entry_dir, "info.json")) as info_fh:
+                return json.load(info_fh)
+        except (IOError, ValueError):
+            return None
+
+    def _write_info(self, entry_dir, info):
+        info_file = os.path.join(entry_dir, "info.json")
+        with open(info_file + ".tmp", "w") as info_fh:
+            json.dump(info, info_fh)
+        os.rename(info_file + ".tmp", info_file)
+
+    def fetch(self, svnroot, package, tag, dest, revision=None):
+        ## @brief Update the cached working copy of a package to the requested version
+        #  and stage a copy of it, without SVN metadata
+        #  @param svnroot Base path to SVN repository
+        #  @param package Path to package root (in git and svn)
+        #  @param tag Package tag to import (i.e., path after base package path)
+        #  @param dest Directory to stage the package into (must not exist yet)
+        #  @param revision Force SVN revision number
+        entry_dir = self._entry_dir(package)
+        if not os.path.isdir(entry_dir):
+            os.makedirs(entry_dir)
+        url = os.path.join(svnroot, package, tag)
+        with self._lock(os.path.join(entry_dir, "lock")):
+            wc = os.path.join(entry_dir, "wc")
+            info = self._read_info(entry_dir)
+            switched = False
+            if info and info.get("svnroot") == svnroot and os.path.isdir(os.path.join(wc, ".svn")):
+                logger.info("Switching cached working copy of {0} to {1}".format(package, tag))
+                cmd = ["svn", "switch", "--ignore-ancestry"]
+                if revision:
+                    cmd.extend(["-r", str(revision)])
+                cmd.extend([url, wc])
+                try:
+                    # Tidy up after any interrupted operation first
+                    check_output_with_retry(["svn", "cleanup", wc], retries=0,
+                                            timeout=svn_command_options["timeout"])
+                    check_output_with_retry(cmd, retries=1, wait=3, capture=False,
+                                            timeout=svn_command_options["timeout"],
+                                            progress=package if svn_command_options["progress"] else None)
+                    switched = True
+                except RuntimeError as e:
+                    logger.warning("Failed to switch cached working copy of {0} ({1}), "
+                                   "making a new checkout".format(package, e))
+            if not switched:
+                # Mark the entry as invalid until the checkout completes
+                self._write_info(entry_dir, {})
+                shutil.rmtree(wc, ignore_errors=True)
+                svn_fetch(svnroot, package, tag, wc, revision=revision, svn_export=False)
+            self._write_info(entry_dir, {"package": package, "svnroot": svnroot, "tag": tag,
+                                         "revision": revision if revision else "HEAD",
+                                         "size": tree_stats(wc)[1], "last_used": time.time()})
+            shutil.copytree(wc, dest, symlinks=True, ignore=shutil.ignore_patterns(".svn"))
+        self.prune()
+
+    def entries(self):
+        ## @brief List cache entries
+        #  @return List of entry information dictionaries, least recently used first
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            entry_dir = os.path.join(self.cache_dir, name)
+            info = self._read_info(entry_dir)
+            if info:
+                info["entry_dir"] = entry_dir
+                entries.append(info)
+        entries.sort(key=lambda info: info["last_used"])
+        return entries
+
+    def prune(self, max_size=None):
+        ## @brief Remove least recently used entries until the cache fits in its size limit;
+        #  entries currently locked by another svnpull are skipped
+        #  @param max_size Size limit to prune to, in bytes (defaults to the cache's limit)
+        #  @return Number of entries removed
+        if max_size is None:
+            max_size = self.max_size
+        removed = 0
+        with self._lock(os.path.join(self.cache_dir, "prune.lock")):
+            entries = self.entries()
+            total_size = sum([ info["size"] for info in entries ])
+            for info in entries:
+                if total_size <= max_size:
+                    break
+                try:
+                    with self._lock(os.path.join(info["entry_dir"], "lock"), blocking=False):
+                        # The lock file is kept, so that waiting processes stay in step
+                        logger.info("Removing {0} from SVN working copy cache".format(info["package"]))
+                        os.unlink(os.path.join(info["entry_dir"], "info.json"))
+                        shutil.rmtree(os.path.join(info["entry_dir"], "wc"), ignore_errors=True)
+                except IOError:
+                    logger.debug("Cache entry for {0} is in use, not removing it".format(info["package"]))
+                    continue
+                total_size -= info["size"]
+                removed += 1
+        return removed
+
+
+class ImportJournal(object):
+    ## @brief Checkpoint journal of finished package imports, used to resume an
+    #  interrupted batch import
+    #
+    #  Each finished import is appended to the journal as one line of JSON giving the
+    #  package specifier, the resolved SVN path, its last changed revision, a key for
+    #  the import options, a fingerprint of the package files written into git and
+    #  the result. Lines are flushed as they are written, so that an import
+    #  that is killed part way keeps the record of every package it finished.
+    def __init__(self, gitrepo="."):
+        ## @param gitrepo Path to git repository
+        self.gitrepo = gitrepo
+        self.journal_file = os.path.join(svnpull_state_dir(gitrepo), "journal")
+        self.entries = {}
+        try:
+            with open(self.journal_file) as journal_fh:
+                for line in journal_fh:
+                    try:
+                        entry = json.loads(line)
+                        self.entries[entry["svn_package"].encode("utf-8")] = entry
+                    except (ValueError, KeyError, AttributeError):
+                        # Probably a line cut short by an interruption
+                        continue
+        except IOError:
+            pass
+
+    def is_done(self, svn_package, svn_path, svn_revision, options_key):
+        ## @brief Check if a package was already imported successfully from the same SVN
+        #  revision, with the same options, and its files in git are unchanged since
+        #  @param svn_package SVN package specifier
+        #  @param svn_path Resolved SVN path of the package version
+        #  @param svn_revision Last changed revision of the SVN path
+        #  @param options_key Key for the import options
+        #  @return @c True if the import can be skipped
+        entry = self.entries.get(svn_package)
+        if not entry or entry["result"] != "ok":
+            return False
+        return (entry["svn_path"] == svn_path and entry["svn_revision"] == svn_revision and
+                entry["options"] == options_key and
+                entry["fingerprint"] == package_tree_fingerprint(os.path.join(self.gitrepo, entry["package"])))
+
+    def record(self, svn_package, package, svn_path, svn_revision, options_key, error=None):
+        ## @brief Append the result of an import to the journal
+        #  @param svn_package SVN package specifier
+        #  @param package Path to package root (in git and svn)
+        #  @param svn_path Resolved SVN path of the package version
+        #  @param svn_revision Last changed revision of the SVN path
+        #  @param options_key Key for the import options
+        #  @param error Exception raised by the import, or @c None if it succeeded
+        entry = {"svn_package": svn_package, "package": package, "svn_path": svn_path,
+                 "svn_revision": svn_revision, "options": options_key,
+                 "fingerprint": package_tree_fingerprint(os.path.join(self.gitrepo, package)) if not error else None,
+                 "result": "failed: {0}".format(error) if error else "ok",
+                 "time": time.time()}
+        with open(self.journal_file, "a") as journal_fh:
+            journal_fh.write(json.dumps(entry) + "\n")
+            journal_fh.flush()
+            os.fsync(journal_fh.fileno())
+        self.entries[svn_package] = json.loads(json.dumps(entry))
+
+
+def import_options_key(svn_path_accept, svn_path_reject, license_text, license_path_accept, license_path_reject,
+                       full_clobber):
+    ## @brief Make a key for the options that change what an import writes into git
+    #  @return Hex digest of the options
+    options = [[ m.pattern for m in svn_path_accept ], [ m.pattern for m in svn_path_reject ],
+               license_text, [ m.pattern for m in license_path_accept ], [ m.pattern for m in license_path_reject ],
+               full_clobber]
+    return hashlib.sha1(json.dumps(options)).hexdigest()
+
+
+def package_tree_fingerprint(path):
+    ## @brief Fingerprint the files of a package from their names, sizes, modes and
+    #  modification times, so that a later change to any of them can be noticed
+    #  @param path Package directory
+    #  @return Hex digest, or @c None if the directory does not exist
+    if not os.path.isdir(path):
+        return None
+    fingerprint = hashlib.sha1()
+    for root, dirs, filenames in os.walk(path):
+        dirs.sort()
+        for name in sorted(filenames):
+            filename = os.path.join(root, name)
+            try:
+                fstat = os.lstat(filename)
+            except OSError:
+                continue
+            fingerprint.update("{0}\0{1}\0{2}\0{3}\n".format(os.path.relpath(filename, path), fstat.st_size,
+                                                              fstat.st_mode, fstat.st_mtime))
+    return fingerprint.hexdigest()
+
+
+class StagingManager(object):
+    ## @brief Hands out the temporary directories packages are prepared in, and makes
+    #  sure they are removed again
+    #
+    #  Once set up for a git repository, directories are made under .git/svnpull/tmp,
+    #  which is on the same filesystem as the checkout, so that moving a prepared
+    #  package into place is a rename and copies can share data blocks (see copy_file()).
+    #  Every directory handed out is remembered, so that cleanup() can remove anything
+    #  left behind by an error or interruption, and directories left by svnpull
+    #  processes that no longer exist are removed by setup().
+    def __init__(self):
+        self.staging_dir = None
+        self.tempdirs = set()
+        self.lock = threading.Lock()
+
+    def setup(self, gitrepo="."):
+        ## @brief Stage under the given git repository from now on
+        #  @param gitrepo Path to git repository
+        try:
+            staging_dir = os.path.join(svnpull_state_dir(gitrepo), "tmp")
+            if not os.path.isdir(staging_dir):
+                os.makedirs(staging_dir)
+        except OSError as e:
+            logger.warning("Failed to make staging area in {0}, using the system temporary "
+                           "directory: {1}".format(gitrepo, e))
+            return
+        self.staging_dir = os.path.abspath(staging_dir)
+        for name in os.listdir(self.staging_dir):
+            try:
+                pid = int(name.split("-")[1])
+                os.kill(pid, 0)
+            except (IndexError, ValueError):
+                continue
+            except OSError as e:
+                if e.errno == errno.ESRCH:
+                    logger.info("Removing staging directory {0} left by an earlier svnpull".format(name))
+                    shutil.rmtree(os.path.join(self.staging_dir, name), ignore_errors=True)
+
+    def mkdtemp(self):
+        ## @brief Make a new temporary directory
+        #  @return Path to directory
+        tempdir = tempfile.mkdtemp(prefix="svnpull-{0}-".format(os.getpid()), dir=self.staging_dir)
+        with self.lock:
+            self.tempdirs.add(tempdir)
+        return tempdir
+
+    def remove(self, tempdir):
+        ## @brief Remove a temporary directory made by mkdtemp()
+        #  @param tempdir Path to directory
+        shutil.rmtree(tempdir, ignore_errors=True)
+        with self.lock:
+            self.tempdirs.discard(tempdir)
+
+    def cleanup(self):
+        ## @brief Remove every temporary directory that is still there
+        for tempdir in list(self.tempdirs):
+            self.remove(tempdir)
+
+
+## Staging area used for all imports (set up for the git repository by main())
+staging = StagingManager()
+
+## ioctl() request to make a file share the data blocks of another (Linux FICLONE)
+FICLONE = 0x40049409
+
+## Pairs of (source, destination) devices on which FICLONE has failed
+reflink_unsupported = set()
+
+
+def copy_file(src, dst):
+    ## @brief Copy a file's content, as a reflink (a copy sharing the same data blocks,
+    #  which costs no I/O) if the filesystem supports it, or else by copying the data
+    #  @param src Source file
+    #  @param dst Destination file (overwritten, but keeping its inode, if it exists)
+    with open(src, "rb") as src_fh:
+        with open(dst, "wb") as dst_fh:
+            devices = (os.fstat(src_fh.fileno()).st_dev, os.fstat(dst_fh.fileno()).st_dev)
+            if devices not in reflink_unsupported:
+                try:
+                    fcntl.ioctl(dst_fh.fileno(), FICLONE, src_fh.fileno())
+                    return
+                except IOError as e:
+                    logger.debug("No reflink copy from {0} to {1}: {2}".format(src, dst, e))
+                    reflink_unsupported.add(devices)
+            shutil.copyfileobj(src_fh, dst_fh, 1024 * 1024)
+
+
+def copy_file_and_stat(src, dst):
+    ## @brief Copy a file's content with copy_file(), then its mode and times
+    #  (like shutil.copy2())
+    #  @param src Source file
+    #  @param dst Destination file
+    copy_file(src, dst)
+    shutil.copystat(src, dst)
+
+
+def tree_stats(path):
+    ## @brief Count the files under a directory, and their total size
+    #  @param path Directory to measure
+    #  @return Tuple of number of files and size in bytes
+    files = size = 0
+    for root, dirs, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                size += os.lstat(os.path.join(root, name)).st_size
+                files += 1
+            except OSError:
+                pass
+    return files, size
+
+
+def copy_package_to_git(tempdir, gitrepo, package, tag, full_clobber=True, sync=False):
+    ## @brief Copy a prepared package from its temporary space into the git checkout
+    #  @param tempdir Temporary directory returned by svn_prepare_package()
+    #  @param gitrepo Path to git repository to import to
+    #  @param package Path to package root (in git and svn)
+    #  @param tag Package tag being imported (only used for messages)
+    #  @param full_clobber If @c True then all current files are deleted, if false then
+    #  only newly imported files are copied to checkout
+    #  @param sync If @c True (and @c full_clobber) then only files that differ are
+    #  written or deleted, so unchanged files keep their timestamps and do not trigger
+    #  rebuilds
+    full_svn_path = os.path.join(tempdir, package)
+    full_git_path = os.path.join(gitrepo, package)
+    package_root, package_name = os.path.split(full_git_path)
+    if not os.path.isdir(full_svn_path):
+        # Everything was filtered out of the import
+        logger.warning("Nothing left to import from {0} after filtering".format(os.path.join(package, tag)))
+        return
+    metrics = ImportMetrics.current()
+    if metrics:
+        files, size = tree_stats(full_svn_path)
+        metrics.add("sync", files=files, bytes=size)
+    if full_clobber and sync:
+        # The same rule for packagedoc.h as below - never delete it if it
+        # is not in the SVN pull area
+        changes = sync_tree(full_svn_path, full_git_path, keep=[os.path.join("doc", "packagedoc.h")])
+        print "Synchronised {0} with {1}: {2} files written, {3} deleted, {4} mode changes, {5} unchanged".format(
+            package, tag, changes["written"], changes["deleted"], changes["chmod"], changes["unchanged"])
+    elif full_clobber:
+        try:
+            # We need to be a little more sophisticated here,
+            # as the doxygen change on the master branch of
+            # git rewrote docs/mainpage.h to docs/packagedoc.h
+            # So we do need to keep that file as least, if it is
+            # not in the SVN pull area
+            pkgdoc = os.path.join(package, "doc", "packagedoc.h")
+            if os.access(pkgdoc, os.R_OK):
+                dest_dir = os.path.join(full_svn_path, "doc")
+                if not os.access(os.path.join(dest_dir, "packagedoc.h"), os.R_OK):
+                    try:
+                        os.makedirs(os.path.join(full_svn_path, "doc"))
+                    except OSError:
+                        pass
+                    copy_file_and_stat(pkgdoc, os.path.join(dest_dir, "packagedoc.h"))
+                    logger.info("Doxygen file packagedoc.h was backed up before overwrite")
+            shutil.rmtree(full_git_path, ignore_errors=True)
+            os.makedirs(package_root)
+        except OSError:
+            pass
+        logger.info("Replacing complete current git checkout with {0}".format(os.path.join(package, tag)))
+        shutil.move(full_svn_path, package_root)
+    else:
+        for root, dirs, files in os.walk(full_svn_path):
+            for name in files:
+                src_filename = os.path.join(root, name)
+                dst_filename = os.path.join(gitrepo, src_filename[len(tempdir) + 1:])
+                logger.info("Pulling {0} into git checkout".format(dst_filename))
+                if not os.path.isdir(os.path.dirname(dst_filename)):
+                    os.makedirs(os.path.dirname(dst_filename))
+                copy_file_and_stat(src_filename, dst_filename)
+
+
+def sync_tree(src, dst, keep=[], changes=None, relpath=""):
+    ## @brief Make a directory tree identical to another, but only writing, deleting
+    #  or chmod-ing the files that actually differ (unchanged files keep their inode and
+    #  timestamps)
+    #  @param src Source directory (@c None means an empty directory)
+    #  @param dst Destination directory
+    #  @param keep Paths, relative to @c dst, that are not deleted even if they are not in @c src
+    #  @param changes Dictionary of counts of changes to update (used in recursion)
+    #  @param relpath Path of @c dst relative to the top of the tree (used in recursion)
+    #  @return Dictionary with the number of files @c written, @c deleted, given a new
+    #  mode (@c chmod) and @c unchanged
+    if changes is None:
+        changes = {"written": 0, "deleted": 0, "chmod": 0, "unchanged": 0}
+    if os.path.islink(dst) or (os.path.exists(dst) and not os.path.isdir(dst)):
+        os.remove(dst)
+        changes["deleted"] += 1
+    if not os.path.isdir(dst):
+        os.makedirs(dst)
+    src_entries = dict((name, (filename, fstat)) for name, filename, fstat in scan_dir(src)) if src else {}
+    for name, dst_filename, dst_stat in scan_dir(dst):
+        dst_relpath = os.path.join(relpath, name)
+        if name in src_entries or dst_relpath in keep:
+            continue
+        if stat.S_ISDIR(dst_stat.st_mode) and [ path for path in keep if path.startswith(dst_relpath + os.sep) ]:
+            # Only remove what is not kept from this directory
+            sync_tree(None, dst_filename, keep, changes, dst_relpath)
+            continue
+        logger.debug("Removing {0}".format(dst_relpath))
+        if stat.S_ISDIR(dst_stat.st_mode):
+            for root, dirs, files in os.walk(dst_filename):
+                changes["deleted"] += len(files)
+            shutil.rmtree(dst_filename)
+        else:
+            os.remove(dst_filename)
+            changes["deleted"] += 1
+    for name, (src_filename, src_stat) in src_entries.iteritems():
+        dst_filename = os.path.join(dst, name)
+        if stat.S_ISDIR(src_stat.st_mode):
+            sync_tree(src_filename, dst_filename, keep, changes, os.path.join(relpath, name))
+        else:
+            sync_file(src_filename, src_stat, dst_filename, changes)
+    return changes
+
+
+def sync_file(src_filename, src_stat, dst_filename, changes):
+    ## @brief Update a file (or softlink) only if it differs from its source,
+    #  comparing the size first and then the content
+    #  @param src_filename Source file
+    #  @param src_stat lstat() result for the source file
+    #  @param dst_filename Destination file
+    #  @param changes Dictionary of counts of changes to update
+    try:
+        dst_stat = os.lstat(dst_filename)
+    except OSError:
+        dst_stat = None
+    if stat.S_ISLNK(src_stat.st_mode):
+        if dst_stat and stat.S_ISLNK(dst_stat.st_mode) and os.readlink(src_filename) == os.readlink(dst_filename):
+            changes["unchanged"] += 1
+            return
+    elif dst_stat and stat.S_ISREG(dst_stat.st_mode) and dst_stat.st_size == src_stat.st_size and \
+            filecmp.cmp(src_filename, dst_filename, shallow=False):
+        if stat.S_IMODE(dst_stat.st_mode) != stat.S_IMODE(src_stat.st_mode):
+            os.chmod(dst_filename, stat.S_IMODE(src_stat.st_mode))
+            changes["chmod"] += 1
+        else:
+            changes["unchanged"] += 1
+        return
+    logger.debug("Updating {0}".format(dst_filename))
+    if dst_stat and stat.S_ISDIR(dst_stat.st_mode):
+        shutil.rmtree(dst_filename)
+    elif dst_stat and not stat.S_ISREG(dst_stat.st_mode):
+        os.remove(dst_filename)
+    if stat.S_ISLNK(src_stat.st_mode):
+        if dst_stat and stat.S_ISREG(dst_stat.st_mode):
+            os.remove(dst_filename)
+        os.symlink(os.readlink(src_filename), dst_filename)
+    else:
+        # Rewrite in place, so the file gets a new modification time
+        copy_file(src_filename, dst_filename)
+        os.chmod(dst_filename, stat.S_IMODE(src_stat.st_mode))
+    changes["written"] += 1
+
+
+## Above this number of changed files (or more changed than unchanged files), a delta import
+#  fetches the whole package instead of one file at a time
+delta_fetch_limit = 50
+
+
+def make_delta_plan(svnroot, gitrepo, package, tag, svn_path_accept=[], svn_path_reject=[], revision=None,
+                    license_text=None, license_path_accept=[], license_path_reject=[]):
+    ## @brief Work out which files of a package have to be fetched from SVN to bring the
+    #  git checkout up to date with a package version
+    #
+    #  SVN does not give the checksum of a file without fetching it, so a file is taken
+    #  to be unchanged if its size and last changed revision in SVN are the same as
+    #  when it was last imported (as recorded by save_delta_state()) and the imported file
+    #  in git, including any license added to it, has not been touched since. Symlinks
+    #  are always fetched, as one that gets a license is imported as a copy of its
+    #  target, which can change while the symlink does not. As for svn_prefiltered_fetch(),
+    #  files with svn:keywords or svn:eol-style are not filtered on their listed size, and
+    #  a package with svn:externals (which the listing does not show) is fetched whole.
+    #  @param svnroot Base path to SVN repository
+    #  @param gitrepo Path to git repository
+    #  @param package Path to package root (in git and svn)
+    #  @param tag Package tag to import (i.e., path after base package path)
+    #  @param svn_path_accept Paths to force import to git
+    #  @param svn_path_reject Paths to force reject from the import
+    #  @param revision Force SVN revision number
+    #  @param license_text List of strings containing the license text to add
+    #  @param license_path_accept Paths to force include in license file addition
+    #  @param license_path_reject Paths to exclude from license file addition
+    #  @return Dictionary describing the plan: @c fetch is a list of (path, size) of files
+    #  to fetch, @c delete and @c unchanged are lists of paths and @c filtered is the number
+    #  of SVN files that are not imported; @c full is @c True if there is no usable record of a
+    #  previous import or the package has svn:externals (when @c externals is also @c True),
+    #  so the whole package has to be fetched. The SVN revision, the SVN listing and the key
+    #  for the import options are also given, as @c svn_revision, @c svn_files and @c options
+    path_filter = PathFilter.cached(svn_path_accept, svn_path_reject)
+    options_key = import_options_key(svn_path_accept, svn_path_reject, license_text, license_path_accept,
+                                     license_path_reject, True)
+    svn_revision = revision if revision else svn_commit_revision(svnroot, package, tag)
+    svn_files = svn_list_package(svnroot, package, tag, svn_revision)
+    properties = svn_list_properties(svnroot, package, tag, svn_revision)
+    externals = any("svn:externals" in names for names in properties.itervalues())
+    state = load_delta_state(gitrepo, package)
+    full = state is None or state["options"] != options_key or externals
+    plan = {"fetch": [], "delete": [], "unchanged": [], "filtered": 0, "full": full, "externals": externals,
+            "svn_revision": svn_revision, "svn_files": svn_files, "options": options_key}
+    accepted = set()
+    for path, (size, last_changed) in sorted(svn_files.iteritems()):
+        names = properties.get(path, set())
+        if "svn:keywords" in names or "svn:eol-style" in names:
+            # The listed size is before expansion, so the size limit waits for the fetch
+            size_checked = 0
+        else:
+            size_checked = size
+        if not svn_file_accepted(os.path.join(package, path), os.path.basename(path), SvnListStat(size_checked),
+                                 path_filter):
+            plan["filtered"] += 1
+            continue
+        accepted.add(path)
+        recorded = None if full or "svn:special" in names else state["files"].get(path)
+        if recorded and recorded[:2] == [size, last_changed]:
+            try:
+                git_stat = os.lstat(os.path.join(gitrepo, package, path))
+                if [git_stat.st_size, git_stat.st_mtime] == recorded[2:]:
+                    plan["unchanged"].append(path)
+                    continue
+            except OSError:
+                pass
+        plan["fetch"].append((path, size))
+    # Everything else goes, as in a full clobber, except packagedoc.h
+    full_git_path = os.path.join(gitrepo, package)
+    for root, dirs, filenames in os.walk(full_git_path):
+        for name in filenames + [ name for name in dirs if os.path.islink(os.path.join(root, name)) ]:
+            path = os.path.relpath(os.path.join(root, name), full_git_path)
+            if path not in accepted and path != os.path.join("doc", "packagedoc.h"):
+                plan["delete"].append(path)
+    plan["delete"].sort()
+    return plan
+
+
+def print_delta_plan(svn_package, plan):
+    ## @brief Print what a delta import would change
+    #  @param svn_package SVN package specifier
+    #  @param plan Plan from make_delta_plan()
+    fetch_size = sum(size for path, size in plan["fetch"])
+    if plan["externals"]:
+        print "{0}: has svn:externals, the whole package would be fetched".format(svn_package)
+        return
+    if plan["full"]:
+        print "{0}: no record of a previous import with the same options, all {1} files ({2:.2f}MB) " \
+            "would be fetched".format(svn_package, len(plan["fetch"]), fetch_size / 1024.0 / 1024)
+        return
+    print "{0}: {1} files to fetch ({2:.2f}MB), {3} to delete, {4} unchanged, {5} filtered out{6}".format(
+        svn_package, len(plan["fetch"]), fetch_size / 1024.0 / 1024, len(plan["delete"]), len(plan["unchanged"]),
+        plan["filtered"], " (the whole package would be fetched)" if delta_plan_is_full(plan) else "")
+    for path, size in plan["fetch"]:
+        print "  fetch  {0} ({1} bytes)".format(path, size)
+    for path in plan["delete"]:
+        print "  delete {0}".format(path)
+
+
+def delta_plan_is_full(plan):
+    ## @brief Decide if a delta import should fetch the whole package, as there is
+    #  no record of the last import or too many files changed
+    #  @param plan Plan from make_delta_plan()
+    #  @return @c True if the whole package should be fetched
+    return plan["full"] or len(plan["fetch"]) > max(delta_fetch_limit, len(plan["unchanged"]))
+
+
+def svn_delta_import(svnroot, gitrepo, package, tag, svn_path_accept=[], svn_path_reject=[], revision=None,
+                     license_text=None, license_path_accept=[], license_path_reject=[],
+                     svn_export=True, wc_cache=None, sync=False, license_cache=None, svn_prefilter=False):
+    ## @brief Import a package, fetching from SVN only the files that changed since the last
+    #  import of the package (or the whole package, if that is better)
+    #  @param svnroot Base path to SVN repository
+    #  @param gitrepo Path to git repository to import to
+    #  @param package Path to package root (in git and svn)
+    #  @param tag Package tag to import (i.e., path after base package path)
+    #  @param svn_path_accept Paths to force import to git
+    #  @param svn_path_reject Paths to force reject from the import
+    #  @param revision Force SVN revision number
+    #  @param license_text List of strings containing the license text to add
+    #  @param license_path_accept Paths to force include in license file addition
+    #  @param license_path_reject Paths to exclude from license file addition
+    #  @param svn_export If @c True use svn export, otherwise make a full svn checkout
+    #  (for fetching the whole package)
+    #  @param wc_cache SvnWorkingCopyCache to fetch through (for fetching the whole package)
+    #  @param sync If @c True only write the files that changed into the git checkout
+    #  (for fetching the whole package)
+    #  @param license_cache LicenseCache to look up licensed files in (or @c None)
+    #  @param svn_prefilter If @c True only fetch the files that are imported, when fetching
+    #  the whole package
+    with metrics_phase("plan"):
+        plan = make_delta_plan(svnroot, gitrepo, package, tag, svn_path_accept=svn_path_accept,
+                               svn_path_reject=svn_path_reject, revision=revision, license_text=license_text,
+                               license_path_accept=license_path_accept, license_path_reject=license_path_reject)
+    if delta_plan_is_full(plan):
+        svn_co_tag_and_commit(svnroot, gitrepo, package, tag, svn_path_accept=svn_path_accept,
+                              svn_path_reject=svn_path_reject, revision=plan["svn_revision"],
+                              license_text=license_text, license_path_accept=license_path_accept,
+                              license_path_reject=license_path_reject, svn_export=svn_export,
+                              wc_cache=wc_cache, sync=sync, license_cache=license_cache,
+                              svn_prefilter=svn_prefilter)
+    else:
+        logger.info("Importing SVN path {0}/{1} by fetching {2} changed files".format(package, tag,
+                                                                                      len(plan["fetch"])))
+        tempdir = staging.mkdtemp()
+        try:
+            with metrics_phase("fetch") as metrics:
+                fetch = list(plan["fetch"])
+                fetched = set(path for path, size in fetch)
+                for path, size in fetch:
+                    dest = os.path.join(tempdir, package, path)
+                    if not os.path.isdir(os.path.dirname(dest)):
+                        os.makedirs(os.path.dirname(dest))
+                    check_output_with_retry(["svn", "export", "{0}@{1}".format(os.path.join(svnroot, package, tag, path),
+                                                                              plan["svn_revision"]), dest],
+                                            retries=1, wait=3, capture=False, timeout=svn_command_options["timeout"])
+                    if metrics:
+                        metrics.add(files=1, bytes=size)
+                    if os.path.islink(dest):
+                        # The target is needed to license the symlink (and is imported again)
+                        target = os.path.normpath(os.path.join(os.path.dirname(path), os.readlink(dest)))
+                        if target in plan["svn_files"] and target not in fetched:
+                            fetched.add(target)
+                            fetch.append((target, plan["svn_files"][target][0]))
+                if metrics:
+                    metrics.add("cleanup", rejected=plan["filtered"])
+            # Delete first, in case a file is replaced by a directory of the same name
+            with metrics_phase("sync"):
+                full_git_path = os.path.join(gitrepo, package)
+                for path in plan["delete"]:
+                    logger.debug("Removing {0}".format(path))
+                    os.remove(os.path.join(full_git_path, path))
+                for root, dirs, filenames in os.walk(full_git_path, topdown=False):
+                    if root != full_git_path and not os.listdir(root):
+                        os.rmdir(root)
+            if plan["fetch"]:
+                with metrics_phase("cleanup"):
+                    process_svn_tree(os.path.join(tempdir, package), svn_co_root=tempdir,
+                                     path_filter=PathFilter.cached(svn_path_accept, svn_path_reject),
+                                     license_text=license_text,
+                                     license_filter=PathFilter.cached(license_path_accept, license_path_reject),
+                                     copy_to=gitrepo, license_cache=license_cache, copy_symlinks=True)
+        finally:
+            staging.remove(tempdir)
+        print "Updated {0} to {1}: {2} files fetched, {3} deleted, {4} unchanged".format(
+            package, tag, len(plan["fetch"]), len(plan["delete"]), len(plan["unchanged"]))
+    save_delta_state(gitrepo, package, plan["options"], plan["svn_files"])
+
+
+## Status columns and path of a line of svn update or switch output
+svn_update_line = re.compile(r"([ADUCGER ])([ UCG])[ B][ C] (.+)$")
+
+
+class SvnTagReplay(object):
+    ## @brief Imports a sequence of tags of one package into git, one commit per tag,
+    #  moving a single SVN working copy from tag to tag
+    #
+    #  The first tag is checked out and imported in full. Each later tag is reached with
+    #  svn switch, which transfers only the differences, and only the files it reports
+    #  as changed are cleaned up, licensed and copied into the git checkout (files it
+    #  deletes, or that are now filtered out, are removed from git). Symlinks to files
+    #  are always imported again, as a symlink that gets a license is replaced by a copy
+    #  of its target, which may have changed, and doc/packagedoc.h is kept if SVN
+    #  deletes it, as in a full import. Each tag is then committed to the current
+    #  branch, with the tag name and its SVN revision in the message.
+    def __init__(self, svnroot, gitrepo, package, svn_path_accept=[], svn_path_reject=[], revision=None,
+                 license_text=None, license_path_accept=[], license_path_reject=[], license_cache=None):
+        ## @param svnroot Base path to SVN repository
+        #  @param gitrepo Path to git repository to import to
+        #  @param package Path to package root (in git and svn)
+        #  @param svn_path_accept Paths to force import to git
+        #  @param svn_path_reject Paths to force reject from the import
+        #  @param revision Force SVN revision number
+        #  @param license_text List of strings containing the license text to add
+        #  @param license_path_accept Paths to force include in license file addition
+        #  @param license_path_reject Paths to exclude from license file addition
+        #  @param license_cache LicenseCache to look up licensed files in (or @c None)
+        self.svnroot = svnroot
+        self.gitrepo = gitrepo
+        self.package = package
+        self.revision = revision
+        self.process_args = {"path_filter": PathFilter.cached(svn_path_accept, svn_path_reject),
+                             "license_text": license_text,
+                             "license_filter": PathFilter.cached(license_path_accept, license_path_reject),
+                             "license_cache": license_cache}
+        self.tempdir = staging.mkdtemp()
+        self.wc = os.path.join(self.tempdir, "wc")
+
+    def import_tag(self, tag):
+        ## @brief Move to the next tag, bring the git checkout into line with it and commit
+        #  @param tag Package tag to import (i.e., path after base package path)
+        #  @return Tuple of git commit hash (or @c None if the tag changed nothing in git) and
+        #  SVN revision of the tag
+        scratch = os.path.join(self.tempdir, "scratch")
+        shutil.rmtree(scratch, ignore_errors=True)
+        full_svn_path = os.path.join(scratch, self.package)
+        if not os.path.isdir(self.wc):
+            with metrics_phase("fetch") as metrics:
+                svn_fetch(self.svnroot, self.package, tag, self.wc, revision=self.revision, svn_export=False)
+                shutil.copytree(self.wc, full_svn_path, symlinks=True, ignore=shutil.ignore_patterns(".svn"))
+                if metrics:
+                    files, size = tree_stats(full_svn_path)
+                    metrics.add(files=files, bytes=size)
+            with metrics_phase("cleanup"):
+                process_svn_tree(full_svn_path, svn_co_root=scratch, **self.process_args)
+            with metrics_phase("sync"):
+                copy_package_to_git(scratch, self.gitrepo, self.package, tag, sync=True)
+        else:
+            with metrics_phase("fetch") as metrics:
+                changed, deleted = self.switch(tag)
+                changed.extend(path for path in self.file_symlinks() if path not in changed)
+                for path in changed:
+                    self.stage(path, full_svn_path)
+                if metrics:
+                    metrics.add(files=len(changed), bytes=tree_stats(scratch)[1])
+            with metrics_phase("sync"):
+                full_git_path = os.path.join(self.gitrepo, self.package)
+                # Files changed in SVN are written again (if they are still imported); as
+                # in copy_package_to_git(), doc/packagedoc.h is kept if SVN deletes it
+                pkgdoc = os.path.join("doc", "packagedoc.h")
+                for path in deleted + changed:
+                    git_path = os.path.join(full_git_path, path)
+                    if os.path.isdir(git_path) and not os.path.islink(git_path):
+                        if path == os.path.dirname(pkgdoc) and path in deleted:
+                            for name in os.listdir(git_path):
+                                doc_path = os.path.join(git_path, name)
+                                if name == os.path.basename(pkgdoc):
+                                    continue
+                                elif os.path.isdir(doc_path) and not os.path.islink(doc_path):
+                                    shutil.rmtree(doc_path)
+                                else:
+                                    os.remove(doc_path)
+                        elif path in deleted:
+                            shutil.rmtree(git_path)
+                    elif os.path.lexists(git_path) and not (path == pkgdoc and path in deleted):
+                        os.remove(git_path)
+            if os.path.isdir(full_svn_path):
+                with metrics_phase("cleanup"):
+                    process_svn_tree(full_svn_path, svn_co_root=scratch, copy_to=self.gitrepo, copy_symlinks=True,
+                                     **self.process_args)
+            for root, dirs, filenames in os.walk(full_git_path, topdown=False):
+                if root != full_git_path and not os.listdir(root):
+                    os.rmdir(root)
+            print "Switched {0} to {1}: {2} files changed, {3} deleted".format(self.package, tag, len(changed),
+                                                                              len(deleted))
+        svn_revision = svn_info_commit_revision(self.wc)
+        with metrics_phase("commit"):
+            commit = git_commit_package(self.gitrepo, self.package,
+                                        "{0} imported from SVN\n\nSVN path {1} at revision {2}\n".format(
+                                            os.path.basename(tag), os.path.join(self.package, tag), svn_revision))
+        if commit:
+            print "Committed {0} (SVN revision {1}) as {2}".format(os.path.basename(tag), svn_revision, commit[:12])
+        else:
+            print "{0} (SVN revision {1}) changes nothing in git, no commit made".format(os.path.basename(tag),
+                                                                                      svn_revision)
+        return commit, svn_revision
+
+    def switch(self, tag):
+        ## @brief Switch the working copy to another tag
+        #  @param tag Package tag to switch to
+        #  @return Tuple of lists of paths, relative to the package root, of files changed
+        #  or added and of files and directories deleted
+        cmd = ["svn", "switch"]
+        if self.revision:
+            cmd.extend(["-r", str(self.revision)])
+        cmd.extend([os.path.join(self.svnroot, self.package, tag), self.wc])
+        output = check_output_with_retry(cmd, retries=1, wait=3, timeout=svn_command_options["timeout"],
+                                         merge_stderr=False)
+        changed = []
+        deleted = []
+        for line in output.splitlines():
+            m = svn_update_line.match(line)
+            if not m or m.group(1) == m.group(2) == " ":
+                continue
+            path = os.path.relpath(os.path.join(self.wc, m.group(3)), self.wc)
+            if path == "." or path.startswith(".." + os.sep):
+                continue
+            if m.group(1) == "D":
+                deleted.append(path)
+            elif os.path.lexists(os.path.join(self.wc, path)):
+                changed.append(path)
+        return changed, deleted
+
+    def file_symlinks(self):
+        ## @brief Find the symlinks in the working copy that are not symlinks to directories
+        #  @return List of paths relative to the package root
+        links = []
+        for root, dirs, filenames in os.walk(self.wc):
+            if ".svn" in dirs:
+                dirs.remove(".svn")
+            for name in filenames:
+                filename = os.path.join(root, name)
+                if os.path.islink(filename):
+                    links.append(os.path.relpath(filename, self.wc))
+        return links
+
+    def stage(self, path, full_svn_path):
+        ## @brief Copy a changed file (or a replaced directory) from the working copy
+        #  to the scratch area, where it is cleaned up and licensed (a symlink to a
+        #  file in the package is copied together with its target)
+        #  @param path Path relative to the package root
+        #  @param full_svn_path Package root in the scratch area
+        src = os.path.join(self.wc, path)
+        dst = os.path.join(full_svn_path, path)
+        if (os.path.isdir(src) and not os.path.islink(src)) or os.path.lexists(dst):
+            # Files in new directories are listed by svn too
+            return
+        if not os.path.isdir(os.path.dirname(dst)):
+            os.makedirs(os.path.dirname(dst))
+        if os.path.islink(src):
+            os.symlink(os.readlink(src), dst)
+            # The target is needed to license the symlink (it is imported again too)
+            target = os.path.normpath(os.path.join(os.path.dirname(path), os.readlink(src)))
+            if (not os.path.isabs(target) and not target.startswith(os.pardir) and
+                    os.path.isfile(os.path.join(self.wc, target))):
+                self.stage(target, full_svn_path)
+        else:
+            copy_file_and_stat(src, dst)
+
+    def close(self):
+        ## @brief Remove the working copy
+        staging.remove(self.tempdir)
+
+
+def git_commit_package(gitrepo, package, message):
+    ## @brief Commit all of the changes to a package in the git checkout (and only them)
+    #  @param gitrepo Path to git repository
+    #  @param package Path to package root
+    #  @param message Commit message
+    #  @return Commit hash, or @c None if nothing changed
+    subprocess.check_call(["git", "add", "-A", "--", package], cwd=gitrepo)
+    if subprocess.call(["git", "diff", "--cached", "--quiet", "--", package], cwd=gitrepo) == 0:
+        return None
+    subprocess.check_call(["git", "commit", "-q", "-m", message, "--", package], cwd=gitrepo)
+    return git_rev_parse(gitrepo, "HEAD")
+
+
+def load_delta_state(gitrepo, package):
+    ## @brief Load the record of the files written by the last delta import of a package
+    #  @param gitrepo Path to git repository
+    #  @param package Path to package root
+    #  @return Dictionary with the options key and the files (or @c None if there is no record)
+    try:
+        with open(delta_state_file(gitrepo, package)) as state_fh:
+            state = json.load(state_fh)
+        state["files"] = dict((path.encode("utf-8"), values) for path, values in state["files"].iteritems())
+        return state
+    except (IOError, ValueError, KeyError, AttributeError):
+        return None
+
+
+def save_delta_state(gitrepo, package, options_key, svn_files):
+    ## @brief Record the files of a package just imported, with their SVN size and last
+    #  changed revision and the size and modification time they were given in git
+    #  @param gitrepo Path to git repository
+    #  @param package Path to package root
+    #  @param options_key Key for the import options
+    #  @param svn_files SVN listing of the package, from svn_list_package()
+    files = {}
+    for path, (size, last_changed) in svn_files.iteritems():
+        try:
+            git_stat = os.lstat(os.path.join(gitrepo, package, path))
+            files[path] = [size, last_changed, git_stat.st_size, git_stat.st_mtime]
+        except OSError:
+            # Not imported
+            continue
+    state_file = delta_state_file(gitrepo, package)
+    if not os.path.isdir(os.path.dirname(state_file)):
+        os.makedirs(os.path.dirname(state_file))
+    with open(state_file + ".tmp", "w") as state_fh:
+        json.dump({"options": options_key, "files": files}, state_fh)
+    os.rename(state_file + ".tmp", state_file)
+
+
+def delta_state_file(gitrepo, package):
+    ## @brief File recording the last delta import of a package
+    return os.path.join(svnpull_state_dir(gitrepo), "delta", urllib.quote(package, safe="") + ".json")
+
+
+def import_file_mode(filename, fstat, license_writer=None):
+    ## @brief Find the git mode a file prepared for import ends up with in the git
+    #  checkout: a symlink stays a symlink, unless a license is added to it, which
+    #  replaces it with a file having its target's content and mode (see
+    #  inject_license_if_needed()). Whether it takes a license is decided from its
+    #  target as it is in SVN, as LicensePool.license_files() does for an import in place.
+    #  @param filename Path to file
+    #  @param fstat lstat() result for the file
+    #  @param license_writer Function adding the license to the file (or @c None)
+    #  @return @c 120000, @c 100755 or @c 100644
+    if stat.S_ISLNK(fstat.st_mode):
+        if not license_writer:
+            return "120000"
+        fstat = os.stat(filename)
+    return "100755" if fstat.st_mode & stat.S_IXUSR else "100644"
+
+
+class GitFastImport(object):
+    ## @brief Write imported packages straight into git objects, as one commit on a branch,
+    #  with git fast-import, instead of copying them into the working tree
+    #
+    #  The content of each file (with any license added on the fly) is streamed into git
+    #  as a blob as soon as it is ready, from any thread, so every file is written only
+    #  once more after the SVN fetch. The packages' trees are put together into the
+    #  commit at the end, from the packages that were imported successfully.
+    def __init__(self, gitrepo, branch):
+        ## @param gitrepo Path to git repository
+        #  @param branch Branch to commit to (it is created from HEAD if it does not exist)
+        self.gitrepo = gitrepo
+        self.ref = "refs/heads/" + branch
+        self.parent = git_rev_parse(gitrepo, self.ref) or git_rev_parse(gitrepo, "HEAD")
+        try:
+            self.committer = subprocess.check_output(["git", "var", "GIT_COMMITTER_IDENT"], cwd=gitrepo).strip()
+        except subprocess.CalledProcessError:
+            raise RuntimeError("git does not know who you are (set user.name and user.email)")
+        self.packages = []
+        self.marks = 0
+        self.lock = threading.Lock()
+        self.process = subprocess.Popen(["git", "fast-import", "--quiet"], stdin=subprocess.PIPE, cwd=gitrepo)
+
+    def blob_writer(self, package_files):
+        ## @brief Make a function to pass to svn_prepare_package() that writes each file
+        #  as a blob
+        #  @param package_files List that (path, mode, mark) tuples are appended to
+        #  @return Function of (path, filename, lstat result, license writer)
+        def write_blob(path, filename, fstat, license_writer):
+            package_files.append((path,) + self.write_blob(filename, fstat, license_writer))
+        return write_blob
+
+    def write_blob(self, filename, fstat, license_writer=None):
+        ## @brief Write a file's content into git
+        #
+        #  A symlink is written as the licensed content of its target if it has a license
+        #  writer, which is given when its target has no license in SVN (the same rule as
+        #  for an import in place, see import_file_mode()), and otherwise as a symlink.
+        #  @param filename Path to file
+        #  @param fstat lstat() result for the file
+        #  @param license_writer If set, function of (input file, output file) that adds
+        #  a license to the content
+        #  @return Tuple of git file mode and fast-import mark of the blob
+        mode = import_file_mode(filename, fstat, license_writer)
+        if mode == "120000":
+            data = os.readlink(filename)
+        else:
+            data = None
+            if license_writer:
+                licensed = cStringIO.StringIO()
+                with open(filename) as ifh:
+                    license_writer(ifh, licensed)
+                data = licensed.getvalue()
+        with self.lock:
+            self.marks += 1
+            mark = ":{0}".format(self.marks)
+            self.process.stdin.write("blob\nmark {0}\n".format(mark))
+            if data is not None:
+                self.process.stdin.write("data {0}\n".format(len(data)))
+                self.process.stdin.write(data)
+            else:
+                with open(filename, "rb") as ifh:
+                    self.process.stdin.write("data {0}\n".format(os.fstat(ifh.fileno()).st_size))
+                    shutil.copyfileobj(ifh, self.process.stdin)
+            self.process.stdin.write("\n")
+        return mode, mark
+
+    def add_package(self, package, tag, package_files, full_clobber=True):
+        ## @brief Add a prepared package to the commit
+        #  @param package Path to package root (in git and svn)
+        #  @param tag Package tag imported (only used for messages)
+        #  @param package_files List of (path, mode, mark) tuples from blob_writer()
+        #  @param full_clobber If @c True the package replaces all the current files, otherwise
+        #  only the given files are added or replaced
+        if not package_files:
+            logger.warning("Nothing left to import from {0} after filtering".format(os.path.join(package, tag)))
+            return
+        self.packages.append((package, tag, package_files, full_clobber))
+        print "Imported {0} from {1} into git objects ({2} files)".format(package, tag, len(package_files))
+
+    def commit(self, message):
+        ## @brief Write the commit and finish the import
+        #  @param message Commit message
+        #  @return New commit hash, or @c None if nothing was imported
+        if not self.packages:
+            self.abort()
+            return None
+        commands = ["commit {0}".format(self.ref), "committer {0}".format(self.committer),
+                    "data {0}".format(len(message)), message]
+        if self.parent:
+            commands.append("from {0}".format(self.parent))
+        for package, tag, package_files, full_clobber in self.packages:
+            paths = set(path for path, mode, mark in package_files)
+            if full_clobber:
+                commands.append("D {0}".format(package))
+                # The same rule for packagedoc.h as when copying into the git checkout -
+                # never delete it if it is not in the SVN import
+                pkgdoc = os.path.join(package, "doc", "packagedoc.h")
+                if pkgdoc not in paths and self.parent:
+                    pkgdoc_entry = subprocess.check_output(["git", "ls-tree", self.parent, "--", pkgdoc],
+                                                           cwd=self.gitrepo).split()
+                    if pkgdoc_entry:
+                        commands.append("M {0} {1} {2}".format(pkgdoc_entry[0], pkgdoc_entry[2], pkgdoc))
+            for path, mode, mark in package_files:
+                commands.append("M {0} {1} {2}".format(mode, mark, path))
+        commands.append("")
+        with self.lock:
+            self.process.stdin.write("\n".join(commands) + "\n")
+            self.process.stdin.close()
+            if self.process.wait():
+                raise RuntimeError("git fast-import failed with exit code {0}".format(self.process.returncode))
+        return git_rev_parse(self.gitrepo, self.ref)
+
+    def abort(self):
+        ## @brief Stop the import without writing a commit
+        if self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+
+
+def git_rev_parse(gitrepo, rev):
+    ## @brief Find the commit a git revision refers to
+    #  @param gitrepo Path to git repository
+    #  @param rev Revision (branch, ref, ...) to look up
+    #  @return Commit hash, or @c None if the revision does not exist
+    try:
+        return subprocess.check_output(["git", "rev-parse", "-q", "--verify", rev + "^{commit}"],
+                                       cwd=gitrepo).strip()
+    except subprocess.CalledProcessError:
+        return None
+
+
+def parallel_import(svnroot, gitrepo, import_list, jobs, revision=None,
+                    license_text=None, license_path_accept=[], license_path_reject=[], svn_export=True,
+                    wc_cache=None, sync=False, on_result=None, git_importer=None, license_cache=None,
+                    svn_prefilter=False):
+    ## @brief Import many packages, checking out and preparing up to @c jobs of them
+    #  concurrently; copying into the git checkout is always done one package at a time,
+    #  in the order the packages were given
+    #  @param svnroot Base path to SVN repository
+    #  @param gitrepo Path to git repository to import to
+    #  @param import_list List of dictionaries describing each import (keys are @c svn_package,
+    #  @c package, @c tag, @c full_clobber, @c svn_path_accept and @c svn_path_reject)
+    #  @param jobs Maximum number of packages to prepare at the same time
+    #  @param revision Force SVN revision number
+    #  @param license_text List of strings containing the license text to add
+    #  @param license_path_accept Paths to force include in license file addition
+    #  @param license_path_reject Paths to exclude from license file addition
+    #  @param svn_export If @c True use svn export, otherwise make a full svn checkout
+    #  @param wc_cache SvnWorkingCopyCache to fetch through (if @c None fetch directly)
+    #  @param sync If @c True only write the files that changed into the git checkout
+    #  @param on_result Function called with the import dictionary and error (@c None
+    #  on success) as soon as each package is finished
+    #  @param git_importer GitFastImport to write the packages to, instead of the git checkout
+    #  (file contents are then written while each package is prepared)
+    #  @param license_cache LicenseCache to look up licensed files in (or @c None)
+    #  @param svn_prefilter If @c True only fetch the files that are imported
+    #  @return List of (svn_package, error) tuples, where error is @c None for a successful import
+    def prepare(svn_import):
+        package_files = []
+        try:
+            with activate_metrics(svn_import["metrics"]):
+                tempdir = svn_prepare_package(svnroot, svn_import["package"], svn_import["tag"],
+                                              svn_path_accept=svn_import["svn_path_accept"],
+                                              svn_path_reject=svn_import["svn_path_reject"],
+                                              revision=revision, license_text=license_text,
+                                              license_path_accept=license_path_accept,
+                                              license_path_reject=license_path_reject,
+                                              svn_export=svn_export, wc_cache=wc_cache,
+                                              blob_writer=git_importer.blob_writer(package_files)
+                                              if git_importer else None,
+                                              license_cache=license_cache, svn_prefilter=svn_prefilter)
+            return svn_import, tempdir, package_files, None
+        except (RuntimeError, OSError, IOError) as e:
+            logger.warning("Failed to prepare {0}: {1}".format(svn_import["svn_package"], e))
+            return svn_import, None, None, e
+
+    results = []
+    pool = ThreadPool(jobs)
+    try:
+        for svn_import, tempdir, package_files, error in pool.imap(prepare, import_list):
+            if tempdir:
+                try:
+                    if git_importer:
+                        git_importer.add_package(svn_import["package"], svn_import["tag"], package_files,
+                                                 svn_import["full_clobber"])
+                    else:
+                        with activate_metrics(svn_import["metrics"]), metrics_phase("sync"):
+                            copy_package_to_git(tempdir, gitrepo, svn_import["package"], svn_import["tag"],
+                                                svn_import["full_clobber"], sync=sync)
+                except (OSError, IOError) as e:
+                    logger.warning("Failed to copy {0} into git: {1}".format(svn_import["svn_package"], e))
+                    error = e
+                finally:
+                    staging.remove(tempdir)
+            if on_result:
+                on_result(svn_import, error)
+            results.append((svn_import["svn_package"], error))
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return results
+
+## Columns of an audit report, in the order they are written to CSV
+audit_report_fields = ["svn_package", "package", "svn_path", "svn_revision", "status", "git_digest", "svn_digest",
+                       "error"]
+
+
+class DriftAudit(object):
+    ## @brief Compare packages in the git checkout with the SVN versions they should
+    #  have been imported from, without changing anything
+    #
+    #  Each side is reduced to a digest of its file paths, git modes and contents.
+    #  The SVN side is fetched (only the files that would be imported, or through the
+    #  working copy cache) and has the import filters and the license applied as it
+    #  is hashed, so nothing is written out; doc/packagedoc.h is left out on both sides,
+    #  as an import keeps the one in git. Digests are cached in the svnpull state
+    #  directory: a git package is only hashed again if the size, mode or modification
+    #  time of one of its files changed, and an SVN version only if its last changed
+    #  revision or the import options did.
+
+    ## Version of the digests (see package_files_digest()), to discard cached digests
+    #  made by an older svnpull
+    digest_version = 2
+
+    def __init__(self, svnroot, gitrepo, revision=None, license_text=None, license_path_accept=[],
+                 license_path_reject=[], wc_cache=None):
+        ## @param svnroot Base path to SVN repository
+        #  @param gitrepo Path to git repository
+        #  @param revision Force SVN revision number
+        #  @param license_text List of strings containing the license text to add
+        #  @param license_path_accept Paths to force include in license file addition
+        #  @param license_path_reject Paths to exclude from license file addition
+        #  @param wc_cache SvnWorkingCopyCache to fetch through (if @c None only the files
+        #  that would be imported are fetched)
+        self.svnroot = svnroot
+        self.gitrepo = gitrepo
+        self.revision = revision
+        self.license_text = license_text
+        self.license_path_accept = license_path_accept
+        self.license_path_reject = license_path_reject
+        self.wc_cache = wc_cache
+        self.cache_file = os.path.join(svnpull_state_dir(gitrepo), "audit-digests.json")
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+        try:
+            with open(self.cache_file) as cache_fh:
+                self.cache = json.load(cache_fh)
+        except (IOError, ValueError):
+            self.cache = {}
+        if self.cache.get("version") != self.digest_version:
+            # Digests made differently cannot be compared
+            self.cache = {"version": self.digest_version}
+        self.cache.setdefault("git", {})
+        self.cache.setdefault("svn", {})
+
+    def audit(self, svn_import):
+        ## @brief Compare one package
+        #  @param svn_import Dictionary describing the import (as for parallel_import(), with
+        #  @c svn_missing set if the tag catalog knows that the SVN version does not exist)
+        #  @return Dictionary for the report (see audit_report_fields), with status
+        #  identical, drifted, missing (from git or SVN) or failed
+        svn_path = os.path.join(svn_import["package"], svn_import["tag"])
+        entry = collections.OrderedDict((field, None) for field in audit_report_fields)
+        entry.update(svn_package=svn_import["svn_package"], package=svn_import["package"], svn_path=svn_path)
+        if svn_import.get("svn_missing"):
+            entry.update(status="missing", error="Not found in SVN (according to the tag catalog)")
+            return entry
+        with activate_metrics(svn_import["metrics"]):
+            try:
+                with metrics_phase("resolve"):
+                    entry["svn_revision"] = svn_commit_revision(self.svnroot, svn_import["package"],
+                                                                svn_import["tag"], self.revision)
+            except RuntimeError as e:
+                entry.update(status="missing", error="Not found in SVN: {0}".format(e))
+                return entry
+            if not os.path.isdir(os.path.join(self.gitrepo, svn_import["package"])):
+                entry.update(status="missing", error="Not found in git")
+                return entry
+            try:
+                with metrics_phase("audit"):
+                    entry["git_digest"] = self.git_digest(svn_import["package"])
+                entry["svn_digest"] = self.svn_digest(svn_import, entry["svn_revision"])
+            except (RuntimeError, OSError, IOError) as e:
+                logger.warning("Failed to audit {0}: {1}".format(svn_import["svn_package"], e))
+                entry.update(status="failed", error=str(e))
+                return entry
+        entry["status"] = "identical" if entry["git_digest"] == entry["svn_digest"] else "drifted"
+        return entry
+
+    def git_digest(self, package):
+        ## @brief Digest of a package in the git checkout
+        #  @param package Path to package root
+        #  @return Hex digest
+        full_git_path = os.path.join(self.gitrepo, package)
+        fingerprint = package_tree_fingerprint(full_git_path)
+        with self.lock:
+            cached = self.cache["git"].get(package)
+            if cached and cached[0] == fingerprint:
+                self.hits += 1
+                return cached[1]
+            self.misses += 1
+        files = []
+        for root, dirs, filenames in os.walk(full_git_path):
+            # Symlinks to directories are not followed, but are files to git
+            for name in filenames + [ name for name in dirs if os.path.islink(os.path.join(root, name)) ]:
+                filename = os.path.join(root, name)
+                files.append((os.path.relpath(filename, full_git_path), filename, os.lstat(filename), None))
+        digest = package_files_digest(files)
+        with self.lock:
+            self.cache["git"][package] = [fingerprint, digest]
+        return digest
+
+    def svn_digest(self, svn_import, svn_revision):
+        ## @brief Digest of an SVN package version, as it would be imported
+        #  @param svn_import Dictionary describing the import
+        #  @param svn_revision Last changed revision of the SVN package version
+        #  @return Hex digest
+        svn_path = os.path.join(svn_import["package"], svn_import["tag"])
+        options_key = import_options_key(svn_import["svn_path_accept"], svn_import["svn_path_reject"],
+                                         self.license_text, self.license_path_accept, self.license_path_reject,
+                                         svn_import["full_clobber"])
+        with self.lock:
+            cached = self.cache["svn"].get(svn_path)
+            if cached and cached[:2] == [svn_revision, options_key]:
+                self.hits += 1
+                return cached[2]
+            self.misses += 1
+        files = []
+        package_root = svn_import["package"] + "/"
+
+        def add_file(path, filename, fstat, license_writer):
+            files.append((path[len(package_root):], filename, fstat, license_writer))
+
+        tempdir = svn_prepare_package(self.svnroot, svn_import["package"], svn_import["tag"],
+                                      svn_path_accept=svn_import["svn_path_accept"],
+                                      svn_path_reject=svn_import["svn_path_reject"],
+                                      revision=svn_revision, license_text=self.license_text,
+                                      license_path_accept=self.license_path_accept,
+                                      license_path_reject=self.license_path_reject,
+                                      wc_cache=self.wc_cache, blob_writer=add_file, svn_prefilter=True)
+        try:
+            with metrics_phase("audit"):
+                digest = package_files_digest(files)
+        finally:
+            staging.remove(tempdir)
+        with self.lock:
+            self.cache["svn"][svn_path] = [svn_revision, options_key, digest]
+        return digest
+
+    def save(self):
+        ## @brief Write out the digest cache
+        with self.lock:
+            with open(self.cache_file + ".tmp", "w") as cache_fh:
+                json.dump(self.cache, cache_fh)
+            os.rename(self.cache_file + ".tmp", self.cache_file)
+
+
+def package_files_digest(files):
+    ## @brief Digest of the files of a package, from their paths, git modes and contents
+    #  (doc/packagedoc.h is left out)
+    #  @param files List of (path relative to the package root, filename, lstat() result,
+    #  license writer) tuples, where the license writer is a function of (input file, output
+    #  file) that adds the license to the content, or @c None
+    #  @return Hex digest
+    digest = hashlib.sha1()
+    for path, filename, fstat, license_writer in sorted(files):
+        if path == os.path.join("doc", "packagedoc.h"):
+            continue
+        content = hashlib.sha1()
+        # The same mode, and so content, as the file gets in git
+        mode = import_file_mode(filename, fstat, license_writer)
+        if mode == "120000":
+            content.update(os.readlink(filename))
+        else:
+            with open(filename, "rb") as ifh:
+                if license_writer:
+                    # Only the write method of the output file is used
+                    license_writer(ifh, DigestWriter(content))
+                else:
+                    for data in iter(lambda: ifh.read(1024 * 1024), ""):
+                        content.update(data)
+        digest.update("{0} {1}\0{2}\n".format(mode, path, content.hexdigest()))
+    return digest.hexdigest()
+
+
+class DigestWriter(object):
+    ## @brief File-like object that adds what is written to it to a hash
+    def __init__(self, digest):
+        ## @param digest hashlib object
+        self.digest = digest
+
+    def write(self, data):
+        self.digest.update(data)
+
+
+def audit_packages(args, import_list, audit):
+    ## @brief Audit packages concurrently, then write the report and print a summary
+    #  @param args Parsed command line arguments
+    #  @param import_list List of dictionaries describing each import
+    #  @param audit DriftAudit to compare the packages with
+    #  @return ImportResult, with exit code 1 if any package is not identical
+    pool = ThreadPool(args.jobs)
+    try:
+        entries = pool.map(audit.audit, import_list)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        audit.save()
+    logger.info("Audit digest cache: {0} hits, {1} misses".format(audit.hits, audit.misses))
+
+    write_audit_report(args.audit, entries)
+    counts = collections.Counter(entry["status"] for entry in entries)
+    print "Audit summary:"
+    for entry in entries:
+        if entry["status"] != "identical":
+            print "  {0:40s} {1}{2}".format(entry["svn_package"], entry["status"].upper(),
+                                            " ({0})".format(entry["error"]) if entry["error"] else "")
+    print "{0} identical, {1} drifted, {2} missing, {3} failed; report written to {4}".format(
+        counts["identical"], counts["drifted"], counts["missing"], counts["failed"], args.audit)
+    result = ImportResult(exit_code=0 if counts["identical"] == len(entries) else 1)
+    result.audit = entries
+    return result
+
+
+def write_audit_report(filename, entries):
+    ## @brief Write an audit report, as JSON or CSV depending on the file extension
+    #  @param filename Report file (.csv for CSV, otherwise JSON)
+    #  @param entries List of dictionaries from DriftAudit.audit()
+    if filename.endswith(".csv"):
+        with open(filename, "wb") as report_fh:
+            writer = csv.DictWriter(report_fh, audit_report_fields)
+            writer.writeheader()
+            writer.writerows(entries)
+    else:
+        summary = collections.OrderedDict((status, 0) for status in ("identical", "drifted", "missing", "failed"))
+        for entry in entries:
+            summary[entry["status"]] += 1
+        with open(filename, "w") as report_fh:
+            json.dump(collections.OrderedDict([("summary", summary), ("packages", entries)]), report_fh, indent=2)
+
+
+def svn_cleanup(svn_path, svn_co_root, svn_path_accept=[], svn_path_reject=[]):
+    # # @brief Cleanout files we do not want to import into git
+    #  @param svn_path Full path to checkout of SVN package
+    #  @param svn_co_root Base directory of SVN checkout
+    #  @param svn_path_accept List of file path globs to always import to git
+    #  @param svn_path_reject List of file path globs to never import to git
+    process_svn_tree(svn_path, svn_co_root, path_filter=PathFilter.cached(svn_path_accept, svn_path_reject))
+
+
+def svn_license_injector(svn_path, svn_co_root, license_text, license_path_accept=[], license_path_reject=[]):
+    ## @brief Add license statements to code before import
+    #  @param svn_path Filesystem path to cleaned up SVN checkout
+    #  @param svn_co_root Base directory of SVN checkout
+    #  @param license_text List of strings that comprise the license to apply
+    #  @param license_path_accept Paths to force include in license file addition (NOT IMPLEMENTED YET)
+    #  @param license_path_reject Paths to exclude from license file addition
+    #   license file addition
+    process_svn_tree(svn_path, svn_co_root, license_text=license_text,
+                     license_filter=PathFilter.cached(license_path_accept, license_path_reject))
+
+
+def process_svn_tree(svn_path, svn_co_root, path_filter=None, license_text=None, license_filter=None,
+                     copy_to=None, blob_writer=None, license_cache=None, license_batch=None, copy_symlinks=False):
+    ## @brief Clean up, license and copy an SVN package in a single pass over its files
+    #
+    #  Each directory is listed once and each file is stat()ed once, then the file
+    #  is rejected, licensed and/or copied straight away (the result is the same as
+    #  running svn_cleanup(), svn_license_injector() and then copying the files)
+    #  @param svn_path Full path to checkout of SVN package
+    #  @param svn_co_root Base directory of SVN checkout
+    #  @param path_filter PathFilter for files to import to git (if @c None, no files
+    #  are cleaned out)
+    #  @param license_text List of strings that comprise the license to apply (if @c None
+    #  no license is applied)
+    #  @param license_filter PathFilter for files to apply the license to
+    #  @param copy_to If set, every file that is kept is copied to the same relative path
+    #  (from @c svn_co_root) under this directory
+    #  @param blob_writer If set, every file that is kept is passed to this function, with
+    #  its path relative to @c svn_co_root, its lstat() result and a function of (input
+    #  file, output file) that adds the license to it (or @c None), instead of being
+    #  licensed in place and copied
+    #  @param license_cache LicenseCache to look up licensed files in (or @c None)
+    #  @param license_batch List to add the files that may need a license to, instead of
+    #  licensing (and copying) them straight away; if @c None, the whole tree is walked
+    #  first and the batch is then licensed by the license_pool (which licenses symlinks
+    #  before the files they point to, so the result does not depend on the order the
+    #  files are listed in)
+    #  @param copy_symlinks If @c True, symlinks that are kept (including symlinks to
+    #  directories) are copied to @c copy_to as symlinks, as a full import leaves them,
+    #  instead of copying the file they point to (and skipping symlinks to directories)
+    #  @return @c False if nothing was left and the directory was removed
+    metrics = ImportMetrics.current()
+    if license_batch is None and license_text and not blob_writer:
+        license_batch = []
+        kept = process_svn_tree(svn_path, svn_co_root, path_filter=path_filter, license_text=license_text,
+                                license_filter=license_filter, copy_to=copy_to, license_cache=license_cache,
+                                license_batch=license_batch, copy_symlinks=copy_symlinks)
+        with metrics_phase("license"):
+            licensed = license_pool.license_files([ (filename, svn_filename, license_writer) for
+                                                    filename, svn_filename, fstat, license_writer in license_batch ],
+                                                  license_text, license_cache)
+            if metrics:
+                metrics.add(files=sum(licensed), bytes=sum(fstat.st_size for (filename, svn_filename, fstat, writer),
+                                                           added in zip(license_batch, licensed) if added))
+        if copy_to:
+            for filename, svn_filename, fstat, license_writer in license_batch:
+                copy_into_checkout(filename, svn_filename, copy_to, fstat, copy_symlinks)
+        return kept
+    kept = 0
+    for name, filename, fstat in scan_dir(svn_path):
+        if stat.S_ISDIR(fstat.st_mode):
+            if name == ".svn":
+                shutil.rmtree(filename)
+            elif process_svn_tree(filename, svn_co_root, path_filter=path_filter, license_text=license_text,
+                                  license_filter=license_filter, copy_to=copy_to, blob_writer=blob_writer,
+                                  license_cache=license_cache, license_batch=license_batch,
+                                  copy_symlinks=copy_symlinks):
+                kept += 1
+            continue
+        if stat.S_ISLNK(fstat.st_mode) and os.path.isdir(filename):
+            # Softlinks to directories are imported as they are
+            kept += 1
+            if blob_writer:
+                blob_writer(filename[len(svn_co_root) + 1:], filename, fstat, None)
+            elif copy_to and copy_symlinks:
+                copy_into_checkout(filename, filename[len(svn_co_root) + 1:], copy_to, fstat, copy_symlinks)
+            continue
+        svn_filename = filename[len(svn_co_root) + 1:]
+        if metrics:
+            metrics.add("cleanup", files=1, bytes=fstat.st_size)
+        if path_filter and not svn_file_accepted(svn_filename, name, fstat, path_filter):
+            if metrics:
+                metrics.add("cleanup", rejected=1)
+            try:
+                os.remove(filename)
+            except OSError as e:
+                logger.debug("Got OSError (harmless!) treating {0}: {1}".format(filename, e))
+            continue
+        kept += 1
+        if blob_writer:
+            license_writer = None
+            if license_text:
+                with metrics_phase("license"):
+                    license_writer = svn_file_license_writer(filename, svn_filename, license_text, license_filter)
+                    if license_writer:
+                        license_writer = functools.partial(license_writer, license_text=license_text)
+                        if metrics:
+                            metrics.add("license", files=1, bytes=fstat.st_size)
+            with metrics_phase("sync"):
+                blob_writer(svn_filename, filename, fstat, license_writer)
+                if metrics:
+                    metrics.add("sync", files=1, bytes=fstat.st_size)
+            continue
+        if license_text:
+            license_writer = svn_file_license_style(svn_filename, license_filter)
+            if license_writer:
+                # Copied once the batch is licensed
+                license_batch.append((filename, svn_filename, fstat, license_writer))
+                continue
+        if copy_to:
+            copy_into_checkout(filename, svn_filename, copy_to, fstat, copy_symlinks)
+    # Clean up empty directories
+    if path_filter and kept == 0:
+        os.rmdir(svn_path)
+        return False
+    return True
+
+
+def copy_into_checkout(filename, svn_filename, copy_to, fstat, copy_symlinks=False):
+    ## @brief Copy a file that has been cleaned up and licensed into the git checkout
+    #  @param filename Path to file
+    #  @param svn_filename Path of file, relative to the SVN checkout base
+    #  @param copy_to Root of the git checkout
+    #  @param fstat lstat() result of the file
+    #  @param copy_symlinks If @c True, and the file is still a symlink (i.e., no
+    #  license was added to it), copy it as a symlink; a symlink in the git checkout
+    #  is always replaced, rather than written through
+    with metrics_phase("sync") as metrics:
+        dst_filename = os.path.join(copy_to, svn_filename)
+        logger.info("Pulling {0} into git checkout".format(svn_filename))
+        if not os.path.isdir(os.path.dirname(dst_filename)):
+            os.makedirs(os.path.dirname(dst_filename))
+        if copy_symlinks and (os.path.islink(filename) or os.path.islink(dst_filename)):
+            # Replace a symlink in the git checkout, rather than writing through it
+            if os.path.lexists(dst_filename):
+                os.remove(dst_filename)
+        if copy_symlinks and os.path.islink(filename):
+            os.symlink(os.readlink(filename), dst_filename)
+        else:
+            copy_file_and_stat(filename, dst_filename)
+        if metrics:
+            metrics.add("sync", files=1, bytes=fstat.st_size)
+
+
+def scan_dir(path):
+    ## @brief List a directory together with the lstat() result of each entry
+    #  (os.scandir, or the scandir module, is used if available, as it caches
+    #  the stat result)
+    #  @param path Directory to list
+    #  @return List of (name, full path, lstat result) tuples
+    if scandir:
+        return [ (entry.name, entry.path, entry.stat(follow_symlinks=False)) for entry in scandir(path) ]
+    entries = []
+    for name in os.listdir(path):
+        filename = os.path.join(path, name)
+        entries.append((name, filename, os.lstat(filename)))
+    return entries
+
+
+def svn_file_accepted(svn_filename, name, fstat, path_filter):
+    ## @brief Decide if a file from SVN should be imported into git
+    #  @param svn_filename Path of file, relative to the SVN checkout base
+    #  @param name File name
+    #  @param fstat lstat() result for the file (only @c st_size is used)
+    #  @param path_filter PathFilter for files to import to git
+    #  @return @c True if the file is imported
+    path_accept_match, filter = path_filter.match(svn_filename)
+    if path_accept_match:
+        logger.debug("{0} imported from globbed exception {1}".format(svn_filename, filter.pattern))
+        return True
+    # Rejection always takes precedence
+    if path_accept_match is False:
+        logger.debug("{0} not imported due to {1} filter".format(svn_filename, filter.pattern))
+        return False
+    if fstat.st_size > 100 * 1024:
+        if "." in name and name.rsplit(".", 1)[1] in ("cxx", "py", "h", "java", "cc", "c", "icc", "cpp",
+                                                      "hpp", "hh", "f", "F"):
+            logger.debug("Source file {0} is too large, but importing anyway (source files always imported)".format(svn_filename))
+        else:
+            logger.debug("File {0} is too large - not importing".format(svn_filename))
+            return False
+    if name.startswith("."):
+        logger.debug("File {0} starts with a '.' - not importing".format(svn_filename))
+        return False
+    return True
+
+
+class LicenseCache(object):
+    ## @brief Persistent cache of the results of adding the license to files
+    #
+    #  Entries are keyed by a hash of the license style, the license text and the
+    #  file's content, and hold the licensed file. An empty entry records that the
+    #  file already had a license and was left alone. On a hit the file is rewritten
+    #  from the entry in place with copy_file() (a reflink where possible; a symlink is
+    #  replaced by a licensed file, as on a miss), instead of
+    #  being scanned and rewritten through a temporary file; entries are never hard
+    #  linked, as the files end up in the git checkout, where they may be edited.
+    #  The cache can be shared by several users and svnpull processes, as entries are
+    #  written atomically; when it grows beyond its size limit the least recently used
+    #  entries are removed by prune().
+    def __init__(self, cache_dir, max_size=1024 * 1024 * 1024):
+        ## @param cache_dir Directory holding the cache
+        #  @param max_size Maximum size of the cache, in bytes
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_size = max_size
+        self.hits = self.misses = 0
+        self.lock = threading.Lock()
+        self._license_digests = {}
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    def key(self, filename, license_text, license_writer):
+        ## @brief Make the cache key of a file
+        #  @param filename Path to file
+        #  @param license_text List of strings that comprise the license to apply
+        #  @param license_writer write_c_license() or write_py_license()
+        #  @return Hex digest
+        license_key = tuple(license_text)
+        if license_key not in self._license_digests:
+            self._license_digests[license_key] = hashlib.sha1("\n".join(license_text)).hexdigest()
+        key = hashlib.sha1("{0}\0{1}\0".format(license_writer.__name__, self._license_digests[license_key]))
+        with open(filename, "rb") as fh:
+            for block in iter(lambda: fh.read(1024 * 1024), ""):
+                key.update(block)
+        return key.hexdigest()
+
+    def _entry_file(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def inject(self, filename, svn_filename, license_text, license_writer):
+        ## @brief Add a license statement to a file, if it needs one, through the cache
+        #  @param filename Path to file
+        #  @param svn_filename Path of file, relative to the SVN checkout base
+        #  @param license_text List of strings that comprise the license to apply
+        #  @param license_writer write_c_license() or write_py_license()
+        #  @return @c True if a license was added
+        entry_file = self._entry_file(self.key(filename, license_text, license_writer))
+        try:
+            if os.path.getsize(entry_file) == 0:
+                licensed = False
+                logger.debug("File {0} already has a license (cached)".format(svn_filename))
+            elif os.path.islink(filename):
+                # A symlink is replaced by a licensed file with the target's mode, as
+                # by inject_license_if_needed(), rather than written through
+                fmode = os.stat(filename).st_mode
+                copy_file(entry_file, filename + ".license")
+                os.chmod(filename + ".license", fmode)
+                os.rename(filename + ".license", filename)
+                licensed = True
+            else:
+                copy_file(entry_file, filename)
+                licensed = True
+            os.utime(entry_file, None)
+            with self.lock:
+                self.hits += 1
+            return licensed
+        except (OSError, IOError):
+            # Not cached (or removed by a prune just now)
+            pass
+        with self.lock:
+            self.misses += 1
+        licensed = inject_license_if_needed(filename, svn_filename, license_text, license_writer)
+        try:
+            if not os.path.isdir(os.path.dirname(entry_file)):
+                os.makedirs(os.path.dirname(entry_file))
+            entry_fd, entry_tmp = tempfile.mkstemp(dir=os.path.dirname(entry_file))
+            os.close(entry_fd)
+            if licensed:
+                copy_file(filename, entry_tmp)
+            os.rename(entry_tmp, entry_file)
+        except (OSError, IOError) as e:
+            logger.warning("Failed to add {0} to the license cache: {1}".format(svn_filename, e))
+        return licensed
+
+    def prune(self, max_size=None):
+        ## @brief Remove least recently used entries until the cache fits into its size limit
+        #  @param max_size Size limit in bytes (defaults to the cache's limit)
+        #  @return Number of entries removed
+        if max_size is None:
+            max_size = self.max_size
+        entries = []
+        total_size = 0
+        for root, dirs, filenames in os.walk(self.cache_dir):
+            for name in filenames:
+                entry_file = os.path.join(root, name)
+                try:
+                    entry_stat = os.stat(entry_file)
+                except OSError:
+                    continue
+                entries.append((entry_stat.st_mtime, entry_stat.st_size, entry_file))
+                total_size += entry_stat.st_size
+        removed = 0
+        for mtime, size, entry_file in sorted(entries):
+            if total_size <= max_size:
+                break
+            try:
+                os.remove(entry_file)
+            except OSError:
+                pass
+            total_size -= size
+            removed += 1
+        return removed
+
+
+class LicensePool(object):
+    ## @brief Pool of worker processes that add the license to files, so that the files
+    #  of large packages are licensed on several cores
+    #
+    #  process_svn_tree() collects the files of a package that may need a license into
+    #  a batch, which is shared out between the workers in chunks. Each worker opens
+    #  the license cache for itself, and the cache hits and misses are added up here.
+    #  Batches of fewer than @c min_batch files are licensed in this process (as is
+    #  every batch when no workers are started): handing files to the workers and
+    #  collecting the results costs about as much as licensing a file, so the pool
+    #  only wins for packages with thousands of files to license.
+    min_batch = 5000
+
+    def __init__(self):
+        self.pool = None
+        self.workers = 1
+
+    def setup(self, workers, license_text, license_cache=None, min_batch=None):
+        ## @brief Start the worker processes (if more than one is asked for)
+        #  @param workers Number of worker processes
+        #  @param license_text List of strings that comprise the license to apply
+        #  @param license_cache LicenseCache the workers use (or @c None)
+        #  @param min_batch Smallest batch of files to share out between the workers
+        #  (defaults to LicensePool.min_batch)
+        self.close()
+        self.min_batch = LicensePool.min_batch if min_batch is None else min_batch
+        if workers > 1 and license_text:
+            self.pool = multiprocessing.Pool(workers, license_worker_init,
+                                             (license_cache.cache_dir, license_cache.max_size) if license_cache
+                                             else (None, None))
+            self.workers = workers
+
+    def running(self):
+        return self.pool is not None
+
+    def license_files(self, jobs, license_text, license_cache=None):
+        ## @brief Add the license to a batch of files
+        #  @param jobs List of (filename, svn_filename, license_writer) tuples
+        #  @param license_text List of strings that comprise the license to apply
+        #  @param license_cache LicenseCache to look the results up in (or @c None)
+        #  @return List of @c True or @c False for each file, if a license was added
+        #
+        #  A symlink gets a license (and is replaced by a licensed copy of its target)
+        #  only if its target has none in SVN, as for a fast-import or an audit, which
+        #  do not change the files. So symlinks are licensed first, in this process,
+        #  before any file they point to is changed; a symlink to another symlink goes
+        #  before it.
+        is_link = [ os.path.islink(filename) for filename, svn_filename, license_writer in jobs ]
+        links = sorted([ index for index in range(len(jobs)) if is_link[index] ],
+                       key=lambda index: (-symlink_depth(jobs[index][0]), jobs[index][0]))
+        files = [ index for index in range(len(jobs)) if not is_link[index] ]
+        licensed = [False] * len(jobs)
+        for index in links if self.pool and len(files) >= self.min_batch else links + files:
+            filename, svn_filename, license_writer = jobs[index]
+            licensed[index] = license_file(filename, svn_filename, license_text, license_writer, license_cache)
+        if not self.pool or len(files) < self.min_batch:
+            return licensed
+        chunksize = max(1, len(files) // (self.workers * 4))
+        # Waiting with a timeout keeps the wait interruptible by Ctrl-C
+        results = self.pool.map_async(license_worker, [ jobs[index] + (license_text,) for index in files ],
+                                      chunksize).get(365 * 24 * 3600)
+        if license_cache:
+            with license_cache.lock:
+                license_cache.hits += sum(hits for added, hits, misses in results)
+                license_cache.misses += sum(misses for added, hits, misses in results)
+        for index, (added, hits, misses) in zip(files, results):
+            licensed[index] = added
+        return licensed
+
+    def close(self):
+        ## @brief Stop the worker processes
+        if self.pool:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+            self.workers = 1
+
+
+def symlink_depth(filename):
+    ## @brief Count the symlinks followed to get from a path to a file
+    #  @param filename Path to symlink
+    #  @return Number of symlinks (0 if @c filename is not one), stopping at a loop
+    depth = 0
+    while os.path.islink(filename) and depth < 40:
+        filename = os.path.join(os.path.dirname(filename), os.readlink(filename))
+        depth += 1
+    return depth
+
+
+## Process wide pool for adding the license to files, set up by run()
+license_pool = LicensePool()
+
+## License cache of a LicensePool worker process
+license_worker_cache = None
+
+
+def license_worker_init(cache_dir, cache_size):
+    ## @brief Set up a LicensePool worker process
+    #  @param cache_dir License cache directory (or @c None)
+    #  @param cache_size Maximum size of the license cache
+    global license_worker_cache
+    # Interrupts and kills are handled by the parent, which stops the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    hdlr.stream = sys.__stdout__
+    license_worker_cache = LicenseCache(cache_dir, cache_size) if cache_dir else None
+
+
+def license_worker(job):
+    ## @brief Add the license to a file, in a LicensePool worker process
+    #  @param job Tuple of filename, svn_filename, license writer and license text
+    #  @return Tuple of @c True if a license was added, and the number of license
+    #  cache hits and misses
+    filename, svn_filename, license_writer, license_text = job
+    hits, misses = (license_worker_cache.hits, license_worker_cache.misses) if license_worker_cache else (0, 0)
+    licensed = license_file(filename, svn_filename, license_text, license_writer, license_worker_cache)
+    if license_worker_cache:
+        return licensed, license_worker_cache.hits - hits, license_worker_cache.misses - misses
+    return licensed, 0, 0
+
+
+def svn_file_license(filename, svn_filename, license_text, license_filter, license_cache=None):
+    ## @brief Add a license statement to a single file, if it needs one
+    #  @param filename Path to file
+    #  @param svn_filename Path of file, relative to the SVN checkout base
+    #  @param license_text List of strings that comprise the license to apply
+    #  @param license_filter PathFilter for files to apply the license to
+    #  @param license_cache LicenseCache to look the result up in (if @c None, always
+    #  add the license directly)
+    #  @return @c True if a license was added
+    license_writer = svn_file_license_style(svn_filename, license_filter)
+    if not license_writer:
+        return False
+    return license_file(filename, svn_filename, license_text, license_writer, license_cache)
+
+
+def license_file(filename, svn_filename, license_text, license_writer, license_cache=None):
+    ## @brief Add a license statement of the given style to a file, if it does not have one
+    #  @param filename Path to file
+    #  @param svn_filename Path of file, relative to the SVN checkout base
+    #  @param license_text List of strings that comprise the license to apply
+    #  @param license_writer write_c_license() or write_py_license()
+    #  @param license_cache LicenseCache to look the result up in (or @c None)
+    #  @return @c True if a license was added
+    try:
+        if license_cache:
+            return license_cache.inject(filename, svn_filename, license_text, license_writer)
+        return inject_license_if_needed(filename, svn_filename, license_text, license_writer)
+    except (OSError, IOError) as e:
+        # Can happen if a file is a softlink to nowhere
+        logger.warning("Got an exception on stating {0}: {1}".format(filename, e))
+        return False
+
+
+def svn_file_license_writer(filename, svn_filename, license_text, license_filter):
+    ## @brief Decide if a file needs a license statement and which style it takes
+    #  @param filename Path to file
+    #  @param svn_filename Path of file, relative to the SVN checkout base
+    #  @param license_text List of strings that comprise the license to apply
+    #  @param license_filter PathFilter for files to apply the license to
+    #  @return Function that writes the licensed file (write_c_license() or write_py_license()),
+    #  or @c None if no license is needed
+    license_writer = svn_file_license_style(svn_filename, license_filter)
+    if not license_writer:
+        return None
+    try:
+        if file_has_license(filename, svn_filename, license_text):
+            return None
+    except (OSError, IOError) as e:
+        # Can happen if a file is a softlink to nowhere
+        logger.warning("Got an exception on stating {0}: {1}".format(filename, e))
+        return None
+    return license_writer
+
+
+def svn_file_license_style(svn_filename, license_filter):
+    ## @brief Decide, from its name, if a file should get a license statement and which
+    #  style it takes
+    #  @param svn_filename Path of file, relative to the SVN checkout base
+    #  @param license_filter PathFilter for files to apply the license to
+    #  @return write_c_license() or write_py_license(), or @c None for no license
+    extension = svn_filename.rsplit(".", 1)[1] if "." in svn_filename else ""
+    if extension in ("cxx", "cpp", "icc", "cc", "c", "C", "h", "hpp", "hh"):
+        license_writer = write_c_license
+    elif extension in ("py", "cmake"):
+        license_writer = write_py_license
+    else:
+        return None
+    license_match, filter = license_filter.match(svn_filename)
+    if license_match is False:
+        logger.debug("File {0} will not have a license file applied".format(svn_filename, filter.pattern))
+        return None
+    elif license_match:
+        logger.debug("File {0} will have a license file applied".format(svn_filename, filter.pattern))
+    return license_writer
+
+
+def file_has_license(filename, svn_filename, license_text):
+    ## @brief See if the license is already in a file from SVN, as this is happening sometimes
+    #  @param filename Path to file
+    #  @param svn_filename Path of file, relative to the SVN checkout base
+    #  @param license_text List of strings that comprise the license to apply
+    #  @return @c True if the license is there
+    with open(filename) as fh:
+        lines = 0
+        licensed = False
+        while lines < 10 and not licensed:
+            fline = fh.readline()
+            # Checking the first line of the file should be enough
+            if license_text[0] in fline:
+                licensed = True
+                break
+            lines += 1
+    if licensed:
+        logger.debug("File {0} appears to already have a copyright/license statement in it".format(svn_filename))
+    return licensed
+
+
+def inject_license_if_needed(filename, svn_filename, license_text, license_writer):
+    ## @brief Add a license statement to a file, unless it already has one
+    #  @param filename Path to file
+    #  @param svn_filename Path of file, relative to the SVN checkout base
+    #  @param license_text List of strings that comprise the license to apply
+    #  @param license_writer write_c_license() or write_py_license()
+    #  @return @c True if a license was added
+    if file_has_license(filename, svn_filename, license_text):
+        return False
+    # Get the file's mode here to then restore it
+    fmode = os.stat(filename).st_mode
+    inject_license(filename, license_text, license_writer)
+    os.chmod(filename, fmode)
+    return True
+
+
+def inject_license(filename, license_text, license_writer):
+    ## @brief Rewrite a file with a license added
+    #  @param filename Path to file
+    #  @param license_text List of strings that comprise the license to apply
+    #  @param license_writer write_c_license() or write_py_license()
+    target_filename = filename + ".license"
+    with open(filename) as ifh:
+        with open(target_filename, "w") as ofh:
+            license_writer(ifh, ofh, license_text)
+    os.rename(target_filename, filename)
+
+
+def inject_c_license(filename, license_text):
+    ## @brief Add a license file, C style commented
+    inject_license(filename, license_text, write_c_license)
+
+
+def inject_py_license(filename, license_text):
+    ## @brief Add a license file, python style commented
+    inject_license(filename, license_text, write_py_license)
+
+
+def write_c_license(ifh, ofh, license_text):
+    ## @brief Copy a file adding a license, C style commented
+    #  @param ifh Input file object
+    #  @param ofh Output file object
+    #  @param license_text List of strings that comprise the license to apply
+    first_line = ifh.readline()
+    license_comment = "/*\n{0}*/\n\n".format("".join("  {0}\n".format(line) if line != "" else "\n"
+                                                      for line in license_text))
+    # If the first line is a -*- C++ -*- then it has to stay the
+    # first line
+    if re.search(r"-\*-\s+[cC]\+\+\s+-\*\-", first_line):
+        multi_line_c_comment = False
+        # Beware of breaking a multi-line C style comment
+        if first_line.startswith("/*") and ("*/" not in first_line[2:]):
+            first_line = first_line[:-1] + " */\n"
+            multi_line_c_comment = True
+        ofh.write(first_line + "\n" + license_comment + ("/*\n" if multi_line_c_comment else ""))
+    else:
+        ofh.write(license_comment + first_line)
+    # The rest of the file is copied in large blocks, not line by line
+    shutil.copyfileobj(ifh, ofh, 1024 * 1024)
+
+
+def write_py_license(ifh, ofh, license_text):
+    ## @brief Copy a file adding a license, python style commented
+    #  @param ifh Input file object
+    #  @param ofh Output file object
+    #  @param license_text List of strings that comprise the license to apply
+    first_line = ifh.readline()
+    license_comment = "".join("# {0}\n".format(line) if line != "" else "#\n" for line in license_text)
+    # If the first line is a #! then it has to stay the
+    # first line
+    if first_line.startswith("#!"):
+        ofh.write(first_line + "\n" + license_comment)
+    else:
+        ofh.write(license_comment + "\n" + first_line)
+    # The rest of the file is copied in large blocks, not line by line
+    shutil.copyfileobj(ifh, ofh, 1024 * 1024)
+
+
+def exit_on_signal(signum, frame):
+    ## @brief Signal handler that exits through the normal exception handling, so that
+    #  @c finally clauses run
+    sys.exit(128 + signum)
+
+
+def default_daemon_socket():
+    ## @brief Default path of the daemon's socket, in a directory private to the user
+    #  (which, as the path is predictable, is checked with daemon_socket_dir_problem()
+    #  before it is used)
+    return os.path.join(tempfile.gettempdir(), "svnpull-{0}".format(os.getuid()), "daemon.sock")
+
+
+def daemon_socket_dir_problem(socket_dir):
+    ## @brief Check that the directory of the daemon's socket is controlled by this user
+    #  alone, so that nobody else can put their own socket (or a symlink) in its place
+    #  @param socket_dir Directory holding the socket
+    #  @return Reason the directory cannot be trusted, or @c None if it can
+    try:
+        dir_stat = os.lstat(socket_dir)
+    except OSError as e:
+        return str(e)
+    if stat.S_ISLNK(dir_stat.st_mode):
+        return "{0} is a symlink".format(socket_dir)
+    if not stat.S_ISDIR(dir_stat.st_mode):
+        return "{0} is not a directory".format(socket_dir)
+    if dir_stat.st_uid != os.getuid():
+        return "{0} is owned by user {1}".format(socket_dir, dir_stat.st_uid)
+    if stat.S_IMODE(dir_stat.st_mode) != 0o700:
+        return "{0} has mode {1:o}, not 700".format(socket_dir, stat.S_IMODE(dir_stat.st_mode))
+    return None
+
+
+def forward_to_daemon(socket_path, argv):
+    ## @brief Pass a command to a running svnpull daemon, showing its output as it comes
+    #  @param socket_path Path to the daemon's Unix socket
+    #  @param argv Command line arguments
+    #  @return Exit code of the command, or @c None if no daemon is running (or its socket
+    #  cannot be trusted, in which case the command should be run locally)
+    socket_dir = os.path.dirname(os.path.abspath(socket_path))
+    if not os.path.lexists(socket_dir):
+        return None
+    problem = daemon_socket_dir_problem(socket_dir)
+    if problem:
+        logger.warning("Not using the svnpull daemon at {0}: {1}".format(socket_path, problem))
+        return None
+    try:
+        socket_stat = os.lstat(socket_path)
+    except OSError:
+        return None
+    if not stat.S_ISSOCK(socket_stat.st_mode) or socket_stat.st_uid != os.getuid():
+        logger.warning("Not using the svnpull daemon at {0}: not a socket owned by this user".format(socket_path))
+        return None
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(socket_path)
+    except socket.error as e:
+        connection.close()
+        if e.errno not in (errno.ENOENT, errno.ECONNREFUSED):
+            logger.warning("Failed to connect to the svnpull daemon at {0}: {1}".format(socket_path, e))
+        return None
+    logger.info("Passing the import to the svnpull daemon at {0}".format(socket_path))
+    try:
+        connection.sendall(json.dumps({"argv": argv, "cwd": os.getcwd(), "env": dict(os.environ)}) + "\n")
+        for line in connection.makefile():
+            message = json.loads(line)
+            if "exit" in message:
+                return message["exit"]
+            stream = sys.stderr if message["stream"] == "stderr" else sys.stdout
+            stream.write(message["data"].encode("utf-8"))
+            stream.flush()
+    finally:
+        connection.close()
+    logger.error("Lost the connection to the svnpull daemon at {0}".format(socket_path))
+    return 1
+
+
+class DaemonOutput(object):
+    ## @brief File-like object that sends what is written to it to a daemon's client
+    def __init__(self, connection, stream, lock):
+        ## @param connection Socket connected to the client
+        #  @param stream Name of the client's stream to write to (stdout or stderr)
+        #  @param lock Lock shared by all of the outputs to the same client
+        self.connection = connection
+        self.stream = stream
+        self.lock = lock
+
+    def write(self, data):
+        if not data:
+            return
+        message = json.dumps({"stream": self.stream, "data": data.decode("utf-8", "replace")}) + "\n"
+        with self.lock:
+            try:
+                self.connection.sendall(message)
+            except socket.error:
+                # The client has gone, but the import carries on
+                pass
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+
+class SvnPullDaemon(object):
+    ## @brief Runs svnpull commands passed to it by bin/svnpull.py on a Unix socket,
+    #  one at a time, in a single long lived process
+    #
+    #  The compiled path filters, loaded exceptions and license files, package indexes
+    #  and shared SSH connections are kept between commands, so that a series of
+    #  imports (e.g., from CI) does not set them up again each time. Commands run in
+    #  the client's current directory and environment (so the client's PATH, SVN_SSH,
+    #  SSH agent and Kerberos credentials are used), and their output is streamed back
+    #  to the client. Shared SSH connections are only reused for the same SVN_SSH.
+    def __init__(self, socket_path):
+        ## @param socket_path Path of the Unix socket to listen on
+        self.socket_path = socket_path
+        self.stopping = False
+
+    def serve(self):
+        ## @brief Listen for commands until killed
+        #
+        #  The socket is only made in a directory owned by this user, with mode 700
+        #  (which is made if it does not exist), so that only this user can run commands
+        #  (and nobody else can stand in for the daemon).
+        socket_dir = os.path.dirname(os.path.abspath(self.socket_path))
+        if not os.path.lexists(socket_dir):
+            try:
+                os.makedirs(socket_dir, 0o700)
+                os.chmod(socket_dir, 0o700)
+            except OSError as e:
+                # Someone else may have made it first, which the check below catches
+                if e.errno != errno.EEXIST:
+                    raise
+        problem = daemon_socket_dir_problem(socket_dir)
+        if problem:
+            logger.fatal("Refusing to listen on {0}: {1}".format(self.socket_path, problem))
+            sys.exit(1)
+        if os.path.lexists(self.socket_path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.socket_path)
+                logger.fatal("An svnpull daemon is already listening on {0}".format(self.socket_path))
+                sys.exit(1)
+            except socket.error:
+                os.remove(self.socket_path)
+            finally:
+                probe.close()
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+        server.listen(5)
+        signal.signal(signal.SIGTERM, self.stop)
+        print "svnpull daemon listening on {0}".format(self.socket_path)
+        sys.stdout.flush()
+        try:
+            while not self.stopping:
+                try:
+                    connection, address = server.accept()
+                except socket.error as e:
+                    if e.errno == errno.EINTR:
+                        continue
+                    raise
+                try:
+                    self.handle(connection)
+                finally:
+                    connection.close()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close()
+            os.remove(self.socket_path)
+
+    def stop(self, signum, frame):
+        ## @brief Signal handler that stops the daemon, after cleaning up any import
+        #  that is running
+        self.stopping = True
+        sys.exit(128 + signum)
+
+    def handle(self, connection):
+        ## @brief Run one command and send its output and exit code to the client
+        #  @param connection Socket connected to the client
+        line = connection.makefile().readline()
+        if not line:
+            # Just checking that the daemon is there
+            return
+        try:
+            request = json.loads(line)
+            argv = [ arg.encode("utf-8") for arg in request["argv"] ]
+            cwd = request["cwd"].encode("utf-8")
+            env = dict((name.encode("utf-8"), value.encode("utf-8"))
+                       for name, value in request.get("env", os.environ).iteritems())
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            logger.error("Bad request to svnpull daemon: {0}".format(e))
+            return
+        logger.info("Running {0} in {1}".format(argv, cwd))
+        lock = threading.Lock()
+        stdout, stderr, level = sys.stdout, sys.stderr, logger.level
+        daemon_env = dict(os.environ)
+        os.environ.clear()
+        os.environ.update(env)
+        sys.stdout = DaemonOutput(connection, "stdout", lock)
+        sys.stderr = DaemonOutput(connection, "stderr", lock)
+        hdlr.stream = sys.stdout
+        exit_code = 1
+        try:
+            os.chdir(cwd)
+            parser = make_parser()
+            exit_code = run_command(parser.parse_args(argv), parser)
+        except SystemExit as e:
+            if self.stopping:
+                raise
+            exit_code = e.code if isinstance(e.code, int) else 0 if e.code is None else 1
+        except Exception:
+            logger.exception("Failed to run {0}".format(argv))
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+            hdlr.stream = stdout
+            logger.setLevel(level)
+            os.environ.clear()
+            os.environ.update(daemon_env)
+        try:
+            connection.sendall(json.dumps({"exit": exit_code}) + "\n")
+        except socket.error:
+            pass
+
+
+def make_parser():
+    ## @brief Make the command line parser
+    #  @return argparse.ArgumentParser
+    parser = argparse.ArgumentParser(description=textwrap.dedent('''\
+                                    Pull a package revision from SVN and apply to the current athena
+                                    git repository.
+
+                                    Run this script from inside the athena git repository clone to
+                                    be updated.
+
+                                    SVN package revisions are usually specified as
+                                    - A simple package name, which means import the package trunk,
+                                      e.g., xAODMuon imports Event/xAOD/xAODMuon/trunk
+
+                                    - A package tag, which imports that SVN tag, e.g., xAODMuon-00-18-01
+                                      imports Event/xAOD/xAODMuon/tags/xAODMuon-00-18-01
+
+                                    Some more advanced specifiers can be used for special cases:
+                                    - A tag name ending "-branch" will import the corresponding development
+                                      branch, e.g., xAODMuon-00-11-04-branch will import
+                                      Event/xAOD/xAODMuon/branches/xAODMuon-00-11-04-branch
+
+                                    - A package path + SVN sub path, PACKAGEPATH+SVNSUBPATH, (NOTE THE
+                                      USE OF '+') where PACKAGEPATH is the path to the package root in
+                                      SVN and git and SVNSUBPATH is the path to the SVN version to import; e.g.,
+                                      Reconstruction/RecJobTransforms+devbranches/RecJobTransforms_RAWtoALL
+                                      (again, ***note the plus sign***) will import the SVN path
+                                      Reconstruction/RecJobTransforms/devbranches/RecJobTransforms_RAWtoALL
+                                      to Reconstruction/RecJobTransforms
+
+                                    - PACKAGE@latest imports the highest numbered tag of the package and
+                                      PACKAGE@rREVISION the last tag made at or before that SVN revision,
+                                      e.g., xAODMuon@r780000
+
+                                    - With --replay, FIRSTTAG..LASTTAG gives all of the tags of a package
+                                      from FIRSTTAG to LASTTAG, which are imported and committed in turn,
+                                      e.g., xAODMuon-00-18-01..xAODMuon-00-18-20
+
+                                    The final specifier is only needed if the package to be imported is
+                                    not in your current git checkout, is missing a CMakeLists.txt file
+                                    or if you want to import an unusual SVN revision, such as a
+                                    development branch.
+
+                                    The --files specifier can be used to import only some files or paths
+                                    to git, with globs supported, e.g.,
+
+                                      --files src/* MyPackage/*.h share/important_file.py
+
+                                    For consistency options applied during the primary ATLAS SVN to
+                                    git migration are re-applied by default.
+                                    '''),
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('svnpackage', nargs="*",
+                        help="SVN package to import, usually a plain package name or tag (see above)")
+    parser.add_argument('--manifest', metavar="FILE",
+                        help="Import the SVN packages listed in FILE, one per line in the same format as on the "
+                        "command line. Finished imports are recorded in a journal, .git/svnpull/journal, so that "
+                        "a re-run skips packages already imported from the same SVN revision whose files "
+                        "in git have not changed since")
+    parser.add_argument('--files', nargs="+",
+                        help="Only package files matching the values specified here are imported (globs allowed). "
+                        "This can be used to import only some files from the SVN package and will "
+                        "disable the normal --svnfilterexceptions matching.", default=[])
+    parser.add_argument('--revision', type=int, default=0,
+                        help="Work at specific SVN revision number instead of HEAD")
+    parser.add_argument('--svnroot', metavar='SVNDIR',
+                        help="Location of the SVN repository (defaults to %(default)s)",
+                        default="svn+ssh://svn.cern.ch/reps/atlasoff")
+    parser.add_argument('--svnfilterexceptions', metavar="FILE",
+                        help="File listing path globs to exempt from SVN import filter (lines with '+PATH') or "
+                        "to always reject (lines with '-PATH'); default %(default)s. "
+                        "It is strongly recommended to keep the default value to ensure consistency "
+                        "with the official ATLAS migration.",
+                        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "share", "svnpull", "atlasoffline-exceptions.txt"))
+    parser.add_argument('--licensefile', metavar="FILE", help="License file to add to C++ and python source code "
+                        "files (default %(default)s). "
+                        "It is strongly recommended to keep the default value to ensure consistency "
+                        "with the official ATLAS migration, which attributed copyright to CERN. "
+                        "Use NONE to disable if it is really necessary.",
+                        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "share", "svnpull", "cerncopy.txt"))
+    parser.add_argument('--licenseexceptions', metavar="FILE", help="File listing path globs to exempt from or  "
+                        "always apply license file to (same format as --svnfilterexceptions). "
+                        "It is strongly recommended to keep the default value to ensure consistency "
+                        "with the official ATLAS migration.",
+                        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "share", "svnpull", "atlaslicense-exceptions.txt"))
+    parser.add_argument('--svn-checkout', action="store_true",
+                        help="Fetch packages with a full svn checkout instead of the default svn export "
+                        "(export only writes the versioned files, without any working copy metadata)")
+    parser.add_argument('--sync', action="store_true",
+                        help="Instead of replacing the whole package in git, only write, delete or change "
+                        "the mode of files that differ from SVN, so that unchanged files keep their timestamps "
+                        "(avoiding a rebuild of the whole package)")
+    parser.add_argument('--delta', action="store_true",
+                        help="Fetch from SVN only the files that changed since the last --delta import of each "
+                        "package, using an SVN listing of file sizes and revisions (the whole package is fetched "
+                        "if there is no record of the last import or most files changed)")
+    parser.add_argument('--prefilter', action="store_true",
+                        help="Decide which files to import from an SVN listing of the package, then fetch only "
+                        "those files (into a sparse checkout), instead of fetching the whole package and "
+                        "cleaning it up afterwards. Files with svn:keywords or svn:eol-style are fetched "
+                        "whatever their size in the listing, and packages with svn:externals are fetched whole, "
+                        "so the import is the same as without --prefilter. This is the default with --files.")
+    parser.add_argument('--plan', action="store_true",
+                        help="Print what a --delta import would fetch and delete, and how much would be "
+                        "transferred, then exit without changing anything")
+    parser.add_argument('--audit', metavar="REPORT",
+                        help="Instead of importing, compare each package in git with the SVN version given, "
+                        "as it would be imported (with the SVN filters and the license applied), and write a "
+                        "report of identical, drifted and missing packages to REPORT (CSV if it ends in .csv, "
+                        "otherwise JSON). --jobs packages are compared at once, and digests are cached so that "
+                        "a repeated audit only hashes packages whose files changed. The exit code is 1 if any "
+                        "package is not identical.")
+    parser.add_argument('--replay', action="store_true",
+                        help="Import the given tags of one package in order, committing each one to the current "
+                        "branch; after the first tag only the changes between tags are fetched and processed. "
+                        "FIRSTTAG..LASTTAG gives all of the tags in between")
+    parser.add_argument('--git-branch', metavar="BRANCH",
+                        help="Write the import straight into git, as a commit on BRANCH that gives the SVN tags in "
+                        "its message (BRANCH is started from HEAD if it does not exist), instead of changing "
+                        "the working tree")
+    parser.add_argument('--update-worktree', action="store_true",
+                        help="With --git-branch, also apply the imported changes to the index and working tree")
+    parser.add_argument('--svn-cache', metavar="DIR",
+                        help="Keep SVN working copies of imported packages in this cache directory, so that "
+                        "importing another version of a package only transfers the differences")
+    parser.add_argument('--svn-cache-size', metavar="MB", type=int, default=10000,
+                        help="Maximum size of the SVN working copy cache, least recently used packages are "
+                        "removed when it is exceeded (default %(default)s)")
+    parser.add_argument('--svn-cache-list', action="store_true",
+                        help="List the contents of the SVN working copy cache, then exit")
+    parser.add_argument('--svn-cache-prune', action="store_true",
+                        help="Remove least recently used packages from the SVN working copy cache until it "
+                        "fits into --svn-cache-size (use 0 to empty it), then exit")
+    parser.add_argument('--license-cache', metavar="DIR",
+                        help="Keep the results of adding the license to files in this cache directory (which can be "
+                        "shared), so that files already seen in an earlier import are not processed again")
+    parser.add_argument('--license-cache-size', metavar="MB", type=int, default=1000,
+                        help="Maximum size of the license cache, least recently used files are removed when it is "
+                        "exceeded (default %(default)s)")
+    parser.add_argument('--check-tags', action="store_true",
+                        help="Check tag and branch names in the local catalog of SVN tags before importing "
+                        "them, exiting with suggestions for names that do not exist (this can list the "
+                        "package's tags from SVN first, so it is not done by default; a missing tag otherwise "
+                        "fails when it is fetched)")
+    parser.add_argument('--no-catalog', action="store_true",
+                        help="Do not use the local catalog of SVN tags (.git/svnpull/tags.sqlite), which is "
+                        "needed for PACKAGE@... specifiers, FIRSTTAG..LASTTAG ranges, --check-tags and for "
+                        "--audit to report missing tags")
+    parser.add_argument('--catalog-max-age', metavar="HOURS", type=float, default=24,
+                        help="List a package's tags from SVN again if the catalog's record of them is older "
+                        "than this (default %(default)s)")
+    parser.add_argument('--list-tags', action="store_true",
+                        help="List the tags of the given SVN packages, with the revision of each, then exit")
+    parser.add_argument('--workers', metavar="N", type=int, default=1,
+                        help="Add the license to the files of large packages with N worker processes "
+                        "(default %(default)s)")
+    parser.add_argument('--workers-min-files', metavar="N", type=int, default=LicensePool.min_batch,
+                        help="Only use the --workers processes for packages with at least N files to license, "
+                        "as for smaller packages sharing out the work costs more than it saves (default "
+                        "%(default)s)")
+    parser.add_argument('--ssh-connections', metavar="N", type=int,
+                        help="For svn+ssh:// repositories, share N persistent SSH connections between all svn "
+                        "commands, instead of connecting for each command (default one per job, up to 4; "
+                        "use 0 to disable)")
+    parser.add_argument('--svn-timeout', metavar="SECONDS", type=int,
+                        help="Kill any SVN command that has not succeeded (including retries) after this time")
+    parser.add_argument('--progress', action="store_true",
+                        help="Show a running count of the files fetched from SVN (ignored with --jobs)")
+    parser.add_argument('--jobs', '-j', type=int, default=1, metavar="N",
+                        help="Check out and prepare up to N packages concurrently (copying into git is "
+                        "still done one package at a time). Failures are reported for each package at the "
+                        "end instead of aborting the whole import (default %(default)s)")
+    parser.add_argument('--profile', action="store_true",
+                        help="Print a table of the wall time, files and bytes processed and SVN retries "
+                        "for each package and each import phase (resolve, fetch, cleanup, license, sync)")
+    parser.add_argument('--metrics-json', metavar="FILE",
+                        help="Write the per package and per phase metrics to FILE as JSON")
+    parser.add_argument('--cprofile', metavar="FILE",
+                        help="Run the in-process import phases under cProfile and dump the statistics to FILE "
+                        "(for use with pstats)")
+    parser.add_argument('--debug', '--verbose', "-v", action="store_true",
+                        help="Switch logging into DEBUG mode (default is WARNING)")
+    parser.add_argument('--info', action="store_true",
+                        help="Switch logging into INFO mode (default is WARNING)")
+
+    parser.add_argument('--list-duplicates', action="store_true",
+                        help="List package names that are used by more than one package in the git checkout, "
+                        "then exit (such packages need the PACKAGEPATH+SVNSUBPATH specifier)")
+    parser.add_argument('--result-json', metavar="FILE",
+                        help="Write the outcome of each import (status, error, files written, skipped and "
+                        "licensed, and the time of each phase) to FILE as JSON")
+    parser.add_argument('--daemon', action="store_true",
+                        help="Run as a daemon, listening on --daemon-socket, that does imports asked for by "
+                        "later svnpull commands (one at a time), keeping the compiled filters, package "
+                        "indexes and SSH connections to SVN between them. Each import runs with the "
+                        "environment of the command that asked for it (e.g., its PATH, SVN_SSH and credentials)")
+    parser.add_argument('--daemon-socket', metavar="PATH", default=default_daemon_socket(),
+                        help="Unix socket of the svnpull daemon; when a daemon is listening, imports are "
+                        "passed to it instead of being done by this command (default %(default)s). The "
+                        "socket's directory must be owned by the user, with mode 700, or the daemon will not "
+                        "start and commands are not passed to it")
+    parser.add_argument('--no-daemon', action="store_true",
+                        help="Do the import in this command, even if a daemon is running")
+    return parser
+
+
+def main(argv=None):
+    ## @brief Command line entry point
+    #  @param argv Command line arguments (defaults to sys.argv[1:])
+    if argv is None:
+        argv = sys.argv[1:]
+    if hdlr not in logger.handlers:
+        logger.addHandler(hdlr)
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    if args.daemon:
+        logger.setLevel(logging.DEBUG if args.debug else logging.INFO if args.info else logging.WARNING)
+        SvnPullDaemon(args.daemon_socket).serve()
+        return
+    if not args.no_daemon:
+        exit_code = forward_to_daemon(args.daemon_socket, argv)
+        if exit_code is not None:
+            sys.exit(exit_code)
+    # Make sure that a kill cleans up like Ctrl-C does
+    signal.signal(signal.SIGTERM, exit_on_signal)
+    sys.exit(run_command(args, parser))
+
+
+def run_command(args, parser):
+    ## @brief Run the import for the command line, reporting how it went
+    #  @param args Parsed command line arguments
+    #  @param parser Command line parser (for reporting invalid arguments)
+    #  @return Exit code
+    if args.result_json:
+        args.result_json = os.path.abspath(args.result_json)
+    result = run(args, parser)
+    if args.result_json:
+        with open(args.result_json, "w") as result_fh:
+            json.dump(result.as_dict(), result_fh, indent=2)
+    if result.imported and result.ok:
+        if args.replay:
+            print "Pull from SVN succeeded. Use 'git log -p' to review the commits made for each tag."
+        elif args.git_branch:
+            print textwrap.fill("Pull from SVN succeeded. Use 'git log -p {0}' to review the import, "
+                                "which has been committed to branch {0}.".format(args.git_branch))
+        else:
+            print textwrap.fill("Pull from SVN succeeded. Use 'git status' to check which files "
+                                "have been changed and 'git diff' to review the changes in detail. "
+                                "When you are happy with your changes commit with a good commit message - "
+                                "as an update has been done from SVN it is recommended to give the "
+                                "SVN tag in the one line commit summary.")
+    return result.exit_code
+
+
+def parse_args(argv):
+    ## @brief Parse svnpull command line arguments, for calling run() as a library
+    #  @param argv List of arguments, as they would be given on the command line
+    #  @return Parsed arguments
+    return make_parser().parse_args(argv)
+
+
+def run(args, parser=None):
+    ## @brief Do the imports (or other actions) asked for, in the git repository
+    #  containing the current directory
+    #
+    #  Invalid arguments and package specifiers exit (raising SystemExit) as they
+    #  would from the command line; failures of the imports themselves are given
+    #  in the result. The current directory is restored afterwards, and messages go
+    #  to the "svnpull" logger (which only main() gives a handler).
+    #  @param args Parsed arguments (see parse_args())
+    #  @param parser Command line parser, used to report invalid arguments
+    #  @return ImportResult
+    if parser is None:
+        parser = make_parser()
+    # Closed when the command finishes, however it finishes (a daemon runs many commands)
+    resources = []
+    # The imports run from the root of the git repository, but the caller's current
+    # directory is left as it was
+    cwd = os.getcwd()
+    try:
+        return run_imports(args, parser, resources)
+    finally:
+        for resource in resources:
+            resource.close()
+        os.chdir(cwd)
+
+
+def run_imports(args, parser, resources):
+    ## @brief Do the work of run()
+    #  @param args Parsed arguments (see parse_args())
+    #  @param parser Command line parser, used to report invalid arguments
+    #  @param resources List to add anything that must be closed when the command finishes to
+    #  @return ImportResult
+    logger.setLevel(logging.DEBUG if args.debug else logging.INFO if args.info else logging.WARNING)
+    # Output files are relative to where the command was run, not the git repository root
+    if args.metrics_json:
+        args.metrics_json = os.path.abspath(args.metrics_json)
+    if args.cprofile:
+        args.cprofile = os.path.abspath(args.cprofile)
+    if args.audit:
+        args.audit = os.path.abspath(args.audit)
+
+    svn_command_options["timeout"] = args.svn_timeout
+    svn_command_options["progress"] = args.progress and args.jobs == 1
+    if args.files:
+        args.prefilter = True
+
+    if args.svn_cache:
+        wc_cache = SvnWorkingCopyCache(args.svn_cache, max_size=args.svn_cache_size * 1024 * 1024)
+    else:
+        wc_cache = None
+    if args.license_cache:
+        license_cache = LicenseCache(args.license_cache, max_size=args.license_cache_size * 1024 * 1024)
+    else:
+        license_cache = None
+    if args.svn_cache_list or args.svn_cache_prune:
+        if not wc_cache:
+            parser.error("--svn-cache must be given to list or prune the cache")
+        if args.svn_cache_prune:
+            print "Removed {0} packages from the cache".format(wc_cache.prune())
+        for info in wc_cache.entries():
+            print "{0:60s} {1:40s} {2:>8} {3:8.1f}MB {4}".format(info["package"], info["tag"], info["revision"],
+                                                                 info["size"] / 1024.0 / 1024,
+                                                                 time.strftime("%Y-%m-%d %H:%M",
+                                                                               time.localtime(info["last_used"])))
+        return ImportResult()
+    if args.manifest:
+        args.svnpackage.extend(load_manifest(args.manifest))
+    if not args.svnpackage and not args.list_duplicates:
+        parser.error("at least one SVN package to import must be given")
+    if args.check_tags and args.no_catalog:
+        parser.error("--check-tags cannot be used with --no-catalog")
+    if args.update_worktree and not args.git_branch:
+        parser.error("--update-worktree can only be used with --git-branch")
+    if args.sync and args.git_branch:
+        parser.error("--sync cannot be used with --git-branch")
+    if args.delta and (args.git_branch or args.jobs > 1):
+        parser.error("--delta cannot be used with --git-branch or --jobs")
+    if args.replay and (args.git_branch or args.delta or args.sync or args.files or args.jobs > 1):
+        parser.error("--replay cannot be used with --git-branch, --delta, --sync, --files or --jobs")
+    if args.audit and (args.git_branch or args.delta or args.sync or args.files or args.replay or args.plan):
+        parser.error("--audit cannot be used with --git-branch, --delta, --sync, --files, --replay or --plan")
+    svn_path_accept, svn_path_reject = load_exceptions_file(args.svnfilterexceptions, reject_changelog=True)
+
+    if len(args.svnpackage) > 1 and args.files:
+        logger.error("You have specified multiple SVN packages and to filter on package files "
+                       "to import, which almost certainly will not work - aborting")
+        return ImportResult(exit_code=1)
+
+    # Check that we do seem to be in a git repository
+    gitrepo = find_git_root()
+    if not gitrepo:
+        logger.fatal("Not a git repository (or any of the parent directories), run from inside a clone of the athena repository.")
+        return ImportResult(exit_code=1)
+    os.chdir(gitrepo)
+    staging.setup(gitrepo)
+
+    # Share SSH connections to the SVN server
+    ssh_connections = min(args.jobs, 4) if args.ssh_connections is None else args.ssh_connections
+    if args.svnroot.startswith("svn+ssh://") and ssh_connections > 0:
+        svn_command_options["ssh"] = shared_ssh_multiplexer(args.svnroot, ssh_connections, args.profile)
+    else:
+        svn_command_options["ssh"] = None
+
+    # License file loading
+    if args.licensefile and args.licensefile != "NONE":
+        license_text = load_license_file(args.licensefile)
+    else:
+        license_text = None
+    if args.licenseexceptions:
+        license_path_accept, license_path_reject = load_exceptions_file(args.licenseexceptions)
+    else:
+        license_path_accept = license_path_reject = []
+
+    # Instrumentation (always collected, as the result is made from it)
+    profiler = ThreadProfiler() if args.cprofile else None
+    all_metrics = [ImportMetrics("(package index)", profiler)]
+
+    # Map package names to paths
+    with activate_metrics(all_metrics[0]), metrics_phase("resolve"):
+        package_index = load_package_index(gitrepo, [ re.split(r"[-@]", svn_package)[0]
+                                                      for svn_package in args.svnpackage if "+" not in svn_package ])
+    if args.list_duplicates:
+        for package, paths in sorted(find_duplicate_packages(package_index).iteritems()):
+            print "{0}: {1}".format(package, " ".join(paths))
+        return ImportResult()
+    package_path_dict = dict((package, paths[0]) for package, paths in package_index.iteritems())
+    journal = ImportJournal(gitrepo) if args.manifest and not args.audit else None
+    if args.no_catalog and not args.list_tags:
+        tag_catalog = None
+    else:
+        tag_catalog = TagCatalog(os.path.join(svnpull_state_dir(gitrepo), "tags.sqlite"), args.svnroot,
+                                 max_age=args.catalog_max_age * 3600)
+        resources.append(tag_catalog)
+    if args.list_tags:
+        for svn_package in args.svnpackage:
+            package_name = svn_package.split("@")[0]
+            package = package_path_dict.get(package_name, package_name)
+            tags = tag_catalog.versions(package)
+            if tags is None:
+                logger.error("Failed to list the tags of {0}".format(package))
+                continue
+            for tag, revision in sorted(tags, key=lambda tag: tag[1]):
+                print "{0} {1}".format(tag, revision)
+        return ImportResult()
+
+    if args.replay:
+        svn_packages = []
+        for svn_package in args.svnpackage:
+            if ".." in svn_package:
+                svn_packages.extend(expand_tag_range(svn_package, package_path_dict, tag_catalog))
+            else:
+                svn_packages.append(svn_package)
+        args.svnpackage = svn_packages
+
+    # Resolve each package we were given into what is to be imported
+    import_list = []
+    result = ImportResult()
+    for svn_package in args.svnpackage:
+        full_clobber = True
+        metrics = ImportMetrics(svn_package, profiler)
+        with activate_metrics(metrics), metrics_phase("resolve"):
+            if "@" in svn_package and "+" not in svn_package:
+                if not tag_catalog:
+                    logger.error("The {0} specifier needs the tag catalog (do not use --no-catalog)".format(svn_package))
+                    sys.exit(2)
+                svn_package = resolve_catalog_specifier(svn_package, package_path_dict, tag_catalog)
+            package_name, package, svn_package_path = get_svn_path_from_tag_name(svn_package, package_path_dict)
+            svn_missing = False
+            if tag_catalog and args.audit:
+                # An audit reports missing versions, rather than stopping
+                kind, name = os.path.split(svn_package_path)
+                svn_missing = kind in ("tags", "branches") and tag_catalog.has_version(package, kind, name) is False
+            elif tag_catalog and args.check_tags:
+                check_svn_version_exists(tag_catalog, svn_package, package, svn_package_path)
+        # If we have a --files option then redo the accept/reject paths here
+        # (as the package path needs to be prepended it needs to happen in this loop)
+        if args.files:
+            full_clobber = False
+            svn_path_reject = [re.compile(fnmatch.translate("*"))]
+            svn_path_accept = []
+            for glob in args.files:
+                package_glob = os.path.join(package_path_dict[package_name], glob)
+                logger.debug("Will accept files matching {0}".format(package_glob))
+                svn_path_accept.append(re.compile(fnmatch.translate(package_glob)))
+            logger.debug("{0}".format([ m.pattern for m in svn_path_accept ]))
+        logger.debug("Will import {0} to {1}, SVN revision {2}".format(os.path.join(package, svn_package_path),
+                                                                       package_path_dict[package_name],
+                                                                       "HEAD" if args.revision == 0 else args.revision))
+        if len(package_index.get(package_name, [])) > 1 and "+" not in svn_package:
+            logger.warning("Package name {0} is used by several packages ({1}), importing to {2}; use "
+                           "the PACKAGEPATH+SVNSUBPATH specifier to choose another".format(package_name,
+                                                                                          " ".join(package_index[package_name]),
+                                                                                          package))
+        svn_import = {"svn_package": svn_package, "package": package, "tag": svn_package_path,
+                      "full_clobber": full_clobber,
+                      "svn_path_accept": svn_path_accept, "svn_path_reject": svn_path_reject,
+                      "svn_missing": svn_missing, "metrics": metrics}
+        if journal:
+            svn_import["options"] = import_options_key(svn_path_accept, svn_path_reject, license_text,
+                                                       license_path_accept, license_path_reject, full_clobber)
+            try:
+                with activate_metrics(metrics), metrics_phase("resolve"):
+                    svn_import["svn_revision"] = svn_commit_revision(args.svnroot, package, svn_package_path,
+                                                                     args.revision)
+            except RuntimeError as e:
+                # Let the import itself fail and report this
+                logger.debug("Failed to get SVN revision of {0}: {1}".format(svn_package, e))
+                svn_import["svn_revision"] = None
+            if journal.is_done(svn_package, os.path.join(package, svn_package_path),
+                               svn_import["svn_revision"], svn_import["options"]):
+                logger.info("Skipping {0}, already imported from SVN revision {1}".format(svn_package,
+                                                                                         svn_import["svn_revision"]))
+                print "{0} is already imported and unchanged, skipping".format(svn_package)
+                result.add(svn_import, "skipped")
+                continue
+        import_list.append(svn_import)
+        all_metrics.append(metrics)
+
+    if args.replay and len(set(svn_import["package"] for svn_import in import_list)) > 1:
+        logger.error("All of the tags to --replay must be of the same package")
+        return ImportResult(exit_code=2)
+
+    if args.plan:
+        for svn_import in import_list:
+            with activate_metrics(svn_import["metrics"]), metrics_phase("plan"):
+                plan = make_delta_plan(args.svnroot, gitrepo, svn_import["package"], svn_import["tag"],
+                                       svn_path_accept=svn_import["svn_path_accept"],
+                                       svn_path_reject=svn_import["svn_path_reject"],
+                                       revision=args.revision, license_text=license_text,
+                                       license_path_accept=license_path_accept,
+                                       license_path_reject=license_path_reject)
+            print_delta_plan(svn_import["svn_package"], plan)
+        return ImportResult()
+
+    if args.audit:
+        try:
+            return audit_packages(args, import_list, DriftAudit(args.svnroot, gitrepo, revision=args.revision,
+                                                                license_text=license_text,
+                                                                license_path_accept=license_path_accept,
+                                                                license_path_reject=license_path_reject,
+                                                                wc_cache=wc_cache))
+        finally:
+            staging.cleanup()
+            if args.profile:
+                print_metrics_table(all_metrics)
+
+    try:
+        git_importer = GitFastImport(gitrepo, args.git_branch) if args.git_branch else None
+    except RuntimeError as e:
+        logger.fatal("Cannot write the import to branch {0}: {1}".format(args.git_branch, e))
+        return ImportResult(exit_code=1)
+    try:
+        license_pool.setup(args.workers, license_text, license_cache, args.workers_min_files)
+        import_packages(args, gitrepo, import_list, license_text, license_path_accept, license_path_reject, wc_cache,
+                        journal, git_importer, license_cache, result)
+    finally:
+        license_pool.close()
+        staging.cleanup()
+        if license_cache:
+            logger.info("License cache: {0} hits, {1} misses".format(license_cache.hits, license_cache.misses))
+            license_cache.prune()
+        if git_importer:
+            git_importer.abort()
+        if args.profile:
+            print_metrics_table(all_metrics)
+        if args.metrics_json:
+            with open(args.metrics_json, "w") as metrics_fh:
+                json.dump([ metrics.as_dict() for metrics in all_metrics ], metrics_fh, indent=2)
+        if profiler:
+            profiler.dump(args.cprofile)
+    return result
+
+
+def import_packages(args, gitrepo, import_list, license_text, license_path_accept, license_path_reject, wc_cache,
+                    journal=None, git_importer=None, license_cache=None, result=None):
+    ## @brief Run the imports requested on the command line, serially or in parallel,
+    #  stopping at the first failure when run serially
+    #  @param args Parsed command line arguments
+    #  @param gitrepo Path to git repository to import to
+    #  @param import_list List of dictionaries describing each import
+    #  @param license_text List of strings containing the license text to add
+    #  @param license_path_accept Paths to force include in license file addition
+    #  @param license_path_reject Paths to exclude from license file addition
+    #  @param wc_cache SvnWorkingCopyCache to fetch through (or @c None)
+    #  @param journal ImportJournal to record each finished import in (or @c None)
+    #  @param git_importer GitFastImport to write the imports to, instead of the git checkout
+    #  (or @c None)
+    #  @param license_cache LicenseCache to look up licensed files in (or @c None)
+    #  @param result ImportResult to add the outcome of each import to
+    if result is None:
+        result = ImportResult()
+    git_imports = []
+
+    def journal_result(svn_import, error=None):
+        if journal:
+            journal.record(svn_import["svn_package"], svn_import["package"],
+                           os.path.join(svn_import["package"], svn_import["tag"]),
+                           svn_import["svn_revision"], svn_import["options"], error)
+
+    def record_result(svn_import, error=None):
+        if git_importer and not error:
+            # The import is only finished once the commit is written
+            git_imports.append(svn_import)
+        else:
+            journal_result(svn_import, error)
+
+    def commit_git_import():
+        if git_importer:
+            commit_git_branch(gitrepo, git_importer, [ svn_import["svn_package"] for svn_import in git_imports ],
+                              args.git_branch, args.revision, args.update_worktree)
+            for svn_import in git_imports:
+                journal_result(svn_import)
+
+    if args.jobs > 1:
+        results = parallel_import(args.svnroot, gitrepo, import_list, args.jobs,
+                                  revision=args.revision,
+                                  license_text=license_text,
+                                  license_path_accept=license_path_accept,
+                                  license_path_reject=license_path_reject,
+                                  svn_export=not args.svn_checkout,
+                                  wc_cache=wc_cache, sync=args.sync, on_result=record_result,
+                                  git_importer=git_importer, license_cache=license_cache,
+                                  svn_prefilter=args.prefilter)
+        commit_git_import()
+        failed = [ svn_package for svn_package, error in results if error ]
+        for svn_import, (svn_package, error) in zip(import_list, results):
+            if svn_import["metrics"]:
+                svn_import["metrics"].status = "failed" if error else "ok"
+            result.add(svn_import, "failed" if error else "ok", error)
+        print "Import summary:"
+        for svn_package, error in results:
+            print "  {0:40s} {1}".format(svn_package, "OK" if error is None else "FAILED ({0})".format(error))
+        if failed:
+            logger.error("Failed to import {0} of {1} packages: {2}. Usually this is caused by a failure "
+                         "to checkout from SVN, meaning you specified a package tag that does not exist, "
+                         "or even a package that does not exist. See --help for how to specify what "
+                         "to import.".format(len(failed), len(results), " ".join(failed)))
+            result.exit_code = 1
+    else:
+        if args.replay:
+            replay = SvnTagReplay(args.svnroot, gitrepo, import_list[0]["package"],
+                                  svn_path_accept=import_list[0]["svn_path_accept"],
+                                  svn_path_reject=import_list[0]["svn_path_reject"],
+                                  revision=args.revision, license_text=license_text,
+                                  license_path_accept=license_path_accept,
+                                  license_path_reject=license_path_reject, license_cache=license_cache)
+        else:
+            replay = None
+        try:
+            for svn_import in import_list:
+                svn_package = svn_import["svn_package"]
+                if svn_import["metrics"]:
+                    svn_import["metrics"].status = "failed"
+                with activate_metrics(svn_import["metrics"]):
+                    if replay:
+                        replay.import_tag(svn_import["tag"])
+                    else:
+                        if args.delta and svn_import["full_clobber"]:
+                            import_function = svn_delta_import
+                            extra_args = {}
+                        else:
+                            import_function = svn_co_tag_and_commit
+                            extra_args = {"full_clobber": svn_import["full_clobber"], "git_importer": git_importer}
+                        import_function(args.svnroot, gitrepo, svn_import["package"], svn_import["tag"],
+                                        svn_path_accept=svn_import["svn_path_accept"],
+                                        svn_path_reject=svn_import["svn_path_reject"],
+                                        revision=args.revision,
+                                        license_text=license_text,
+                                        license_path_accept=license_path_accept,
+                                        license_path_reject=license_path_reject,
+                                        svn_export=not args.svn_checkout,
+                                        wc_cache=wc_cache,
+                                        sync=args.sync,
+                                        license_cache=license_cache,
+                                        svn_prefilter=args.prefilter,
+                                        **extra_args)
+                if svn_import["metrics"]:
+                    svn_import["metrics"].status = "ok"
+                record_result(svn_import)
+                result.add(svn_import, "ok")
+        except RuntimeError as e:
+            record_result(svn_import, e)
+            result.add(svn_import, "failed", e)
+            for svn_import in import_list[import_list.index(svn_import) + 1:]:
+                result.add(svn_import, "not run")
+            commit_git_import()
+            logger.error("Got a RuntimeError raised when processing package {0} ({1}). "
+                         "Usually this is caused by a failure to checkout from SVN, meaning you "
+                         "specified a package tag that does not exist, or even a package that "
+                         "does not exist. See --help for how to specify what to import.".format(svn_package, e))
+            result.exit_code = 1
+            return result
+        finally:
+            if replay:
+                replay.close()
+        commit_git_import()
+    return result
+
+
+def commit_git_branch(gitrepo, git_importer, svn_packages, branch, revision=None, update_worktree=False):
+    ## @brief Write the commit of a git fast-import of SVN packages and, if asked, apply it
+    #  to the index and working tree
+    #  @param gitrepo Path to git repository
+    #  @param git_importer GitFastImport holding the imported packages
+    #  @param svn_packages SVN package specifiers that were imported
+    #  @param branch Branch the commit is written to
+    #  @param revision SVN revision number imported (0 or @c None for HEAD)
+    #  @param update_worktree If @c True then update the index and working tree to the commit
+    summary = "Import {0} from SVN".format(" ".join(svn_packages) if len(svn_packages) <= 3
+                                           else "{0} packages".format(len(svn_packages)))
+    message = "{0}\n\nImported SVN paths{1}:\n{2}\n".format(
+        summary, " at revision {0}".format(revision) if revision else "",
+        "\n".join("  {0}".format(os.path.join(package, tag)) for package, tag, package_files, full_clobber
+                  in git_importer.packages))
+    commit = git_importer.commit(message)
+    if not commit:
+        return
+    print "Committed the import to branch {0} as {1}".format(branch, commit[:12])
+    if update_worktree:
+        subprocess.check_call(["git", "read-tree", "-m", "-u"] +
+                              ([git_importer.parent] if git_importer.parent else []) + [commit], cwd=gitrepo)
+    else:
+        try:
+            head_ref = subprocess.check_output(["git", "symbolic-ref", "-q", "HEAD"], cwd=gitrepo).strip()
+        except subprocess.CalledProcessError:
+            head_ref = None
+        if head_ref == git_importer.ref:
+            logger.warning("Branch {0} is checked out, but the import was not applied to the index and working "
+                           "tree; use 'git read-tree -m -u {1} {2}' to do so".format(branch, git_importer.parent,
+                                                                                commit))
+
+
+if __name__ == '__main__':
+    main()